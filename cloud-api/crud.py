@@ -2,8 +2,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
 from models import Resident, ResidentStatus, Card, RefusedCard, ChargingCost, ChargingProfile, ProfileType, ProfileStatus
 from schemas import ResidentBase, CardBase, ChargingCostBase, ChargingProfileCreate, ChargingProfileUpdate
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from typing import List, Optional
+from bisect import bisect_right
+import threading
 
 def get_residents(db: Session, skip: int = 0, limit: int = 100):
     # Only return non-deleted residents
@@ -53,9 +55,24 @@ def create_card(db: Session, card: CardBase):
     db.refresh(db_card)
     return db_card
 
-def log_refused_card(db: Session, rfid: str, station_id: str):
-    refused_card = RefusedCard(rfid=rfid, station_id=station_id)
-    db.add(refused_card)
+def log_refused_card(db: Session, rfid: str, station_id: str, window_minutes: int = 5):
+    """ Counts a refusal on the card's row of the last `window_minutes` at this station, or adds a row. """
+    now = datetime.utcnow()
+    refused_card = (
+        db.query(RefusedCard)
+        .filter(
+            RefusedCard.rfid == rfid,
+            RefusedCard.station_id == station_id,
+            RefusedCard.last_seen >= now - timedelta(minutes=window_minutes)
+        )
+        .order_by(RefusedCard.last_seen.desc())
+        .first()
+    )
+    if refused_card:
+        refused_card.count += 1
+        refused_card.last_seen = now
+    else:
+        db.add(RefusedCard(rfid=rfid, station_id=station_id, last_seen=now))
     db.commit()
 
 def update_card_name(db: Session, rfid: str, name: str):
@@ -95,6 +112,7 @@ def create_charging_cost(db: Session, kwh_price: float, start_date: date) -> Cha
     )
     db.add(new_cost)
     db.commit()
+    invalidate_tariff_timeline()
     db.refresh(new_cost)
     return new_cost
 
@@ -113,8 +131,60 @@ def get_active_charging_cost_at_date(db: Session, target_date: datetime) -> Char
         (ChargingCost.end_date.is_(None)) | (ChargingCost.end_date > target_date_only)
     ).order_by(ChargingCost.created.desc()).first()
 
-def calculate_power_log_costs(db: Session, power_logs: list) -> list:
-    """Calculate costs for power logs based on active charging cost at the time"""
+class TariffTimeline:
+    """
+    The charging costs as sorted validity intervals, so the price on a date is a
+    bisect instead of a query. A cost applies to the dates before its end_date,
+    like the end_date filter of get_active_charging_cost_at_date; the cost
+    without end_date applies from the last end_date on.
+    """
+
+    def __init__(self, costs: List[ChargingCost]):
+        ended = sorted((cost for cost in costs if cost.end_date is not None), key=lambda cost: (cost.end_date, cost.created or datetime.min))
+        active = [cost for cost in costs if cost.end_date is None]
+        self.end_dates = [cost.end_date for cost in ended]
+        self.prices = [float(cost.kwh_price) for cost in ended]
+        # Normally there is one active cost; the newest wins, like get_active_charging_cost_at_date
+        self.active_price = float(max(active, key=lambda cost: (cost.created or datetime.min, cost.id)).kwh_price) if active else None
+
+    @classmethod
+    def load(cls, db: Session) -> "TariffTimeline":
+        return cls(db.query(ChargingCost).all())
+
+    def price_at(self, target_date: date) -> Optional[float]:
+        """The kWh price on a date, or None when there was no charging cost then."""
+        index = bisect_right(self.end_dates, target_date)
+        if index < len(self.prices):
+            return self.prices[index]
+        return self.active_price
+
+_tariff_timeline: Optional[TariffTimeline] = None
+_tariff_timeline_generation = 0
+_tariff_timeline_lock = threading.Lock()
+
+def get_tariff_timeline(db: Session) -> TariffTimeline:
+    """The tariff timeline, loaded once and kept until the charging costs change."""
+    global _tariff_timeline
+    with _tariff_timeline_lock:
+        timeline = _tariff_timeline
+        generation = _tariff_timeline_generation
+    if timeline is None:
+        timeline = TariffTimeline.load(db)
+        with _tariff_timeline_lock:
+            # Not when the costs changed during the load: it may have read them before the change
+            if _tariff_timeline_generation == generation:
+                _tariff_timeline = timeline
+    return timeline
+
+def invalidate_tariff_timeline():
+    """Reload the tariff timeline on its next use; call after writing charging costs."""
+    global _tariff_timeline, _tariff_timeline_generation
+    with _tariff_timeline_lock:
+        _tariff_timeline = None
+        _tariff_timeline_generation += 1
+
+def calculate_power_log_costs(db: Session, power_logs: list, timeline: Optional[TariffTimeline] = None) -> list:
+    """Calculate costs for power logs based on the charging cost active at the time, from the tariff timeline"""
     from models import PowerLog
     import logging
     
@@ -126,22 +196,12 @@ def calculate_power_log_costs(db: Session, power_logs: list) -> list:
     # Sort power logs by timestamp to calculate deltas correctly
     sorted_logs = sorted(power_logs, key=lambda x: x.created)
     
-    # Get all unique dates from power logs to batch fetch charging costs
-    dates = set()
-    for log in sorted_logs:
-        dates.add(log.created.date())
-    
-    # Get charging costs for all relevant dates
-    charging_costs = {}
-    for date in dates:
-        cost = get_active_charging_cost_at_date(db, datetime.combine(date, datetime.min.time()))
-        if cost:
-            charging_costs[date] = float(cost.kwh_price)
+    if timeline is None:
+        timeline = get_tariff_timeline(db)
     
     # Calculate costs for each power log
     for i, log in enumerate(sorted_logs):
-        log_date = log.created.date()
-        kwh_rate = charging_costs.get(log_date, 0.0)
+        kwh_rate = timeline.price_at(log.created.date()) or 0.0
         log.kwh_rate = float(kwh_rate)
         
         # Calculate delta energy (difference from previous log)
@@ -13,11 +13,13 @@ engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Enable foreign key constraints for SQLite
+# Enable foreign key constraints for SQLite, and wait for the station controller's
+# writes instead of failing with "database is locked"
 @event.listens_for(engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA busy_timeout=5000")
     cursor.close()
 
 # Define the declarative base for models
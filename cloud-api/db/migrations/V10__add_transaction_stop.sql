@@ -0,0 +1,7 @@
+-- Store what StartTransaction and StopTransaction report, so a transaction is closed with its final figures
+ALTER TABLE charge_transactions ADD COLUMN connector_id INTEGER;
+ALTER TABLE charge_transactions ADD COLUMN meter_start INTEGER;
+ALTER TABLE charge_transactions ADD COLUMN meter_stop INTEGER;
+ALTER TABLE charge_transactions ADD COLUMN stopped DATETIME;
+ALTER TABLE charge_transactions ADD COLUMN stop_reason TEXT;
+ALTER TABLE charge_transactions ADD COLUMN energy_delivered_kwh REAL;
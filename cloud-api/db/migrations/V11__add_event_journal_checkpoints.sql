@@ -0,0 +1,5 @@
+-- Last event of the station controller's event journal that has been applied to the database
+CREATE TABLE event_journal_checkpoints (
+    journal TEXT PRIMARY KEY,
+    sequence INTEGER NOT NULL
+);
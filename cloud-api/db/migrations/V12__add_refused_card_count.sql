@@ -0,0 +1,6 @@
+-- Repeated refusals of a card at a station are collapsed into one row
+ALTER TABLE refused_cards ADD COLUMN count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE refused_cards ADD COLUMN last_seen DATETIME;
+UPDATE refused_cards SET last_seen = created;
+
+CREATE INDEX idx_refused_cards_last_seen ON refused_cards(last_seen);
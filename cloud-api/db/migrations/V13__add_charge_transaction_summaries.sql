@@ -0,0 +1,116 @@
+-- Energy and cost per charge transaction, so transaction lists don't need every power log.
+-- Kept up to date by triggers: a new power log adds its energy increase and cost, and
+-- all summaries are recomputed when the charging costs change.
+CREATE TABLE charge_transaction_summaries (
+    charge_transaction_id INTEGER PRIMARY KEY,
+    started DATETIME NOT NULL,        -- First power log
+    ended DATETIME NOT NULL,          -- Last power log
+    sample_count INTEGER NOT NULL,
+    anomaly_count INTEGER NOT NULL,   -- Power logs with less energy than the one before
+    energy_kwh REAL NOT NULL,         -- Sum of the energy increases
+    cost REAL NOT NULL,
+    kwh_rate REAL,                    -- Price per kWh of the last power log
+    last_energy_kwh REAL NOT NULL,    -- Energy of the last power log, to compute the next increase
+    FOREIGN KEY (charge_transaction_id) REFERENCES charge_transactions (id) ON DELETE CASCADE
+);
+
+-- Every power log with its energy increase and the price per kWh on its date: the cost without
+-- an end_date, or the one with the earliest end_date after that date (as crud.TariffTimeline)
+CREATE VIEW power_log_costs AS
+SELECT
+    p.id,
+    p.charge_transaction_id,
+    p.created,
+    p.energy_kwh,
+    COALESCE(p.energy_kwh - LAG(p.energy_kwh) OVER (PARTITION BY p.charge_transaction_id ORDER BY p.created, p.id), p.energy_kwh) AS delta_energy_kwh,
+    COALESCE((
+        SELECT c.kwh_price FROM charging_costs c
+        WHERE c.end_date IS NULL OR c.end_date > date(p.created)
+        ORDER BY c.end_date IS NULL, c.end_date, c.created DESC
+        LIMIT 1
+    ), 0) AS kwh_rate,
+    ROW_NUMBER() OVER (PARTITION BY p.charge_transaction_id ORDER BY p.created DESC, p.id DESC) AS from_last
+FROM power_logs p;
+
+-- The summaries computed from all power logs, in the columns of charge_transaction_summaries
+CREATE VIEW charge_transaction_summary_rows AS
+SELECT
+    charge_transaction_id,
+    MIN(created) AS started,
+    MAX(created) AS ended,
+    COUNT(*) AS sample_count,
+    SUM(delta_energy_kwh < 0) AS anomaly_count,
+    SUM(MAX(delta_energy_kwh, 0)) AS energy_kwh,
+    SUM(MAX(delta_energy_kwh, 0) * kwh_rate) AS cost,
+    MAX(CASE WHEN from_last = 1 THEN kwh_rate END) AS kwh_rate,
+    MAX(CASE WHEN from_last = 1 THEN energy_kwh END) AS last_energy_kwh
+FROM power_log_costs
+GROUP BY charge_transaction_id;
+
+INSERT INTO charge_transaction_summaries SELECT * FROM charge_transaction_summary_rows;
+
+-- Power logs arrive in order, so a new one only adds its increase over the last one
+CREATE TRIGGER power_logs_summary_insert AFTER INSERT ON power_logs
+BEGIN
+    INSERT INTO charge_transaction_summaries (
+        charge_transaction_id, started, ended, sample_count, anomaly_count, energy_kwh, cost, kwh_rate, last_energy_kwh
+    )
+    SELECT NEW.charge_transaction_id, NEW.created, NEW.created, 1, NEW.energy_kwh < 0, MAX(NEW.energy_kwh, 0), MAX(NEW.energy_kwh, 0) * rate.kwh_rate,
+           rate.kwh_rate, NEW.energy_kwh
+    FROM (
+        SELECT COALESCE((
+            SELECT c.kwh_price FROM charging_costs c
+            WHERE c.end_date IS NULL OR c.end_date > date(NEW.created)
+            ORDER BY c.end_date IS NULL, c.end_date, c.created DESC
+            LIMIT 1
+        ), 0) AS kwh_rate
+    ) AS rate
+    WHERE true
+    ON CONFLICT (charge_transaction_id) DO UPDATE SET
+        ended = excluded.ended,
+        sample_count = sample_count + 1,
+        anomaly_count = anomaly_count + (excluded.last_energy_kwh < last_energy_kwh),
+        energy_kwh = energy_kwh + MAX(excluded.last_energy_kwh - last_energy_kwh, 0),
+        cost = cost + MAX(excluded.last_energy_kwh - last_energy_kwh, 0) * excluded.kwh_rate,
+        kwh_rate = excluded.kwh_rate,
+        last_energy_kwh = excluded.last_energy_kwh;
+END;
+
+-- Recomputed from the transaction's own power logs: SQLite doesn't push the filter through the
+-- GROUP BY of charge_transaction_summary_rows, which would read all power logs
+CREATE TRIGGER power_logs_summary_delete AFTER DELETE ON power_logs
+BEGIN
+    DELETE FROM charge_transaction_summaries WHERE charge_transaction_id = OLD.charge_transaction_id;
+    INSERT INTO charge_transaction_summaries
+    SELECT
+        charge_transaction_id,
+        MIN(created),
+        MAX(created),
+        COUNT(*),
+        SUM(delta_energy_kwh < 0),
+        SUM(MAX(delta_energy_kwh, 0)),
+        SUM(MAX(delta_energy_kwh, 0) * kwh_rate),
+        MAX(CASE WHEN from_last = 1 THEN kwh_rate END),
+        MAX(CASE WHEN from_last = 1 THEN energy_kwh END)
+    FROM power_log_costs
+    WHERE charge_transaction_id = OLD.charge_transaction_id
+    GROUP BY charge_transaction_id;
+END;
+
+CREATE TRIGGER charging_costs_summary_insert AFTER INSERT ON charging_costs
+BEGIN
+    DELETE FROM charge_transaction_summaries;
+    INSERT INTO charge_transaction_summaries SELECT * FROM charge_transaction_summary_rows;
+END;
+
+CREATE TRIGGER charging_costs_summary_update AFTER UPDATE OF kwh_price, end_date ON charging_costs
+BEGIN
+    DELETE FROM charge_transaction_summaries;
+    INSERT INTO charge_transaction_summaries SELECT * FROM charge_transaction_summary_rows;
+END;
+
+CREATE TRIGGER charging_costs_summary_delete AFTER DELETE ON charging_costs
+BEGIN
+    DELETE FROM charge_transaction_summaries;
+    INSERT INTO charge_transaction_summaries SELECT * FROM charge_transaction_summary_rows;
+END;
@@ -0,0 +1,11 @@
+-- Keyset pagination reads the listings newest first on (created, id): an index range from
+-- the cursor instead of counting off the skipped rows
+CREATE INDEX idx_power_logs_created_id ON power_logs (created, id);
+CREATE INDEX idx_charge_transactions_created_id ON charge_transactions (created, id);
+
+-- A resident's transactions, by the rfids of their cards
+CREATE INDEX idx_charge_transactions_rfid_created_id ON charge_transactions (rfid, created, id);
+
+-- Refused cards are listed on (last_seen, id)
+DROP INDEX idx_refused_cards_last_seen;
+CREATE INDEX idx_refused_cards_last_seen_id ON refused_cards (last_seen, id);
@@ -0,0 +1,19 @@
+-- Indexes for the filters of the routes that still scanned their table
+
+-- A resident's cards (my_cards and the per-resident transaction listings)
+CREATE INDEX idx_cards_resident_id ON cards (resident_id);
+
+-- Account activation by invite token (login tokens have had an index since V2)
+CREATE INDEX idx_residents_invite_token ON residents (invite_token);
+
+-- The latest refused card at a station (add_card), and the row a new refusal of a card at a
+-- station is collapsed into (log_refused_card)
+CREATE INDEX idx_refused_cards_station_id_last_seen ON refused_cards (station_id, last_seen);
+CREATE INDEX idx_refused_cards_rfid_station_id_last_seen ON refused_cards (rfid, station_id, last_seen);
+
+-- A transaction's power logs in order, for its chart and the summary triggers (V13)
+DROP INDEX idx_power_logs_charge_transaction_id;
+CREATE INDEX idx_power_logs_charge_transaction_id_created_id ON power_logs (charge_transaction_id, created, id);
+
+-- Replaced by idx_charge_transactions_rfid_created_id (V14)
+DROP INDEX ix_charge_transactions_rfid;
@@ -61,9 +61,16 @@ class ChargeTransaction(Base):
     rfid = Column(String, ForeignKey("cards.rfid"), nullable=False)
     created = Column(DateTime(timezone=True), server_default=func.now())
     final_energy_kwh = Column(Float, nullable=True)
+    connector_id = Column(Integer, nullable=True)
+    meter_start = Column(Integer, nullable=True)  # Wh, as sent in StartTransaction
+    meter_stop = Column(Integer, nullable=True)   # Wh, as sent in StopTransaction
+    stopped = Column(DateTime(timezone=True), nullable=True)
+    stop_reason = Column(String, nullable=True)
+    energy_delivered_kwh = Column(Float, nullable=True)
 
     card = relationship("Card", back_populates="charge_transactions")
     power_logs = relationship("PowerLog", back_populates="charge_transaction")
+    summary = relationship("ChargeTransactionSummary", uselist=False, viewonly=True)
 
 class PowerLog(Base):
     __tablename__ = "power_logs"
@@ -76,6 +83,20 @@ class PowerLog(Base):
 
     charge_transaction = relationship("ChargeTransaction", back_populates="power_logs")
 
+class ChargeTransactionSummary(Base):
+    """Energy and cost of a transaction's power logs, maintained by database triggers (V13)."""
+    __tablename__ = "charge_transaction_summaries"
+
+    charge_transaction_id = Column(Integer, ForeignKey("charge_transactions.id"), primary_key=True)
+    started = Column(DateTime(timezone=True), nullable=False)  # First power log
+    ended = Column(DateTime(timezone=True), nullable=False)    # Last power log
+    sample_count = Column(Integer, nullable=False)
+    anomaly_count = Column(Integer, nullable=False)            # Power logs with less energy than the one before
+    energy_kwh = Column(Float, nullable=False)
+    cost = Column(Float, nullable=False)
+    kwh_rate = Column(Float, nullable=True)                    # Price per kWh of the last power log
+    last_energy_kwh = Column(Float, nullable=False)
+
 class RefusedCard(Base):
     __tablename__ = "refused_cards"
 
@@ -83,6 +104,8 @@ class RefusedCard(Base):
     rfid = Column(String, nullable=False)
     station_id = Column(String, nullable=False)
     created = Column(DateTime(timezone=True), server_default=func.now())
+    count = Column(Integer, nullable=False, default=1)       # Refusals collapsed into this row
+    last_seen = Column(DateTime(timezone=True), nullable=True)  # Time of the latest of them
 
 class ChargingCost(Base):
     __tablename__ = "charging_costs"
@@ -107,5 +130,8 @@ class ChargingCost(Base):
         if active_cost:
             active_cost.end_date = end_date
             db_session.commit()
+            # Imported here, crud imports this module
+            from crud import invalidate_tariff_timeline
+            invalidate_tariff_timeline()
             return active_cost
         return None
\ No newline at end of file
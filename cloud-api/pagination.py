@@ -0,0 +1,45 @@
+import base64
+import json
+from typing import Optional
+from fastapi import HTTPException, Response
+from sqlalchemy import String, tuple_, type_coerce
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(time: str, id: int) -> str:
+    """Opaque cursor for the rows after the one with this (time, id) key."""
+    return base64.urlsafe_b64encode(json.dumps([time, id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        time, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(time, str) or not isinstance(id, int):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return time, id
+
+def paginate(query, time_column, id_column, response: Response, skip: int = 0,
+             limit: Optional[int] = 100, cursor: Optional[str] = None):
+    """
+    One page of `query`, newest first on (time_column, id_column), e.g. (created, id).
+    With a cursor, the page starts after the row it was made from (an index range, however
+    deep the page); without one at `skip`. When the page is full, the cursor of the next
+    page is sent in the X-Next-Cursor header.
+    """
+    # The key is compared as it is stored: a datetime parameter would not match the format
+    # of CURRENT_TIMESTAMP defaults
+    time = type_coerce(time_column, String)
+    if cursor:
+        query = query.filter(tuple_(time, id_column) < tuple_(*decode_cursor(cursor)))
+    query = query.add_columns(time, id_column).order_by(time_column.desc(), id_column.desc())
+    if skip and not cursor:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+
+    if limit is not None and rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1][-2], rows[-1][-1])
+    # Without the key columns, as the query would have returned them
+    return [row[0] if len(row) == 3 else tuple(row[:-2]) for row in rows]
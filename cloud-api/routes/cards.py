@@ -1,11 +1,13 @@
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Security, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Security, Depends, Response
 from sqlalchemy.orm import Session
 from schemas import CardResponse, CardBase, CardUpdate
 from models import Card, RefusedCard, Resident
 from crud import get_cards, create_card, log_refused_card, update_card_name
 from dependencies import get_db_dependency, get_authenticated_active_resident
 from security import verify_api_key
+from pagination import paginate
 
 router = APIRouter(prefix="/cards", tags=["cards"])
 
@@ -51,7 +53,7 @@ def add_card(station_id: str, db: Session = Depends(get_db_dependency), _: Resid
     latest_refused_card_by_station = (
         db.query(RefusedCard)
         .filter(RefusedCard.station_id == station_id)
-        .order_by(RefusedCard.created.desc())
+        .order_by(RefusedCard.last_seen.desc())
         .first()
     )
     if not latest_refused_card_by_station:
@@ -81,23 +83,35 @@ def get_my_cards(db: Session = Depends(get_db_dependency), _: Resident = Depends
 
 @router.get("/refused")
 def list_refused_cards(
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db_dependency), 
     _: Resident = Depends(get_authenticated_active_resident)
 ):
-    """ Returns distinct refused cards from the last 5 minutes, ordered by created descending. Requires cookie-based authentication. """
+    """ Returns the cards refused in the last 5 minutes, one per card and station, most recent first.
+    Pages of `limit`, the next one with the X-Next-Cursor header as `cursor`. Requires cookie-based authentication. """
     five_minutes_ago = datetime.utcnow() - timedelta(minutes=5)
-    refused_cards = (
-        db.query(RefusedCard)
-        .filter(RefusedCard.created >= five_minutes_ago)
-        .order_by(RefusedCard.created.desc())
-        .distinct(RefusedCard.rfid)
-        .all()
+    # Repeated swipes are collapsed into one row by the station controller
+    refused_cards = paginate(
+        db.query(RefusedCard).filter(RefusedCard.last_seen >= five_minutes_ago),
+        RefusedCard.last_seen, RefusedCard.id, response,
+        limit=limit, cursor=cursor
     )
     
-    if not refused_cards:
+    if not refused_cards and not cursor:
         raise HTTPException(status_code=404, detail="No refused cards found")
     
-    return {"refused_cards": refused_cards}
+    return {"refused_cards": [
+        {
+            "id": refused_card.id,
+            "rfid": refused_card.rfid,
+            "station_id": refused_card.station_id,
+            "timestamp": refused_card.last_seen,
+            "count": refused_card.count
+        }
+        for refused_card in refused_cards
+    ]}
 
 @router.put("/{rfid}/name", response_model=CardResponse)
 def update_card_name_endpoint(
@@ -1,32 +1,42 @@
-from fastapi import APIRouter, HTTPException, Security, Depends
-from sqlalchemy.orm import Session, joinedload
-from typing import List
-from schemas import ChargeTransactionResponse
-from models import ChargeTransaction, Card, Resident
+from fastapi import APIRouter, HTTPException, Security, Depends, Response
+from sqlalchemy.orm import Session, joinedload, selectinload, noload
+from typing import List, Optional
+from schemas import ChargeTransactionResponse, PowerLogResponse
+from models import ChargeTransaction, Card, Resident, PowerLog
 from dependencies import get_db_dependency, get_authenticated_active_resident
 from security import verify_api_key
+from pagination import paginate
 
 from crud import calculate_power_log_costs
 
 router = APIRouter(prefix="/charge-transactions", tags=["charge-transactions"])
 
+def transaction_load_options(include_power_logs: bool):
+    """Load the summary with the transactions; the power logs only when asked for, in one extra query."""
+    if include_power_logs:
+        return [joinedload(ChargeTransaction.summary), selectinload(ChargeTransaction.power_logs)]
+    return [joinedload(ChargeTransaction.summary), noload(ChargeTransaction.power_logs)]
+
 @router.get("/", response_model=List[ChargeTransactionResponse])
 def get_all_transactions(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
+    cursor: Optional[str] = None,
+    include_power_logs: bool = False,
     db: Session = Depends(get_db_dependency),
     _: str = Security(verify_api_key)
 ):
     """
-    Get all charge transactions with their related power logs.
+    Get all charge transactions with their energy and cost summary, and their
+    power logs with include_power_logs=true. Newest first; pass the X-Next-Cursor
+    header of a page as `cursor` to get the next one.
     Requires API key authentication.
     """
-    transactions = (
-        db.query(ChargeTransaction)
-        .options(joinedload(ChargeTransaction.power_logs))
-        .offset(skip)
-        .limit(limit)
-        .all()
+    transactions = paginate(
+        db.query(ChargeTransaction).options(*transaction_load_options(include_power_logs)),
+        ChargeTransaction.created, ChargeTransaction.id, response,
+        skip=skip, limit=limit, cursor=cursor
     )
     
     return transactions
@@ -34,13 +44,16 @@ def get_all_transactions(
 @router.get("/resident/{resident_id}", response_model=List[ChargeTransactionResponse])
 def get_transactions_by_resident(
     resident_id: int,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
+    cursor: Optional[str] = None,
+    include_power_logs: bool = False,
     db: Session = Depends(get_db_dependency),
     _: str = Security(verify_api_key)
 ):
     """
-    Get all charge transactions for a specific resident (by resident_id).
+    Get all charge transactions for a specific resident (by resident_id), newest first.
     Requires API key authentication.
     """
     # First verify the resident exists
@@ -57,13 +70,12 @@ def get_transactions_by_resident(
     rfid_list = [card.rfid for card in resident_cards]
     
     # Get transactions for all cards of this resident
-    transactions = (
+    transactions = paginate(
         db.query(ChargeTransaction)
         .filter(ChargeTransaction.rfid.in_(rfid_list))
-        .options(joinedload(ChargeTransaction.power_logs))
-        .offset(skip)
-        .limit(limit)
-        .all()
+        .options(*transaction_load_options(include_power_logs)),
+        ChargeTransaction.created, ChargeTransaction.id, response,
+        skip=skip, limit=limit, cursor=cursor
     )
     
     # Calculate costs for power logs
@@ -75,8 +87,11 @@ def get_transactions_by_resident(
 
 @router.get("/my-transactions", response_model=List[ChargeTransactionResponse])
 def get_my_transactions(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
+    cursor: Optional[str] = None,
+    include_power_logs: bool = False,
     db: Session = Depends(get_db_dependency),
     _: Resident = Depends(get_authenticated_active_resident)
 ):
@@ -92,69 +107,78 @@ def get_my_transactions(
     # Get RFID values for all cards of this resident
     rfid_list = [card.rfid for card in resident_cards]
     
-    # Get transactions for all cards of this resident, ordered by ID desc
-    transactions = (
+    # Get transactions for all cards of this resident, newest first
+    transactions = paginate(
         db.query(ChargeTransaction)
         .filter(ChargeTransaction.rfid.in_(rfid_list))
-        .options(joinedload(ChargeTransaction.power_logs))
-        .order_by(ChargeTransaction.id.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+        .options(*transaction_load_options(include_power_logs)),
+        ChargeTransaction.created, ChargeTransaction.id, response,
+        skip=skip, limit=limit, cursor=cursor
     )
     
-    # Calculate costs for power logs and add card names
+    # Calculate costs for power logs and add card names (the cards are already loaded)
+    card_names = {card.rfid: card.name for card in resident_cards}
     for transaction in transactions:
         if transaction.power_logs:
             calculate_power_log_costs(db, transaction.power_logs)
         
-        card = db.query(Card).filter(Card.rfid == transaction.rfid).first()
-        if card:
-            transaction.card_name = card.name
+        if transaction.rfid in card_names:
+            transaction.card_name = card_names[transaction.rfid]
     
     return transactions 
 
 @router.get("/all")
 def get_all_charge_transactions(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_power_logs: bool = False,
     db: Session = Depends(get_db_dependency),
     _: Resident = Depends(get_authenticated_active_resident)
 ):
     """
-    Get all charge transactions with resident information and power logs for cost calculation.
+    Get all charge transactions with resident information and their energy and cost
+    summary; with include_power_logs=true also the power logs with their costs.
+    Newest first; all of them, or pages of `limit` with the X-Next-Cursor header as `cursor`.
     Requires cookie-based authentication for management access.
     """
-    # Get all charge transactions with power logs and resident information
-    transactions = (
-        db.query(ChargeTransaction)
-        .options(joinedload(ChargeTransaction.power_logs))
+    # Get all charge transactions with their summary and their resident's name in
+    # one query, and the power logs of all of them (when asked for) in a second one
+    rows = paginate(
+        db.query(ChargeTransaction, Resident.full_name)
         .join(Card, ChargeTransaction.rfid == Card.rfid)
         .join(Resident, Card.resident_id == Resident.id)
-        .order_by(ChargeTransaction.created.desc())
-        .all()
+        .options(*transaction_load_options(include_power_logs)),
+        ChargeTransaction.created, ChargeTransaction.id, response,
+        limit=limit, cursor=cursor
     )
     
     # Calculate costs for power logs and convert to dictionary format
     result = []
-    for transaction in transactions:
+    for transaction, resident_name in rows:
         # Calculate costs for power logs
         if transaction.power_logs:
             calculate_power_log_costs(db, transaction.power_logs)
         
-        # Get resident name
-        resident_name = None
-        card = db.query(Card).filter(Card.rfid == transaction.rfid).first()
-        if card:
-            resident = db.query(Resident).filter(Resident.id == card.resident_id).first()
-            if resident:
-                resident_name = resident.full_name
-        
         result.append({
             "id": transaction.id,
             "station_id": transaction.station_id,
             "rfid": transaction.rfid,
             "created": transaction.created.isoformat() if transaction.created else None,
             "final_energy_kwh": float(transaction.final_energy_kwh) if transaction.final_energy_kwh else 0,
+            "stopped": transaction.stopped.isoformat() if transaction.stopped else None,
+            "stop_reason": transaction.stop_reason,
+            "energy_delivered_kwh": transaction.energy_delivered_kwh,
             "resident_name": resident_name,
+            "summary": {
+                "started": transaction.summary.started.isoformat(),
+                "ended": transaction.summary.ended.isoformat(),
+                "sample_count": transaction.summary.sample_count,
+                "anomaly_count": transaction.summary.anomaly_count,
+                "energy_kwh": transaction.summary.energy_kwh,
+                "cost": transaction.summary.cost,
+                "kwh_rate": transaction.summary.kwh_rate
+            } if transaction.summary else None,
             "power_logs": [
                 {
                     "id": log.id,
@@ -166,4 +190,31 @@ def get_all_charge_transactions(
             ]
         })
     
-    return result 
\ No newline at end of file
+    return result
+
+@router.get("/my-transactions/{transaction_id}/power-logs", response_model=List[PowerLogResponse])
+def get_my_transaction_power_logs(
+    transaction_id: int,
+    db: Session = Depends(get_db_dependency),
+    _: Resident = Depends(get_authenticated_active_resident)
+):
+    """
+    Get the power logs, with their costs, of one charge transaction of the currently authenticated resident.
+    Requires cookie-based authentication.
+    """
+    transaction = (
+        db.query(ChargeTransaction)
+        .join(Card, ChargeTransaction.rfid == Card.rfid)
+        .filter(ChargeTransaction.id == transaction_id, Card.resident_id == _.id)
+        .first()
+    )
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Charge transaction not found")
+    
+    power_logs = (
+        db.query(PowerLog)
+        .filter(PowerLog.charge_transaction_id == transaction.id)
+        .order_by(PowerLog.created)
+        .all()
+    )
+    return calculate_power_log_costs(db, power_logs)
@@ -1,33 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from dependencies import get_db_dependency, get_authenticated_active_resident
 from models import PowerLog, Resident
 from schemas import PowerLogResponse
+from pagination import paginate
 
 router = APIRouter(prefix="/power-logs", tags=["power-logs"])
 
 @router.get("/", response_model=List[PowerLogResponse])
 def get_power_logs(
+    response: Response,
     skip: int = 0,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db_dependency),
     _: Resident = Depends(get_authenticated_active_resident)
 ):
     """
-    Get PowerLog data with pagination.
+    Get PowerLog data with pagination, newest first. Pass the X-Next-Cursor header of a
+    page as `cursor` to get the next one; `skip` still works but gets slower for deep pages.
     Requires cookie-based authentication for management access.
     """
     try:
-        power_logs = (
-            db.query(PowerLog)
-            .order_by(PowerLog.created.desc())
-            .offset(skip)
-            .limit(limit)
-            .all()
+        power_logs = paginate(
+            db.query(PowerLog), PowerLog.created, PowerLog.id, response,
+            skip=skip, limit=limit, cursor=cursor
         )
         
         return power_logs
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving PowerLog data: {str(e)}")
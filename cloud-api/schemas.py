@@ -34,6 +34,7 @@ class RefusedCardBase(BaseModel):
 class RefusedCardResponse(RefusedCardBase):
     id: int
     timestamp: datetime
+    count: int = 1
 
     class Config:
         from_attributes = True
@@ -52,6 +53,18 @@ class PowerLogResponse(PowerLogBase):
     class Config:
         from_attributes = True
 
+class ChargeTransactionSummaryResponse(BaseModel):
+    started: datetime
+    ended: datetime
+    sample_count: int
+    anomaly_count: int
+    energy_kwh: float
+    cost: float
+    kwh_rate: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
 class ChargeTransactionBase(BaseModel):
     station_id: str
     rfid: str
@@ -60,7 +73,14 @@ class ChargeTransactionResponse(ChargeTransactionBase):
     id: int
     created: datetime
     final_energy_kwh: Optional[float] = None
-    power_logs: List[PowerLogResponse] = []
+    connector_id: Optional[int] = None
+    meter_start: Optional[int] = None
+    meter_stop: Optional[int] = None
+    stopped: Optional[datetime] = None
+    stop_reason: Optional[str] = None
+    energy_delivered_kwh: Optional[float] = None
+    summary: Optional[ChargeTransactionSummaryResponse] = None
+    power_logs: List[PowerLogResponse] = []  # Only with include_power_logs=true
     card_name: Optional[str] = None
 
     class Config:
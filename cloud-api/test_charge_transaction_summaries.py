@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compares the charge transaction summaries that the V13 triggers maintain with
+the costs crud.calculate_power_log_costs computes from the power logs: after
+inserting power logs (including a first log with energy already on the meter
+and a meter that goes back), after a tariff change and after deleting logs.
+
+Run: python3 test_charge_transaction_summaries.py   (or with pytest)
+"""
+import math
+import sys
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import sessionmaker
+
+from models import Resident, ResidentStatus, Card, ChargeTransaction, ChargeTransactionSummary, PowerLog
+from testing import create_migrated_engine
+import crud
+
+# Energy readings (kWh) of each transaction, one power log every 6 hours from its start
+TRANSACTIONS = [
+    (datetime(2025, 1, 3, 20, 0), [5.0, 7.5, 9.0, 12.0, 12.0, 15.5]),   # First log at 5 kWh, across the tariff change
+    (datetime(2025, 1, 4, 8, 0), [0.0, 2.0, 1.5, 3.0, 6.0]),            # The meter goes back once
+    (datetime(2025, 1, 6, 9, 0), [3.25]),                               # A single power log
+]
+
+def expected_summary(db, power_logs):
+    """The summary of a transaction's power logs, from calculate_power_log_costs."""
+    crud.invalidate_tariff_timeline()
+    logs = sorted(crud.calculate_power_log_costs(db, power_logs), key=lambda log: log.created)
+    deltas = [logs[0].energy_kwh] + [log.energy_kwh - previous.energy_kwh for previous, log in zip(logs, logs[1:])]
+    return {
+        "started": logs[0].created,
+        "ended": logs[-1].created,
+        "sample_count": len(logs),
+        "anomaly_count": sum(1 for delta in deltas if delta < 0),
+        "energy_kwh": sum(delta for delta in deltas if delta > 0),
+        "cost": sum(log.delta_power_cost for log in logs),
+        "kwh_rate": logs[-1].kwh_rate,
+        "last_energy_kwh": logs[-1].energy_kwh,
+    }
+
+def compare(db, step):
+    failures = []
+    db.expire_all()
+    for transaction in db.query(ChargeTransaction).order_by(ChargeTransaction.id).all():
+        power_logs = db.query(PowerLog).filter(PowerLog.charge_transaction_id == transaction.id).all()
+        summary = db.query(ChargeTransactionSummary).filter(ChargeTransactionSummary.charge_transaction_id == transaction.id).first()
+        if not power_logs:
+            if summary is not None:
+                failures.append(f"{step}: transaction {transaction.id} has a summary without power logs")
+            continue
+        if summary is None:
+            failures.append(f"{step}: transaction {transaction.id} has no summary")
+            continue
+        for field, expected in expected_summary(db, power_logs).items():
+            actual = getattr(summary, field)
+            matches = math.isclose(actual, expected, abs_tol=1e-9) if isinstance(expected, float) else actual == expected
+            if not matches:
+                failures.append(f"{step}: transaction {transaction.id} {field} is {actual}, expected {expected}")
+        print(f"{step:<24} transaction {transaction.id}: {summary.sample_count} logs, {summary.energy_kwh:.2f} kWh, {summary.cost:.4f}")
+    return failures
+
+def test_summaries_match_power_log_costs():
+    engine = create_migrated_engine()
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        crud.create_charging_cost(db, 0.20, date(2025, 1, 1))
+        resident = Resident(full_name="Resident", email="resident@example.com", status=ResidentStatus.ACTIVE)
+        db.add(resident)
+        db.flush()
+        db.add(Card(rfid="CARD", name="Card", resident_id=resident.id))
+        for started, readings in TRANSACTIONS:
+            transaction = ChargeTransaction(station_id="STATION", rfid="CARD", created=started)
+            db.add(transaction)
+            db.flush()
+            for number, energy_kwh in enumerate(readings):
+                # One commit per power log, so the insert trigger adds them one at a time
+                db.add(PowerLog(charge_transaction_id=transaction.id, created=started + timedelta(hours=6 * number),
+                                power_kw=7.0, energy_kwh=energy_kwh))
+                db.commit()
+
+        failures = compare(db, "Power logs inserted")
+
+        # The old price gets end_date January 4, so the new one applies from the first transaction's second log
+        crud.create_charging_cost(db, 0.35, date(2025, 1, 5))
+        failures += compare(db, "Tariff changed")
+
+        # The log after the meter went back, and the only log of a transaction
+        for power_log in db.query(PowerLog).filter(PowerLog.energy_kwh.in_([1.5, 3.25])).all():
+            db.delete(power_log)
+        db.commit()
+        failures += compare(db, "Power logs deleted")
+    finally:
+        db.close()
+    assert not failures, "Summaries differ from calculate_power_log_costs:\n" + "\n".join(failures)
+
+if __name__ == "__main__":
+    try:
+        test_summaries_match_power_log_costs()
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Counts the SQL statements of the charge transaction endpoints, on an in-memory
+database seeded with few and with many transactions. Fails when an endpoint
+issues more statements for more transactions (an N+1 query).
+
+Run: python3 test_query_counts.py   (or with pytest)
+"""
+import sys
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import sessionmaker
+
+from models import Resident, ResidentStatus, Card, ChargeTransaction, PowerLog
+from routes import charge_transactions
+from testing import create_migrated_engine, create_client as create_test_client, record_statements
+import crud
+
+SMALL = 3
+LARGE = 30
+LOGS_PER_TRANSACTION = 5
+
+ENDPOINTS = [
+    "/charge-transactions/",
+    "/charge-transactions/resident/1",
+    "/charge-transactions/my-transactions",
+    "/charge-transactions/all",
+    "/charge-transactions/?include_power_logs=true",
+    "/charge-transactions/resident/1?include_power_logs=true",
+    "/charge-transactions/my-transactions?include_power_logs=true",
+    "/charge-transactions/all?include_power_logs=true",
+]
+
+def create_client(transactions_per_card):
+    """A test client for the charge transaction routes on a new in-memory database, with its triggers."""
+    engine = create_migrated_engine()
+    SessionTest = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionTest()
+    crud.create_charging_cost(db, 0.25, date(2025, 1, 1))
+    for number in range(2):
+        resident = Resident(full_name=f"Resident {number}", email=f"resident{number}@example.com", status=ResidentStatus.ACTIVE)
+        db.add(resident)
+        db.flush()
+        for card_number in range(2):
+            card = Card(rfid=f"CARD{number}{card_number}", name=f"Card {card_number}", resident_id=resident.id)
+            db.add(card)
+            for transaction_number in range(transactions_per_card):
+                started = datetime(2025, 1, 1) + timedelta(days=transaction_number)
+                transaction = ChargeTransaction(station_id="STATION", rfid=card.rfid, created=started)
+                db.add(transaction)
+                db.flush()
+                for log_number in range(LOGS_PER_TRANSACTION):
+                    db.add(PowerLog(charge_transaction_id=transaction.id, created=started + timedelta(minutes=log_number),
+                                    power_kw=7.0, energy_kwh=log_number * 0.5))
+    db.commit()
+    db.close()
+
+    return create_test_client(engine, [charge_transactions.router]), engine
+
+def count_statements(client, engine, path):
+    """Number of SQL statements executed for one request."""
+    # Every request loads the tariffs again, as after a restart
+    crud.invalidate_tariff_timeline()
+    with record_statements(engine) as statements:
+        response = client.get(path)
+    assert response.status_code == 200, f"{path}: {response.status_code} {response.text}"
+    return len(statements), len(response.json())
+
+def test_query_counts_do_not_grow():
+    small_client, small_engine = create_client(SMALL)
+    large_client, large_engine = create_client(LARGE)
+    failures = []
+    for path in ENDPOINTS:
+        small, small_rows = count_statements(small_client, small_engine, path)
+        large, large_rows = count_statements(large_client, large_engine, path)
+        print(f"{path:<62} {small:>3} statements for {small_rows:>3} transactions, {large:>3} for {large_rows:>3}")
+        if large > small:
+            failures.append(f"{path}: {small} statements for {small_rows} transactions, {large} for {large_rows}")
+    assert not failures, "Query count grows with the number of transactions:\n" + "\n".join(failures)
+
+if __name__ == "__main__":
+    try:
+        test_query_counts_do_not_grow()
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    print("OK")
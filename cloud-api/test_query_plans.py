@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Runs EXPLAIN QUERY PLAN on every statement the routes issue, on an in-memory
+database built from the Flyway migrations and seeded with transactions, power
+logs and refused cards, and on the statements of the power_logs triggers. Fails
+when a query does a full scan of a table that grows with use, so a missing or
+dropped index shows up here.
+
+Run: python3 test_query_plans.py   (or with pytest)
+"""
+import re
+import sys
+from datetime import datetime, timedelta
+
+from routes import residents, cards, charge_transactions, power_logs, charging_costs, charging_profiles
+from testing import create_migrated_engine, create_client as create_test_client, record_statements
+
+# Tables that grow with every charge or card swipe; the others hold a few rows of configuration
+HOT_TABLES = {"power_logs", "charge_transactions", "charge_transaction_summaries", "refused_cards", "cards", "residents"}
+
+ALLOWED_SCANS = {
+    # Listings of all rows of a table
+    ("GET", "/residents/", "residents"),
+    ("GET", "/cards/", "cards"),
+    ("GET", "/charge-transactions/all", "charge_transactions"),
+    # An offset reads the rows it skips; deeper pages are read with the cursor
+    ("GET", "/charge-transactions/?skip=20", "charge_transactions"),
+}
+
+REQUESTS = [
+    ("GET", "/residents/"),
+    ("GET", "/residents/1"),
+    ("POST", "/residents/activate/unknown-token"),
+    ("GET", "/cards/"),
+    ("GET", "/cards/my_cards"),
+    ("GET", "/cards/authenticate/UNKNOWN?station_id=STATION0"),
+    ("GET", "/cards/refused"),
+    ("POST", "/cards/add_card/STATION1"),
+    ("GET", "/charge-transactions/"),
+    ("GET", "/charge-transactions/?skip=20"),
+    ("GET", "/charge-transactions/resident/1"),
+    ("GET", "/charge-transactions/my-transactions?include_power_logs=true"),
+    ("GET", "/charge-transactions/all"),
+    ("GET", "/charge-transactions/my-transactions/1/power-logs"),
+    ("GET", "/power-logs/?limit=50"),
+    ("GET", "/charging-costs/"),
+    ("GET", "/charging-costs/active"),
+    ("GET", "/charging-profiles/"),
+]
+
+def seed(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO charging_costs (kwh_price) VALUES (0.25)")
+        started = datetime(2025, 1, 1)
+        for number in range(2):
+            cursor.execute("INSERT INTO residents (full_name, email, status) VALUES (?, ?, 'ACTIVE')",
+                           (f"Resident {number}", f"resident{number}@example.com"))
+            resident_id = cursor.lastrowid
+            for card_number in range(2):
+                rfid = f"CARD{number}{card_number}"
+                cursor.execute("INSERT INTO cards (rfid, name, resident_id) VALUES (?, ?, ?)", (rfid, rfid, resident_id))
+                for transaction_number in range(50):
+                    created = started + timedelta(hours=transaction_number)
+                    cursor.execute("INSERT INTO charge_transactions (station_id, rfid, created) VALUES ('STATION0', ?, ?)",
+                                   (rfid, created.strftime("%Y-%m-%d %H:%M:%S")))
+                    transaction_id = cursor.lastrowid
+                    cursor.executemany(
+                        "INSERT INTO power_logs (charge_transaction_id, created, power_kw, energy_kwh) VALUES (?, ?, 7.0, ?)",
+                        [(transaction_id, (created + timedelta(minutes=log)).strftime("%Y-%m-%d %H:%M:%S"), log * 0.5)
+                         for log in range(20)]
+                    )
+        for number in range(200):
+            cursor.execute("INSERT INTO refused_cards (rfid, station_id, created, last_seen) VALUES (?, ?, ?, ?)",
+                           (f"REFUSED{number}", f"STATION{number % 4}", started, started + timedelta(minutes=number)))
+        connection.commit()
+    finally:
+        connection.close()
+
+def create_client():
+    """A test client for all routes on a new seeded in-memory database."""
+    engine = create_migrated_engine()
+    seed(engine)
+    routers = [module.router for module in (residents, cards, charge_transactions, power_logs, charging_costs, charging_profiles)]
+    return create_test_client(engine, routers), engine
+
+def request_statements(client, engine, method, path):
+    """The statements executed for one request, with their parameters."""
+    with record_statements(engine) as statements:
+        response = client.request(method, path)
+    assert response.status_code < 500, f"{method} {path}: {response.status_code} {response.text}"
+    return statements
+
+def trigger_statements(engine, table):
+    """
+    The statements in the bodies of the triggers on the table, as stored in the database,
+    with the NEW and OLD columns as parameters, and the values of a row of the table.
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        triggers = cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,)).fetchall()
+        cursor.execute(f"SELECT * FROM {table} LIMIT 1")
+        row = dict(zip([column[0] for column in cursor.description], cursor.fetchone()))
+    finally:
+        connection.close()
+
+    statements = []
+    for name, sql in triggers:
+        body = re.search(r"\bBEGIN\b(.*)\bEND\b", sql, re.IGNORECASE | re.DOTALL).group(1)
+        for statement in body.split(";"):
+            if statement.strip():
+                statements.append((name, re.sub(r"\b(?:NEW|OLD)\.(\w+)", r":\1", statement.strip()), row))
+    return statements
+
+def full_scans(engine, statement, parameters=()):
+    """The tables the statement reads entirely, with or without an index."""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        plan = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        views = [sql for (sql,) in cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'view'")]
+    finally:
+        connection.close()
+
+    # The plan names tables by their alias, also the ones inside views
+    tables_by_alias = {}
+    for sql in [statement] + views:
+        for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+            tables_by_alias[alias or table] = table
+
+    # A scan of an index in the order of the ORDER BY stops at the LIMIT and reads a page,
+    # not the table; unless an offset makes it read the skipped rows first. SQLAlchemy
+    # renders "LIMIT ? OFFSET ?" for every limit, with 0 when there is no offset.
+    offset = re.search(r"\bOFFSET\s+(\?|\d+)\s*$", statement, re.IGNORECASE)
+    reads_page = (re.search(r"\bORDER BY\b", statement, re.IGNORECASE)
+                  and re.search(r"\bLIMIT\b", statement, re.IGNORECASE)
+                  and not (offset and int(parameters[-1] if offset.group(1) == "?" else offset.group(1)))
+                  and not any(detail.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in detail for _, _, _, detail in plan))
+    tables = set()
+    for _, _, _, detail in plan:
+        match = re.match(r"SCAN (\w+)( USING .*)?$", detail)
+        if match and not (match.group(2) and reads_page):
+            tables.add(tables_by_alias.get(match.group(1), match.group(1)))
+    return tables & HOT_TABLES
+
+def test_hot_paths_use_indexes():
+    client, engine = create_client()
+    failures = []
+    for method, path in REQUESTS:
+        statements = request_statements(client, engine, method, path)
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            for table in full_scans(engine, statement, parameters):
+                if (method, path, table) not in ALLOWED_SCANS:
+                    failures.append(f"{method} {path}: full scan of {table} in\n    {' '.join(statement.split())}")
+        print(f"{method:<4} {path:<62} {len(statements):>3} statements")
+
+    # The cursor of a full page continues with an index range too
+    response = client.get("/power-logs/?limit=50")
+    next_page = f"/power-logs/?limit=50&cursor={response.headers['X-Next-Cursor']}"
+    for statement, parameters in request_statements(client, engine, "GET", next_page):
+        for table in full_scans(engine, statement, parameters):
+            failures.append(f"GET {next_page}: full scan of {table}")
+
+    # The triggers run for every power log the stations send, and for every one deleted
+    for trigger, statement, parameters in trigger_statements(engine, "power_logs"):
+        for table in full_scans(engine, statement, parameters):
+            failures.append(f"Trigger {trigger}: full scan of {table} in\n    {' '.join(statement.split())}")
+        print(f"Trigger {trigger:<55} {' '.join(statement.split())[:40]}")
+    assert not failures, "Queries without an index:\n" + "\n".join(failures)
+
+if __name__ == "__main__":
+    try:
+        test_hot_paths_use_indexes()
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,77 @@
+"""
+Helpers for the test scripts (test_*.py): in-memory databases with the
+Flyway schema, and test clients for the routes on them.
+"""
+import glob
+import os
+import re
+from contextlib import contextmanager
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Resident
+from dependencies import get_db_dependency, get_authenticated_active_resident
+from security import verify_api_key
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "migrations")
+
+def create_migrated_engine():
+    """A new in-memory database with the Flyway migrations applied, including their views and triggers."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    migrate(engine)
+    return engine
+
+def migrate(engine):
+    """Applies the Flyway migrations in version order."""
+    files = sorted(glob.glob(os.path.join(MIGRATIONS, "V*__*.sql")),
+                   key=lambda path: int(re.match(r"V(\d+)__", os.path.basename(path)).group(1)))
+    connection = engine.raw_connection()
+    try:
+        for path in files:
+            with open(path) as f:
+                connection.executescript(f.read())
+        connection.commit()
+    finally:
+        connection.close()
+
+def create_client(engine, routers, resident_id=1):
+    """A test client for the routers on the database, signed in as the resident and with a valid API key."""
+    SessionTest = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_test_db():
+        db = SessionTest()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_test_resident():
+        db = SessionTest()
+        try:
+            return db.query(Resident).filter(Resident.id == resident_id).first()
+        finally:
+            db.close()
+
+    app = FastAPI()
+    for router in routers:
+        app.include_router(router)
+    app.dependency_overrides[get_db_dependency] = get_test_db
+    app.dependency_overrides[get_authenticated_active_resident] = get_test_resident
+    app.dependency_overrides[verify_api_key] = lambda: "test"
+    return TestClient(app)
+
+@contextmanager
+def record_statements(engine):
+    """Collects the (statement, parameters) the engine executes inside the block."""
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -11,8 +11,12 @@ sudo apt install certbot python3-certbot-apache -y
 
 sudo certbot --apache
 
-sudo touch /var/www/html/meter_values.json
-sudo chown ubuntu:www-data /var/www/html/meter_values.json
+# Status files written by the station controller. They are replaced atomically, so they
+# live in a directory the controller owns; meter_values.json links to the latest snapshot.
+sudo mkdir -p /var/www/html/meter_values
+sudo touch /var/www/html/meter_values/latest.json
+sudo chown -R ubuntu:www-data /var/www/html/meter_values
+sudo ln -sf /var/www/html/meter_values/latest.json /var/www/html/meter_values.json
 
 # Create management-ui directory and symbolic link for deployment
 sudo mkdir -p /var/www/html/management-ui
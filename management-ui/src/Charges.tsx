@@ -1,6 +1,6 @@
 import { useEffect, useState, useMemo } from "react";
 import { Table, Card, Spin, message } from "antd";
-import { getAllChargeTransactions, ChargeTransaction, MonthlyData, YearlySummary } from "./services/chargeTransactionService";
+import { getAllChargeTransactions, getTransactionCost, ChargeTransaction, MonthlyData, YearlySummary } from "./services/chargeTransactionService";
 
 const Charges: React.FC = () => {
   const [loading, setLoading] = useState<boolean>(true);
@@ -61,9 +61,7 @@ const Charges: React.FC = () => {
       const yearKey = `${year}-${transaction.resident_name}`;
       
       // Calculate transaction cost
-      const transactionCost = transaction.power_logs?.reduce((sum, log) => {
-        return sum + (log.delta_power_cost || 0);
-      }, 0) || 0;
+      const transactionCost = getTransactionCost(transaction);
 
       // Monthly grouping
       if (!monthlyGroups.has(monthKey)) {
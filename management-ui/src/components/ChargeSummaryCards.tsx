@@ -1,7 +1,7 @@
 import { useEffect, useState, useMemo } from "react";
 import { Card, Row, Col, Statistic, Spin, message } from "antd";
 import { ThunderboltOutlined, TransactionOutlined } from "@ant-design/icons";
-import { getAllChargeTransactions, ChargeTransaction } from "../services/chargeTransactionService";
+import { getAllChargeTransactions, getTransactionCost, ChargeTransaction } from "../services/chargeTransactionService";
 
 const ChargeSummaryCards: React.FC = () => {
   const [loading, setLoading] = useState<boolean>(true);
@@ -49,10 +49,7 @@ const ChargeSummaryCards: React.FC = () => {
     const totalEnergy = validTransactions.reduce((sum, transaction) => sum + transaction.final_energy_kwh, 0);
     const totalTransactions = validTransactions.length;
     const totalCost = validTransactions.reduce((sum, transaction) => {
-      const transactionCost = transaction.power_logs?.reduce((logSum, log) => {
-        return logSum + (log.delta_power_cost || 0);
-      }, 0) || 0;
-      return sum + transactionCost;
+      return sum + getTransactionCost(transaction);
     }, 0);
     const averageEnergy = totalTransactions > 0 ? totalEnergy / totalTransactions : 0;
 
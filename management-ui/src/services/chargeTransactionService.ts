@@ -6,7 +6,20 @@ export interface ChargeTransaction {
   rfid: string;
   created: string;
   final_energy_kwh: number;
+  stopped?: string | null;
+  stop_reason?: string | null;
+  energy_delivered_kwh?: number | null;
   resident_name: string;
+  summary?: {
+    started: string;
+    ended: string;
+    sample_count: number;
+    anomaly_count: number;
+    energy_kwh: number;
+    cost: number;
+    kwh_rate: number | null;
+  } | null;
+  // Only requested with include_power_logs=true
   power_logs?: Array<{
     id: number;
     delta_power_cost?: number;
@@ -14,6 +27,14 @@ export interface ChargeTransaction {
   }>;
 }
 
+// Cost of a transaction: from its summary, or from its power logs when they were requested
+export const getTransactionCost = (transaction: ChargeTransaction): number => {
+  if (transaction.summary) {
+    return transaction.summary.cost;
+  }
+  return transaction.power_logs?.reduce((sum, log) => sum + (log.delta_power_cost || 0), 0) || 0;
+};
+
 export interface MonthlyData {
   year: number;
   month: number;
@@ -2,10 +2,10 @@ import { useState, useEffect } from "react";
 import { Layout, Menu, message, List, Button, Table, Card, Space, Typography, Input } from "antd";
 import { HomeOutlined, ThunderboltOutlined, CheckCircleOutlined, CloseCircleOutlined, LineChartOutlined, EditOutlined } from "@ant-design/icons";
 import { API_BASE_URL } from "./config";
-import { getCurrentResidentTransactions, getAllCurrentResidentTransactions, calculateMonthlyEnergyStats, ChargeTransaction, MonthlyEnergyStats } from "./services/chargeTransactionService";
+import { getCurrentResidentTransactions, getAllCurrentResidentTransactions, calculateMonthlyEnergyStats, getTransactionCost, getPowerLogCount, ChargeTransaction, MonthlyEnergyStats } from "./services/chargeTransactionService";
 import { getMyCards, addCard, updateCardName, Card as CardType } from "./services/cardService";
 import { chargingCostService, ChargingCost } from "./services/chargingCostService";
-import PowerLogsChart from "./components/PowerLogsChart";
+import { TransactionPowerLogsChart } from "./components/PowerLogsChart";
 
 const { Content } = Layout;
 const { Text } = Typography;
@@ -255,13 +255,11 @@ const Home: React.FC = () => {
       title: 'Cost (€)',
       key: 'total_cost',
       render: (_: unknown, record: ChargeTransaction) => {
-        if (!record.power_logs || record.power_logs.length === 0) {
+        if (getPowerLogCount(record) === 0) {
           return <Text type="secondary">N/A</Text>;
         }
         
-        const totalCost = record.power_logs.reduce((sum, log) => {
-          return sum + (log.delta_power_cost || 0);
-        }, 0);
+        const totalCost = getTransactionCost(record);
         
         return (
           <Text type={totalCost > 0 ? 'success' : 'secondary'}>
@@ -289,7 +287,7 @@ const Home: React.FC = () => {
       key: 'chart',
       width: 80,
       render: (_: unknown, record: ChargeTransaction) => {
-        const hasPowerLogs = record.power_logs && record.power_logs.length > 1;
+        const hasPowerLogs = getPowerLogCount(record) > 1;
         const isExpanded = expandedRowKeys.includes(record.id);
         
         if (!hasPowerLogs) {
@@ -627,12 +625,7 @@ const Home: React.FC = () => {
                   <br />
                   <Text strong style={{ fontSize: "18px", color: "#52c41a" }}>
                     €{chargeTransactions.reduce((sum, transaction) => {
-                      if (transaction.power_logs) {
-                        return sum + transaction.power_logs.reduce((logSum, log) => {
-                          return logSum + (log.delta_power_cost || 0);
-                        }, 0);
-                      }
-                      return sum;
+                      return sum + getTransactionCost(transaction);
                     }, 0).toFixed(2)}
                   </Text>
                 </div>
@@ -652,12 +645,7 @@ const Home: React.FC = () => {
                 <div style={{ textAlign: 'right' }}>
                   <Text strong>Total Cost: €{
                     chargeTransactions.reduce((sum, transaction) => {
-                      if (transaction.power_logs) {
-                        return sum + transaction.power_logs.reduce((logSum, log) => {
-                          return logSum + (log.delta_power_cost || 0);
-                        }, 0);
-                      }
-                      return sum;
+                      return sum + getTransactionCost(transaction);
                     }, 0).toFixed(2)
                   }</Text>
                 </div>
@@ -678,13 +666,13 @@ const Home: React.FC = () => {
                     }
                   },
                   expandedRowRender: (record: ChargeTransaction) => {
-                    if (!record.power_logs || record.power_logs.length < 2) {
+                    if (getPowerLogCount(record) < 2) {
                       return null;
                     }
-                    return <PowerLogsChart powerLogs={record.power_logs} transactionId={record.id} />;
+                    return <TransactionPowerLogsChart transactionId={record.id} />;
                   },
                   rowExpandable: (record: ChargeTransaction) => {
-                    return record.power_logs && record.power_logs.length > 1;
+                    return getPowerLogCount(record) > 1;
                   },
                 }}
                 pagination={{
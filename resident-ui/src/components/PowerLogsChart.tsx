@@ -1,7 +1,7 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { Line } from '@ant-design/charts';
-import { PowerLog } from '../services/chargeTransactionService';
-import { Card, Typography } from 'antd';
+import { PowerLog, getTransactionPowerLogs } from '../services/chargeTransactionService';
+import { Card, Spin, Typography } from 'antd';
 
 const { Text } = Typography;
 
@@ -124,4 +124,32 @@ const PowerLogsChart: React.FC<PowerLogsChartProps> = ({ powerLogs, transactionI
   );
 };
 
+// Loads the power logs of a transaction when it is expanded; the transaction list only has their summary
+export const TransactionPowerLogsChart: React.FC<{ transactionId: number }> = ({ transactionId }) => {
+  const [powerLogs, setPowerLogs] = useState<PowerLog[] | null>(null);
+  const [failed, setFailed] = useState(false);
+
+  useEffect(() => {
+    getTransactionPowerLogs(transactionId)
+      .then(setPowerLogs)
+      .catch(() => setFailed(true));
+  }, [transactionId]);
+
+  if (failed) {
+    return (
+      <Card size="small" style={{ margin: '8px 0' }}>
+        <Text type="secondary">Could not load the power logs of this transaction.</Text>
+      </Card>
+    );
+  }
+  if (powerLogs === null) {
+    return (
+      <Card size="small" style={{ margin: '8px 0', textAlign: 'center' }}>
+        <Spin />
+      </Card>
+    );
+  }
+  return <PowerLogsChart powerLogs={powerLogs} transactionId={transactionId} />;
+};
+
 export default PowerLogsChart;
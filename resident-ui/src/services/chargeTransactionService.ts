@@ -17,7 +17,19 @@ export interface ChargeTransaction {
   card_name?: string;
   created: string;
   final_energy_kwh: number | null;
-  power_logs: PowerLog[];
+  summary?: ChargeTransactionSummary | null;
+  // Only with include_power_logs=true; see getTransactionPowerLogs
+  power_logs?: PowerLog[];
+}
+
+export interface ChargeTransactionSummary {
+  started: string;
+  ended: string;
+  sample_count: number;
+  anomaly_count: number;
+  energy_kwh: number;
+  cost: number;
+  kwh_rate: number | null;
 }
 
 export interface ChargeTransactionsResponse {
@@ -88,6 +100,39 @@ export const getAllCurrentResidentTransactions = async (): Promise<ChargeTransac
   }
 };
 
+export const getTransactionPowerLogs = async (transactionId: number): Promise<PowerLog[]> => {
+  try {
+    const response = await fetch(
+      `${API_BASE_URL}/charge-transactions/my-transactions/${transactionId}/power-logs`,
+      {
+        credentials: 'include',
+      }
+    );
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch power logs');
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error fetching power logs:', error);
+    throw error;
+  }
+};
+
+// Cost of a transaction: from its summary, or from its power logs when they were requested
+export const getTransactionCost = (transaction: ChargeTransaction): number => {
+  if (transaction.summary) {
+    return transaction.summary.cost;
+  }
+  return transaction.power_logs?.reduce((sum, log) => sum + (log.delta_power_cost || 0), 0) || 0;
+};
+
+// Number of power logs of a transaction
+export const getPowerLogCount = (transaction: ChargeTransaction): number => {
+  return transaction.summary?.sample_count ?? transaction.power_logs?.length ?? 0;
+};
+
 export const calculateMonthlyEnergyStats = (transactions: ChargeTransaction[]): MonthlyEnergyStats[] => {
   const monthlyStats = new Map<string, MonthlyEnergyStats>();
 
@@ -115,13 +160,8 @@ export const calculateMonthlyEnergyStats = (transactions: ChargeTransaction[]):
       stats.totalEnergy += transaction.final_energy_kwh;
       stats.transactionCount += 1;
       
-      // Calculate total cost for this transaction
-      if (transaction.power_logs) {
-        const transactionCost = transaction.power_logs.reduce((sum, log) => {
-          return sum + (log.delta_power_cost || 0);
-        }, 0);
-        stats.totalCost += transactionCost;
-      }
+      // Add the cost of this transaction
+      stats.totalCost += getTransactionCost(transaction);
     }
   });
 
@@ -0,0 +1,174 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from transaction_service import TransactionService
+from constants import ACTIVE_TRANSACTION_MAX_AGE, ACTIVE_TRANSACTION_RECENTLY_CLOSED
+
+class ActiveTransaction:
+    """ An open charging session and its latest meter readings. """
+
+    def __init__(self, transaction_id, station_id, connector_id=None, rfid=None, meter_start=None, started=None):
+        self.transaction_id = transaction_id
+        self.station_id = station_id
+        self.connector_id = connector_id  # None until the station reports it (e.g. after a restart)
+        self.rfid = rfid
+        self.meter_start = meter_start    # Wh, as sent in StartTransaction
+        self.started = started
+        self.energy_kwh = None
+        self.power_kw = None
+        self.current = None               # Highest phase current (A)
+        self.phase_currents = {}          # Current per phase (A), e.g. {"L1": 16.0} for a single-phase EV
+        self.last_timestamp = None
+
+    def to_dict(self):
+        return {
+            "transactionId": self.transaction_id,
+            "stationId": self.station_id,
+            "connectorId": self.connector_id,
+            "rfid": self.rfid,
+            "meterStart": self.meter_start,
+            "started": self.started.isoformat() if isinstance(self.started, datetime) else self.started,
+            "energyKwh": self.energy_kwh,
+            "powerKw": self.power_kw,
+            "current": self.current,
+            "phaseCurrents": self.phase_currents,
+            "timestamp": self.last_timestamp,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        started = data.get("started")
+        if isinstance(started, str):
+            started = datetime.fromisoformat(started)
+        transaction = cls(data["transactionId"], data["stationId"], data.get("connectorId"), data.get("rfid"),
+                          data.get("meterStart"), started)
+        transaction.energy_kwh = data.get("energyKwh")
+        transaction.power_kw = data.get("powerKw")
+        transaction.current = data.get("current")
+        transaction.phase_currents = data.get("phaseCurrents") or {}
+        transaction.last_timestamp = data.get("timestamp")
+        return transaction
+
+class ActiveTransactionTable:
+    """
+    In-memory table of the open transactions of all charge points, keyed by
+    transaction id, with an index by (station, connector).
+
+    StartTransaction adds a row, MeterValues update it and StopTransaction
+    removes it, so the MeterValues hot path, the load balancer and the status
+    files never have to query the database for them. The table is rebuilt from
+    the database at startup.
+    """
+
+    def __init__(self, recently_closed_size=ACTIVE_TRANSACTION_RECENTLY_CLOSED):
+        self._transactions = {}  # transaction_id -> ActiveTransaction
+        self._connectors = {}    # (station_id, connector_id) -> transaction_id
+        self._recently_closed = OrderedDict()  # transaction_id -> None, oldest first
+        self.recently_closed_size = recently_closed_size
+
+    def open(self, transaction_id, station_id, connector_id, rfid, meter_start=None, started=None):
+        # A new transaction on a connector ends whatever we still had open there
+        previous = self._connectors.get((station_id, connector_id))
+        if previous is not None and previous != transaction_id:
+            logging.info("Transaction %s on %s connector %s replaced by %s", previous, station_id, connector_id, transaction_id)
+            self.close(previous)
+
+        transaction = ActiveTransaction(transaction_id, station_id, connector_id, rfid, meter_start, started or datetime.utcnow())
+        self._transactions[transaction_id] = transaction
+        self._connectors[(station_id, connector_id)] = transaction_id
+        return transaction
+
+    def close(self, transaction_id):
+        """ Remove a transaction; returns it, or None when it wasn't open. """
+        transaction = self._remove(transaction_id)
+        if transaction is not None:
+            self._recently_closed[transaction_id] = None
+            if len(self._recently_closed) > self.recently_closed_size:
+                self._recently_closed.popitem(last=False)
+        return transaction
+
+    def _remove(self, transaction_id):
+        transaction = self._transactions.pop(transaction_id, None)
+        if transaction is not None and transaction.connector_id is not None:
+            key = (transaction.station_id, transaction.connector_id)
+            if self._connectors.get(key) == transaction_id:
+                del self._connectors[key]
+        return transaction
+
+    def get(self, transaction_id):
+        return self._transactions.get(transaction_id)
+
+    def for_connector(self, station_id, connector_id):
+        transaction_id = self._connectors.get((station_id, connector_id))
+        return self._transactions.get(transaction_id) if transaction_id is not None else None
+
+    def for_station(self, station_id):
+        return [transaction for transaction in self._transactions.values() if transaction.station_id == station_id]
+
+    def replace_station(self, station_id, transactions):
+        """ Replace the open transactions of a station with the given ones (ActiveTransaction.to_dict() format). """
+        for transaction in self.for_station(station_id):
+            self._remove(transaction.transaction_id)
+        for data in transactions:
+            transaction = ActiveTransaction.from_dict(data)
+            self._transactions[transaction.transaction_id] = transaction
+            if transaction.connector_id is not None:
+                self._connectors[(station_id, transaction.connector_id)] = transaction.transaction_id
+
+    def record_meter_values(self, transaction_id, station_id, connector_id, energy_kwh=None, power_kw=None, phase_currents=None, timestamp=None):
+        """
+        Update the latest readings of a transaction from a MeterValues request; returns
+        the transaction, or None when the readings are for one that isn't open.
+        """
+        transaction = self._transactions.get(transaction_id)
+        if transaction is None:
+            # Readings after StopTransaction (late, or queued while offline) must not reopen
+            # the transaction, nor replace the one running on the connector now. Only a
+            # transaction on an idle connector is adopted: it started before the table was
+            # built, or is too old to have been loaded.
+            if (transaction_id in self._recently_closed or connector_id is None
+                    or self.for_connector(station_id, connector_id) is not None):
+                logging.debug("MeterValues for transaction %s on %s connector %s, which isn't open: ignored", transaction_id, station_id, connector_id)
+                return None
+            logging.info("Adopting transaction %s on %s connector %s from its MeterValues", transaction_id, station_id, connector_id)
+            transaction = self.open(transaction_id, station_id, connector_id, rfid=None)
+        elif transaction.connector_id is None and connector_id is not None:
+            transaction.connector_id = connector_id
+            self._connectors[(station_id, connector_id)] = transaction_id
+
+        if energy_kwh is not None:
+            transaction.energy_kwh = energy_kwh
+        if power_kw is not None:
+            transaction.power_kw = power_kw
+        if phase_currents:
+            transaction.phase_currents = phase_currents
+            transaction.current = max(phase_currents.values())
+        if timestamp:
+            transaction.last_timestamp = timestamp
+        return transaction
+
+    def load(self, max_age=ACTIVE_TRANSACTION_MAX_AGE):
+        """
+        Rebuild the table from the database: every transaction without a stop time.
+        Transactions older than max_age are skipped, as their StopTransaction may
+        have been lost (or they predate stop times being stored).
+        """
+        since = datetime.utcnow() - timedelta(seconds=max_age)
+        self._transactions = {}
+        self._connectors = {}
+        for transaction in TransactionService.get_open_transactions(since):
+            self._transactions[transaction.id] = ActiveTransaction(
+                transaction.id, transaction.station_id, transaction.connector_id, transaction.rfid,
+                transaction.meter_start, transaction.created
+            )
+            if transaction.connector_id is not None:
+                self._connectors[(transaction.station_id, transaction.connector_id)] = transaction.id
+        logging.info("Loaded %s open transactions into the active transaction table", len(self._transactions))
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __iter__(self):
+        return iter(list(self._transactions.values()))
+
+active_transactions = ActiveTransactionTable()
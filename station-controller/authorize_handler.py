@@ -2,8 +2,6 @@ import logging
 from ocpp.v16 import call_result
 from rfid_manager import RFIDManager
 
-logging.basicConfig(level=logging.INFO)
-
 class AuthorizeHandler:
     """ Handles authorization based on an RFID whitelist stored in a CSV file. """
 
@@ -12,9 +10,9 @@ class AuthorizeHandler:
 
     async def on_authorize(self, id_tag, station_id=None):
         """ Handle the Authorize event from the OCPP server. """
-        if self.rfid_manager.is_authorized(id_tag, station_id):
-            logging.info(f"Authorization successful for RFID {id_tag}")
+        if await self.rfid_manager.is_authorized(id_tag, station_id):
+            logging.info("Authorization successful for RFID %s", id_tag)
             return call_result.AuthorizePayload(id_tag_info={"status": "Accepted"})
         else:
-            logging.info(f"Unauthorized RFID attempt: {id_tag}")
+            logging.info("Unauthorized RFID attempt: %s", id_tag)
             return call_result.AuthorizePayload(id_tag_info={"status": "Rejected"})
\ No newline at end of file
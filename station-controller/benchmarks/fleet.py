@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Load generator and throughput benchmark for the station controller.
+
+Starts the controller (main.main()) in a child process on a temporary database and
+connects N simulated OCPP 1.6 charge points to its websocket server on localhost.
+Every station sends a BootNotification and then keeps charging: Authorize,
+StartTransaction, MeterValues every --meter-interval seconds, StopTransaction, a
+short pause, and again. Heartbeats run alongside.
+
+Reported:
+- messages/s: completed CALL -> CALLRESULT round-trips per second
+- p50/p95/p99 latency per action, measured by the simulated stations
+- event-loop lag of the controller process (how late a 100 ms timer fires)
+- SQLite write rate: rows added to the database per second
+
+Usage:
+    python3 benchmarks/fleet.py [--stations 100] [--duration 60] [--meter-interval 5]
+    python3 benchmarks/fleet.py --url ws://controller:9000   # against a running controller
+    python3 benchmarks/fleet.py --workers 4                  # controller with 4 worker processes (lag: supervisor only)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import websockets
+
+CONTROLLER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTROLLER_URL = "ws://127.0.0.1:9000"
+COUNTED_TABLES = ["charge_transactions", "power_logs", "refused_cards"]
+LAG_SAMPLE_INTERVAL = 0.1
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def station_id(number):
+    return f"BENCH{number:04d}"
+
+def rfid(number):
+    return f"BENCHCARD{number:04d}"
+
+# Controller process
+
+def run_controller(directory, stations, workers, ready, stop, results):
+    """Runs main.main(), or the Supervisor with `workers` > 1, on a temporary database and reports the event-loop lag when stopped."""
+    sys.path.insert(0, CONTROLLER_DIRECTORY)
+
+    # Point the controller at the temporary directory before any module reads the constants
+    import constants
+    constants.DB_FILE = os.path.join(directory, "bench.db")
+    constants.METER_ARCHIVE_DIRECTORY = os.path.join(directory, "archive") + "/"
+    constants.TIMESERIES_DIRECTORY = os.path.join(directory, "timeseries") + "/"
+    constants.EVENT_JOURNAL_DIRECTORY = os.path.join(directory, "journal") + "/"
+    constants.STATUS_JSON = os.path.join(directory, "meter_values.json")
+    constants.STATUS_STATIONS_DIRECTORY = os.path.join(directory, "meter_values") + "/"
+    constants.LOAD_BALANCING_ENABLED = False
+    os.makedirs(constants.STATUS_STATIONS_DIRECTORY, exist_ok=True)
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    from database import engine, SessionLocal
+    from models import Base, Card, Resident, ResidentStatus
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        for number in range(stations):
+            resident = Resident(full_name=f"Resident {number}", email=f"resident{number}@example.com", status=ResidentStatus.ACTIVE)
+            db.add(resident)
+            db.flush()
+            db.add(Card(rfid=rfid(number), resident_id=resident.id))
+        db.commit()
+    finally:
+        db.close()
+
+    import main
+    supervisor = None
+    if workers > 1:
+        from workers import Supervisor
+        supervisor = Supervisor(workers)
+        supervisor.spawn()
+
+    async def measure_lag(lags):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_SAMPLE_INTERVAL
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lags.append((loop.time() - expected) * 1000)
+
+    async def serve():
+        lags = []
+        server = asyncio.create_task(supervisor.run() if supervisor else main.main())
+        sampler = asyncio.create_task(measure_lag(lags))
+        await asyncio.sleep(0.5)
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        sampler.cancel()
+        server.cancel()
+        await asyncio.gather(sampler, server, return_exceptions=True)
+        return lags
+
+    results.put(asyncio.run(serve()))
+
+def count_rows(database_file):
+    connection = sqlite3.connect(database_file)
+    try:
+        return {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in COUNTED_TABLES}
+    finally:
+        connection.close()
+
+# Simulated charge points
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # action -> round-trip times (ms)
+        self.errors = defaultdict(int)      # action -> CALLERRORs and timeouts
+        self.server_calls = 0               # CALLs sent by the controller, e.g. SetChargingProfile
+        self.disconnects = 0
+
+class SimulatedChargePoint:
+    """One OCPP 1.6 station over a raw websocket, answering every CALL from the controller."""
+
+    def __init__(self, number, url, stats, args):
+        self.number = number
+        self.id = station_id(number)
+        self.url = f"{url.rstrip('/')}/{self.id}"
+        self.stats = stats
+        self.args = args
+        self.energy_wh = 0
+        self._ids = itertools.count(1)
+        self._waiting = {}  # unique id -> future for the response
+        self._websocket = None
+
+    async def call(self, action, payload):
+        unique_id = str(next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[unique_id] = future
+        start = time.perf_counter()
+        await self._websocket.send(json.dumps([2, unique_id, action, payload]))
+        try:
+            message = await asyncio.wait_for(future, timeout=self.args.timeout)
+        except asyncio.TimeoutError:
+            self.stats.errors[action] += 1
+            return None
+        finally:
+            self._waiting.pop(unique_id, None)
+        if message[0] != 3:
+            self.stats.errors[action] += 1
+            return None
+        self.stats.latencies[action].append((time.perf_counter() - start) * 1000)
+        return message[2]
+
+    async def _receive(self):
+        async for raw in self._websocket:
+            message = json.loads(raw)
+            if message[0] == 2:
+                self.stats.server_calls += 1
+                # The simulated stations have no local authorization list
+                payload = {"listVersion": -1} if message[2] == "GetLocalListVersion" else {"status": "Accepted"}
+                await self._websocket.send(json.dumps([3, message[1], payload]))
+            else:
+                future = self._waiting.get(message[1])
+                if future and not future.done():
+                    future.set_result(message)
+
+    async def _heartbeats(self):
+        while True:
+            await asyncio.sleep(self.args.heartbeat_interval)
+            await self.call("Heartbeat", {})
+
+    async def _charge(self, deadline):
+        """Back-to-back charging sessions until the deadline."""
+        loop = asyncio.get_running_loop()
+        while loop.time() < deadline:
+            result = await self.call("Authorize", {"idTag": rfid(self.number)})
+            if result is None:
+                await asyncio.sleep(self.args.meter_interval)
+                continue
+
+            result = await self.call("StartTransaction", {
+                "connectorId": 1, "idTag": rfid(self.number), "meterStart": self.energy_wh, "timestamp": now()
+            })
+            if result is None:
+                await asyncio.sleep(self.args.meter_interval)
+                continue
+            transaction_id = result["transactionId"]
+
+            session_end = min(deadline, loop.time() + self.args.session_length)
+            while loop.time() < session_end:
+                await asyncio.sleep(self.args.meter_interval)
+                self.energy_wh += int(7400 * self.args.meter_interval / 3600)
+                await self.call("MeterValues", {
+                    "connectorId": 1, "transactionId": transaction_id, "meterValue": [meter_value(self.energy_wh)]
+                })
+
+            await self.call("StopTransaction", {
+                "transactionId": transaction_id, "idTag": rfid(self.number), "meterStop": self.energy_wh,
+                "timestamp": now(), "reason": "Local"
+            })
+            await asyncio.sleep(random.uniform(0, self.args.meter_interval))
+
+    async def run(self, start_at, deadline):
+        await asyncio.sleep(max(0.0, start_at - asyncio.get_running_loop().time()))
+        try:
+            async with websockets.connect(self.url, subprotocols=["ocpp1.6"], open_timeout=self.args.timeout) as websocket:
+                self._websocket = websocket
+                receiver = asyncio.create_task(self._receive())
+                await self.call("BootNotification", {
+                    "chargePointVendor": "Bench", "chargePointModel": "Simulated", "chargePointSerialNumber": self.id
+                })
+                heartbeats = asyncio.create_task(self._heartbeats())
+                try:
+                    await self._charge(deadline)
+                finally:
+                    heartbeats.cancel()
+                    receiver.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            self.stats.disconnects += 1
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+def meter_value(energy_wh):
+    return {
+        "timestamp": now(),
+        "sampledValue": [
+            {"value": f"{energy_wh / 1000:.3f}", "measurand": "Energy.Active.Import.Register", "unit": "kWh"},
+            {"value": "7.4", "measurand": "Power.Active.Import", "unit": "kW"},
+            {"value": "10.7", "measurand": "Current.Import", "phase": "L1", "unit": "A"},
+            {"value": "10.7", "measurand": "Current.Import", "phase": "L2", "unit": "A"},
+            {"value": "10.7", "measurand": "Current.Import", "phase": "L3", "unit": "A"},
+            {"value": "230.1", "measurand": "Voltage", "phase": "L1-N", "unit": "V"},
+        ]
+    }
+
+async def run_fleet(args):
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + args.ramp + args.duration
+    stations = [SimulatedChargePoint(number, args.url, stats, args) for number in range(args.stations)]
+    await asyncio.gather(*(
+        station.run(start + args.ramp * number / args.stations, deadline)
+        for number, station in enumerate(stations)
+    ))
+    return stats, loop.time() - start
+
+# Report
+
+def report(args, stats, elapsed, lags, rows_written):
+    completed = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"{args.stations} stations, {elapsed:.1f}s, meter interval {args.meter_interval}s")
+    print(f"messages/s: {completed / elapsed:.1f} ({completed} round-trips, {sum(stats.errors.values())} errors, "
+          f"{stats.server_calls} controller calls, {stats.disconnects} failed connections)")
+    print()
+    print(f"{'action':<18} {'count':>7} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for action in sorted(set(stats.latencies) | set(stats.errors)):
+        latencies = stats.latencies.get(action) or [0.0]
+        print(
+            f"{action:<18} {len(stats.latencies.get(action, [])):>7} {stats.errors.get(action, 0):>7} "
+            f"{statistics.median(latencies):>7.1f}ms {percentile(latencies, 95):>7.1f}ms {percentile(latencies, 99):>7.1f}ms"
+        )
+    if lags:
+        print()
+        print(f"event-loop lag: p50 {statistics.median(lags):.1f}ms, p95 {percentile(lags, 95):.1f}ms, "
+              f"p99 {percentile(lags, 99):.1f}ms, max {max(lags):.1f}ms")
+    if rows_written is not None:
+        total = sum(rows_written.values())
+        detail = ", ".join(f"{table} {count}" for table, count in rows_written.items())
+        print(f"SQLite writes: {total / elapsed:.1f} rows/s ({detail})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stations", type=int, default=100, help="Number of simulated charge points")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run after all stations connected")
+    parser.add_argument("--ramp", type=float, default=5, help="Seconds over which the stations connect")
+    parser.add_argument("--meter-interval", type=float, default=5, help="Seconds between MeterValues")
+    parser.add_argument("--session-length", type=float, default=30, help="Seconds per charging session")
+    parser.add_argument("--heartbeat-interval", type=float, default=30, help="Seconds between Heartbeats")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a CALLRESULT")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the controller")
+    parser.add_argument("--url", help="Benchmark a controller that is already running, e.g. ws://host:9000")
+    args = parser.parse_args()
+
+    controller = None
+    if args.url is None:
+        args.url = CONTROLLER_URL
+        directory = tempfile.mkdtemp(prefix="fleet-bench-")
+        context = multiprocessing.get_context("spawn")
+        ready, stop, results = context.Event(), context.Event(), context.Queue()
+        controller = context.Process(target=run_controller, args=(directory, args.stations, args.workers, ready, stop, results))
+        controller.start()
+        if not ready.wait(30):
+            controller.terminate()
+            sys.exit("The station controller did not start")
+        database_file = os.path.join(directory, "bench.db")
+        rows_before = count_rows(database_file)
+
+    try:
+        stats, elapsed = asyncio.run(run_fleet(args))
+    finally:
+        lags = None
+        rows_written = None
+        if controller:
+            stop.set()
+            lags = results.get(timeout=30)
+            controller.join(30)
+            rows_after = count_rows(database_file)
+            rows_written = {table: rows_after[table] - rows_before[table] for table in COUNTED_TABLES}
+
+    report(args, stats, elapsed, lags, rows_written)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the SQLite engine configuration of the station controller.
+
+Compares the default SQLite settings with the tuned PRAGMAs from database.py on a
+temporary database: power log inserts per second (one commit per insert, as the
+services do) and Authorize lookup latency. Optionally a reader thread queries the
+database concurrently, like the cloud API does, to show "database is locked" errors.
+
+Usage:
+    python3 benchmarks/sqlite_profile.py [--inserts 2000] [--lookups 2000] [--concurrent-reader]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from database import create_sqlite_engine, SQLITE_PRAGMAS
+from models import Base, Card, Resident, ResidentStatus, ChargeTransaction, PowerLog
+
+PROFILES = {
+    "default": {},
+    "tuned": SQLITE_PRAGMAS,
+}
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def seed(Session, cards):
+    db = Session()
+    try:
+        for i in range(cards):
+            resident = Resident(full_name=f"Resident {i}", email=f"resident{i}@example.com", status=ResidentStatus.ACTIVE)
+            db.add(resident)
+            db.flush()
+            db.add(Card(rfid=f"RFID{i:06d}", resident_id=resident.id))
+        transaction = ChargeTransaction(station_id="BENCH", rfid="RFID000000")
+        db.add(transaction)
+        db.commit()
+        return transaction.id
+    finally:
+        db.close()
+
+def bench_inserts(Session, transaction_id, count):
+    errors = 0
+    start = time.perf_counter()
+    for i in range(count):
+        db = Session()
+        try:
+            db.add(PowerLog(charge_transaction_id=transaction_id, power_kw=7.4, energy_kwh=i / 100))
+            db.commit()
+        except OperationalError:
+            errors += 1
+            db.rollback()
+        finally:
+            db.close()
+    return count / (time.perf_counter() - start), errors
+
+def bench_lookups(Session, cards, count):
+    latencies = []
+    for i in range(count):
+        rfid = f"RFID{i % cards:06d}"
+        start = time.perf_counter()
+        db = Session()
+        try:
+            db.query(Card).join(Resident).filter(Card.rfid == rfid, Resident.status == ResidentStatus.ACTIVE).first()
+        finally:
+            db.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def concurrent_reader(engine, stop, counters):
+    """Reads the power logs like the cloud API's transaction endpoints."""
+    while not stop.is_set():
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT COUNT(*), MAX(energy_kwh) FROM power_logs")).fetchone()
+            counters["reads"] += 1
+        except OperationalError:
+            counters["errors"] += 1
+
+def run_profile(name, pragmas, args):
+    directory = tempfile.mkdtemp(prefix="sqlite-bench-")
+    url = "sqlite:///" + os.path.join(directory, "bench.db")
+    engine = create_sqlite_engine(url, pragmas=pragmas)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(engine)
+    transaction_id = seed(Session, args.cards)
+
+    stop = threading.Event()
+    counters = {"reads": 0, "errors": 0}
+    reader = None
+    if args.concurrent_reader:
+        # The reader uses its own engine with default settings, like a separate process would
+        reader_engine = create_sqlite_engine(url, pragmas={})
+        reader = threading.Thread(target=concurrent_reader, args=(reader_engine, stop, counters), daemon=True)
+        reader.start()
+
+    try:
+        inserts_per_second, insert_errors = bench_inserts(Session, transaction_id, args.inserts)
+        latencies = bench_lookups(Session, args.cards, args.lookups)
+    finally:
+        stop.set()
+        if reader:
+            reader.join()
+        engine.dispose()
+
+    return {
+        "profile": name,
+        "inserts_per_second": inserts_per_second,
+        "insert_errors": insert_errors,
+        "lookup_p50_ms": statistics.median(latencies),
+        "lookup_p95_ms": percentile(latencies, 95),
+        "lookup_p99_ms": percentile(latencies, 99),
+        "reader_reads": counters["reads"],
+        "reader_errors": counters["errors"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inserts", type=int, default=2000, help="Power log inserts per profile")
+    parser.add_argument("--lookups", type=int, default=2000, help="Authorize lookups per profile")
+    parser.add_argument("--cards", type=int, default=200, help="Cards in the seeded database")
+    parser.add_argument("--concurrent-reader", action="store_true", help="Query the database from a second connection meanwhile")
+    args = parser.parse_args()
+
+    results = [run_profile(name, pragmas, args) for name, pragmas in PROFILES.items()]
+
+    print(f"{'profile':<10} {'inserts/s':>10} {'ins.err':>8} {'auth p50':>9} {'auth p95':>9} {'auth p99':>9} {'reads':>7} {'read.err':>8}")
+    for r in results:
+        print(
+            f"{r['profile']:<10} {r['inserts_per_second']:>10.0f} {r['insert_errors']:>8} "
+            f"{r['lookup_p50_ms']:>7.3f}ms {r['lookup_p95_ms']:>7.3f}ms {r['lookup_p99_ms']:>7.3f}ms "
+            f"{r['reader_reads']:>7} {r['reader_errors']:>8}"
+        )
+
+if __name__ == "__main__":
+    main()
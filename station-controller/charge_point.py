@@ -1,35 +1,70 @@
-import logging
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 from ocpp.v16 import ChargePoint as BaseChargePoint
 from ocpp.v16 import call_result, call
 from ocpp.v16.enums import RegistrationStatus, AuthorizationStatus, ChargingProfileStatus, ChargingRateUnitType, ChargingProfilePurposeType
 from ocpp.routing import on
 from rfid_manager import RFIDManager
 from meter_values_manager import MeterValuesManager
-from transaction_service import TransactionService
-from refused_card_service import RefusedCardService
-from charging_profile import ChargingProfileManager
+from event_journal import event_journal
+from charging_profile import ChargingProfileManager, ChargingLimitSender, charging_profile_id
+from charge_point_registry import connected_charge_points
+from active_transactions import active_transactions
+from status_publisher import status_publisher
+from metrics import metrics, instrument_handlers
+from logging_setup import station_logger, RATE_LIMITED
+
+def parse_timestamp(timestamp):
+    """ OCPP timestamp (ISO 8601) as a naive UTC datetime, like the database stores; now when it can't be parsed. """
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return datetime.utcnow()
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 class ChargePoint(BaseChargePoint):
     """ Handles communication with the charging station. """
 
     def __init__(self, id, websocket):
         super().__init__(id, websocket)
+        instrument_handlers(self)
         self.rfid_manager = RFIDManager()
         self.meter_values_manager = MeterValuesManager(charge_point=self)
         self.charging_profile_manager = ChargingProfileManager(self)
+        self.limit_sender = ChargingLimitSender(self)
         
-        # Dynamic load simulation parameters
-        self.current_power_limit = 16.0  # Start at 16A
-        self.min_power_limit = 8.0       # Minimum 8A
-        self.max_power_limit = 32.0      # Maximum 32A
-        self.power_step = 2.0            # Change by 2A each time
-        self.dynamic_load_task = None
+        # Load balancing state, read by the site load balancer
+        self.current_power_limit = 16.0  # Last limit applied to the station (A)
+        self.applied_limits = {}         # connector_id -> (transaction_id, limit, unit) of the last limit accepted
+        self.transactions = active_transactions  # Open transactions of all stations
+
+    @property
+    def log(self):
+        """ Logger of this station; its debug logging can be switched on at runtime. """
+        return station_logger(self.id)
+
+    async def route_message(self, raw_msg):
+        connected_charge_points.touch(self.id)
+        await super().route_message(raw_msg)
+
+    async def call(self, payload, *args, **kwargs):
+        """ Send a call to the station, recording its round-trip time per action. """
+        start = time.perf_counter()
+        error = True
+        try:
+            response = await super().call(payload, *args, **kwargs)
+            # A CALLERROR is returned as None unless suppress=False
+            error = response is None
+            return response
+        finally:
+            metrics.observe_sent(payload.__class__.__name__, self.id, (time.perf_counter() - start) * 1000, error)
 
     @on("BootNotification")
     async def on_boot_notification(self, **kwargs):
-        logging.info(f"Raw BootNotification payload: {kwargs}")
+        self.log.debug("Raw BootNotification payload: %s", kwargs)
 
         # Extract values safely
         charging_station = {
@@ -45,12 +80,10 @@ class ChargePoint(BaseChargePoint):
         new_id = charging_station["serial"]
         if new_id != "Unknown Serial" and new_id != old_id:
             self.id = new_id
-            logging.info(f"Updated charge point ID from '{old_id}' to '{new_id}'")
+            connected_charge_points.rename(self, old_id)
+            self.log.info("Updated charge point ID from '%s' to '%s'", old_id, new_id)
         
-        logging.info(f"BootNotification received from {self.id}: {charging_station}, Reason: {reason}")
-
-        # Start dynamic load simulation when charging station boots
-        # await self.start_dynamic_load_simulation()  # DISABLED: Power simulation disabled
+        self.log.info("BootNotification received from %s: %s, Reason: %s", self.id, charging_station, reason)
 
         return call_result.BootNotification(
             current_time=datetime.now().isoformat(),
@@ -61,12 +94,12 @@ class ChargePoint(BaseChargePoint):
     @on("Heartbeat")
     async def on_heartbeat(self, **kwargs):
         """ Handles Heartbeat event. """
-        logging.debug(f"Heartbeat received from {self.id}")
+        self.log.debug("Heartbeat received from %s", self.id)
         
         # Initialize heartbeat counter
         if not hasattr(self, '_heartbeat_count'):
             self._heartbeat_count = 0
-            logging.info(f"🔄 First heartbeat from {self.id}")
+            self.log.info("🔄 First heartbeat from %s", self.id)
         
         self._heartbeat_count += 1
         
@@ -75,56 +108,52 @@ class ChargePoint(BaseChargePoint):
     @on("Authorize")
     async def on_authorize(self, id_tag, **kwargs):
         """ Handles Authorize event and checks if the RFID is authorized. """
-        logging.debug(f"Authorization request for idTag {id_tag}")
+        self.log.debug("Authorization request for idTag %s", id_tag)
 
-        if self.rfid_manager.is_authorized(id_tag, self.id):
-            logging.info(f"RFID {id_tag} authorized")
+        if await self.rfid_manager.is_authorized(id_tag, self.id):
+            self.log.info("RFID %s authorized", id_tag)
             return call_result.Authorize(
                 id_tag_info={"status": AuthorizationStatus.accepted}
             )
         else:
-            logging.info(f"RFID {id_tag} not authorized")
-            self.log_rejected_rfid(id_tag)
+            # Recorded as refused card by the RFID manager
+            self.log.info("RFID %s not authorized", id_tag)
             return call_result.Authorize(
-                id_tag_info={"status": AuthorizationStatus.rejected}
+                id_tag_info={"status": AuthorizationStatus.invalid}
             )
 
     @on("StartTransaction")
     async def on_start_transaction(self, connector_id, id_tag, meter_start, timestamp, **kwargs):
-        logging.info(f"StartTransaction {kwargs}")        
+        self.log.info("StartTransaction %s", kwargs)        
         
-        # Store transaction in database
-        try:
-            transaction = TransactionService.create_transaction(
-                station_id=self.id,
-                rfid=id_tag
-            )
-            logging.info(f"Transaction stored in database with ID: {transaction.id}")
-        except Exception as e:
-            logging.error(f"Failed to store transaction in database: {e}, for card: {id_tag}")
+        # Journaled before the response; the journal stores it in the database
+        transaction_id = event_journal.allocate_transaction_id()
+        created = datetime.utcnow()
+        self.transactions.open(transaction_id, self.id, connector_id, id_tag, meter_start, created)
+        self.limit_sender.reset(connector_id)
+        status_publisher.touch(self.id)
+        await event_journal.record(
+            "start",
+            transaction_id=transaction_id,
+            station_id=self.id,
+            rfid=id_tag,
+            connector_id=connector_id,
+            meter_start=meter_start,
+            created=created.isoformat()
+        )
+        self.log.info("Transaction %s journaled for card %s", transaction_id, id_tag)
                 
         return call_result.StartTransaction(
-            transaction_id=transaction.id,
+            transaction_id=transaction_id,
             id_tag_info={"status": AuthorizationStatus.accepted}
         )
 
-    def log_rejected_rfid(self, rfid_tag):
-        """ Store rejected RFID tags in the database. """
-        try:
-            refused_card = RefusedCardService.create_refused_card(
-                station_id=self.id,
-                rfid=rfid_tag
-            )
-            logging.info(f"Rejected RFID {rfid_tag} stored in database with ID: {refused_card.id}")
-        except Exception as e:
-            logging.error(f"Failed to store rejected RFID {rfid_tag} in database: {e}")
-
     @on("MeterValues")
     async def on_meter_values(self, connector_id, transaction_id, meter_value):
         """Handles MeterValues event and logs readings to file."""
-        logging.debug(f"Received MeterValues for connector {connector_id}, transaction {transaction_id}")
+        self.log.debug("Received MeterValues for connector %s, transaction %s", connector_id, transaction_id)
 
-        self.meter_values_manager.log_meter_values(connector_id, transaction_id, meter_value)
+        await self.meter_values_manager.log_meter_values(connector_id, transaction_id, meter_value)
 
         return call_result.MeterValues()
 
@@ -132,7 +161,8 @@ class ChargePoint(BaseChargePoint):
     async def on_status_notification(self, connector_id, error_code, status, timestamp=None, info=None, vendor_id=None, vendor_error_code=None):
         """Handle the StatusNotification event from the charge point."""
 
-        logging.info(f"StatusNotification received: Connector {connector_id}, Status {status}, Error {error_code}, Timestamp {timestamp}")
+        self.log.info("StatusNotification received: Connector %s, Status %s, Error %s, Timestamp %s", connector_id, status, error_code, timestamp,
+                      extra=RATE_LIMITED)
 
         return call_result.StatusNotification()
 
@@ -140,7 +170,22 @@ class ChargePoint(BaseChargePoint):
     async def on_stop_transaction(self, transaction_id, id_tag, meter_stop, timestamp, **kwargs):
         """Handle the StopTransaction event from the charge point."""
         
-        logging.info(f"StopTransaction received: Transaction {transaction_id}, RFID {id_tag}, Meter stop {meter_stop}")
+        self.log.info("StopTransaction received: Transaction %s, RFID %s, Meter stop %s", transaction_id, id_tag, meter_stop)
+
+        transaction = self.transactions.close(transaction_id)
+        if transaction is not None:
+            self.limit_sender.reset(transaction.connector_id)
+            status_publisher.touch(self.id)
+
+        # All totals of the transaction are written here, once
+        await event_journal.record(
+            "stop",
+            transaction_id=transaction_id,
+            meter_stop=meter_stop,
+            stopped=parse_timestamp(timestamp).isoformat(),
+            reason=kwargs.get("reason"),
+            last_energy_kwh=transaction.energy_kwh if transaction is not None else None
+        )
 
         return call_result.StopTransaction(
             id_tag_info={"status": AuthorizationStatus.accepted}
@@ -149,39 +194,67 @@ class ChargePoint(BaseChargePoint):
     @on("SetChargingProfile")
     async def on_set_charging_profile(self, connector_id, cs_charging_profiles, **kwargs):
         """Handle SetChargingProfile requests from the charging station."""
-        logging.info(f"SetChargingProfile received for connector {connector_id}")
+        self.log.info("SetChargingProfile received for connector %s", connector_id)
         
         try:
             # Use the existing charging profile manager to handle the profile
             result = await self.charging_profile_manager.apply_profile(connector_id, cs_charging_profiles)
             return result
         except Exception as e:
-            logging.error(f"Error handling SetChargingProfile: {e}")
+            self.log.error("Error handling SetChargingProfile: %s", e)
             return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
 
-    async def set_charging_profile(self, connector_id: int, power_limit: float, unit: ChargingRateUnitType = ChargingRateUnitType.amps, profile_id: int = 1):
+    async def request_power_limit(self, connector_id: int, power_limit: float, unit: ChargingRateUnitType = ChargingRateUnitType.amps):
+        """
+        Queue a power limit for a connector. Limits are coalesced per connector and
+        sent one at a time; returns True once the station accepted the limit.
+        """
+        return await self.limit_sender.submit(connector_id, power_limit, unit)
+
+    async def set_charging_profile(self, connector_id: int, power_limit: float, unit: ChargingRateUnitType = ChargingRateUnitType.amps, profile_id: int = None, superseded=None):
         """
         Set a charging profile on the charging station via OCPP SetChargingProfile.
+        Prefer request_power_limit, which skips limits that are already applied
+        and never has more than one call outstanding.
         
         Args:
             connector_id: The connector ID
             power_limit: The power limit value
             unit: The unit (amps or watts)
-            profile_id: The charging profile ID
+            profile_id: The charging profile ID, by default the one of the connector
+            superseded: Optional callable; retries stop once it returns True
         """
+        if profile_id is None:
+            profile_id = charging_profile_id(connector_id)
         max_retries = 3
         base_delay = 1.0
         
         for attempt in range(max_retries):
+            if attempt > 0 and superseded is not None and superseded():
+                self.log.info("SetChargingProfile %s for %s connector %s superseded, not retrying", power_limit, self.id, connector_id)
+                return False
             try:
+                # OCPP 1.6 only allows ChargePointMaxProfile on connector 0: a connector gets a
+                # TxProfile for its running transaction, or a TxDefaultProfile when there is none
+                profile = {
+                    "chargingProfileId": profile_id,
+                    "chargingProfilePurpose": ChargingProfilePurposeType.charge_point_max_profile,
+                    "chargingProfileKind": "Absolute",
+                    "stackLevel": 0,
+                }
+                if connector_id > 0:
+                    transaction = self.transactions.for_connector(self.id, connector_id)
+                    if transaction is not None:
+                        profile["chargingProfilePurpose"] = ChargingProfilePurposeType.tx_profile
+                        profile["transactionId"] = transaction.transaction_id
+                    else:
+                        profile["chargingProfilePurpose"] = ChargingProfilePurposeType.tx_default_profile
+
                 # Create the SetChargingProfile request
                 request = call.SetChargingProfile(
                     connector_id=connector_id,
                     cs_charging_profiles={
-                        "chargingProfileId": profile_id,
-                        "chargingProfilePurpose": ChargingProfilePurposeType.charge_point_max_profile,
-                        "chargingProfileKind": "Absolute",
-                        "stackLevel": 0,
+                        **profile,
                         "chargingSchedule": {
                             "duration": 0,  # No duration limit
                             "chargingRateUnit": unit,
@@ -200,28 +273,30 @@ class ChargePoint(BaseChargePoint):
                     response = await asyncio.wait_for(self.call(request), timeout=10.0)
                     
                     if response.status == "Accepted":
+                        self.applied_limits[connector_id] = (profile.get("transactionId"), power_limit, unit)
+                        self.current_power_limit = power_limit
                         return True
                     else:
-                        logging.error(f"❌ Failed to set charging profile: {response.status}")
+                        self.log.error("❌ Failed to set charging profile: %s", response.status)
                         return False
                         
                 except asyncio.TimeoutError:
                     if attempt < max_retries - 1:
                         delay = base_delay * (2 ** attempt)
-                        logging.warning(f"⚠️  Timeout on attempt {attempt + 1}/{max_retries}, retrying in {delay}s...")
+                        self.log.warning("⚠️  Timeout on attempt %s/%s, retrying in %ss...", attempt + 1, max_retries, delay)
                         await asyncio.sleep(delay)
                         continue
                     else:
-                        logging.error(f"❌ Timeout waiting for SetChargingProfile response from charging station after {max_retries} attempts")
+                        self.log.error("❌ Timeout waiting for SetChargingProfile response from charging station after %s attempts", max_retries)
                         return False
                 except ConnectionError as e:
                     if attempt < max_retries - 1:
                         delay = base_delay * (2 ** attempt)
-                        logging.warning(f"⚠️  WebSocket connection error on attempt {attempt + 1}/{max_retries}, retrying in {delay}s: {e}")
+                        self.log.warning("⚠️  WebSocket connection error on attempt %s/%s, retrying in %ss: %s", attempt + 1, max_retries, delay, e)
                         await asyncio.sleep(delay)
                         continue
                     else:
-                        logging.warning(f"⚠️  WebSocket connection error during SetChargingProfile: {e}")
+                        self.log.warning("⚠️  WebSocket connection error during SetChargingProfile: %s", e)
                         return False
                 except Exception as e:
                     error_str = str(e).lower()
@@ -237,182 +312,52 @@ class ChargePoint(BaseChargePoint):
                     else:
                         if attempt < max_retries - 1:
                             delay = base_delay * (2 ** attempt)
-                            logging.warning(f"⚠️  Unexpected error on attempt {attempt + 1}/{max_retries}, retrying in {delay}s: {e}")
+                            self.log.warning("⚠️  Unexpected error on attempt %s/%s, retrying in %ss: %s", attempt + 1, max_retries, delay, e)
                             await asyncio.sleep(delay)
                             continue
                         else:
-                            logging.error(f"❌ Unexpected error during SetChargingProfile: {e}")
+                            self.log.error("❌ Unexpected error during SetChargingProfile: %s", e)
                             return False
                     
             except Exception as e:
                 if attempt < max_retries - 1:
                     delay = base_delay * (2 ** attempt)
-                    logging.warning(f"⚠️  Error on attempt {attempt + 1}/{max_retries}, retrying in {delay}s: {e}")
+                    self.log.warning("⚠️  Error on attempt %s/%s, retrying in %ss: %s", attempt + 1, max_retries, delay, e)
                     await asyncio.sleep(delay)
                     continue
                 else:
-                    logging.error(f"❌ Error setting charging profile: {e}")
+                    self.log.error("❌ Error setting charging profile: %s", e)
                     return False
         
         return False
 
-    async def start_dynamic_load_simulation(self):
-        """Start the dynamic load simulation that changes power limit every 10 seconds."""
-        if self.dynamic_load_task is None:
-            try:
-                self.dynamic_load_task = asyncio.create_task(self._dynamic_load_loop())
-            except Exception as e:
-                logging.error(f"❌ Error creating dynamic load simulation task for {self.id}: {e}")
-        else:
-            if self.dynamic_load_task.done():
-                # Clean up and restart
-                self.dynamic_load_task = None
-                await self.start_dynamic_load_simulation()
-
-
-    async def _dynamic_load_loop(self):
-        """Background task that changes power limit every 10 seconds."""
-        import random
-        while True:
-            try:
-                # Randomly decide to increase or decrease power
-                if random.choice([True, False]):
-                    # Increase power
-                    new_limit = min(self.current_power_limit + self.power_step, self.max_power_limit)
-                    direction = "⬆️"
-                else:
-                    # Decrease power
-                    new_limit = max(self.current_power_limit - self.power_step, self.min_power_limit)
-                    direction = "⬇️"
-                
-                # Always update and apply the new limit (for testing)
-                old_limit = self.current_power_limit
-                self.current_power_limit = new_limit
-                
-                # Apply the new charging profile
-                success = await self.set_charging_profile(
-                    connector_id=1,
-                    power_limit=new_limit,
-                    unit=ChargingRateUnitType.amps,
-                    profile_id=1
-                )
-                
-                if success:
-                    # Power limit changed successfully
-                    pass
-                else:
-                    logging.warning(f"⚠️  Dynamic load: Failed to change from {old_limit}A to {new_limit}A")
-                    # Revert the current_power_limit if it failed
-                    self.current_power_limit = old_limit
-                    # Add extra delay on failure to allow connection to stabilize
-                    await asyncio.sleep(2)
-                
-                # Wait 10 seconds before next change
-                await asyncio.sleep(10)
-                
-            except asyncio.CancelledError:
-                logging.info(f"🛑 Dynamic load simulation cancelled for {self.id}")
-                break
-            except Exception as e:
-                logging.error(f"❌ Error in dynamic load simulation: {e}")
-                await asyncio.sleep(10)  # Wait before retrying
-
-    async def force_power_limit(self, power_limit: float):
+    async def force_power_limit(self, power_limit: float, connector_id: int = 1):
         """Force a specific power limit for testing."""
-        old_limit = self.current_power_limit
-        self.current_power_limit = power_limit
-        
-        success = await self.set_charging_profile(
-            connector_id=1,
+        success = await self.request_power_limit(
+            connector_id=connector_id,
             power_limit=power_limit,
-            unit=ChargingRateUnitType.amps,
-            profile_id=1
+            unit=ChargingRateUnitType.amps
         )
-        
-        if success:
-            # Force power limit applied successfully
-            pass
-        else:
-            logging.warning(f"⚠️  Force power limit failed: {old_limit}A → {power_limit}A")
-            self.current_power_limit = old_limit
-
-    def get_dynamic_load_status(self):
-        """Get the current status of the dynamic load simulation."""
-        task_running = False
-        task_done = False
-        task_cancelled = False
-        
-        if self.dynamic_load_task:
-            task_running = not self.dynamic_load_task.done()
-            task_done = self.dynamic_load_task.done()
-            task_cancelled = self.dynamic_load_task.cancelled()
-        
-        return {
-            "current_power_limit": self.current_power_limit,
-            "min_power_limit": self.min_power_limit,
-            "max_power_limit": self.max_power_limit,
-            "power_step": self.power_step,
-            "task_running": task_running,
-            "task_done": task_done,
-            "task_cancelled": task_cancelled,
-            "task_exists": self.dynamic_load_task is not None
-        }
 
-    async def restart_dynamic_load_simulation(self):
-        """Restart the dynamic load simulation."""
-        # Stop current simulation
-        if self.dynamic_load_task:
-            self.dynamic_load_task.cancel()
-            self.dynamic_load_task = None
-        
-        # Wait a moment
-        await asyncio.sleep(1)
-        
-        # Start new simulation
-        await self.start_dynamic_load_simulation()
+        if not success:
+            self.log.warning("⚠️  Force power limit failed: %sA → %sA", self.get_power_limit(connector_id), power_limit)
+        return success
 
-    async def trigger_dynamic_load_change(self):
-        """Manually trigger a dynamic load change for testing."""
-        import random
-        
-        # Randomly decide to increase or decrease power
-        if random.choice([True, False]):
-            # Increase power
-            new_limit = min(self.current_power_limit + self.power_step, self.max_power_limit)
-            direction = "⬆️"
-        else:
-            # Decrease power
-            new_limit = max(self.current_power_limit - self.power_step, self.min_power_limit)
-            direction = "⬇️"
-        
-        # Always update and apply the new limit
-        old_limit = self.current_power_limit
-        self.current_power_limit = new_limit
-        
-        # Apply the new charging profile
-        success = await self.set_charging_profile(
-            connector_id=1,
-            power_limit=new_limit,
-            unit=ChargingRateUnitType.amps,
-            profile_id=1
-        )
-        
-        if success:
-            # Manual trigger successful
-            pass
-        else:
-            logging.warning(f"⚠️  Manual trigger: Failed to change power limit from {old_limit}A to {new_limit}A")
-            # Revert the current_power_limit if it failed
-            self.current_power_limit = old_limit
+    def get_power_limit(self, connector_id):
+        """The power limit (A) applied to the current transaction of a connector."""
+        applied = self.limit_sender.applied_limit(connector_id)
+        return applied[0] if applied is not None else self.current_power_limit
 
-    async def clear_charging_profile(self, connector_id: int, profile_id: int = 1):
+    async def clear_charging_profile(self, connector_id: int, profile_id: int = None):
         """
         Clear a charging profile from the charging station via OCPP ClearChargingProfile.
         
         Args:
             connector_id: The connector ID
-            profile_id: The charging profile ID to clear
+            profile_id: The charging profile ID to clear, by default the one of the connector
         """
+        if profile_id is None:
+            profile_id = charging_profile_id(connector_id)
         try:
             # Create the ClearChargingProfile request
             request = call.ClearChargingProfile(
@@ -425,11 +370,11 @@ class ChargePoint(BaseChargePoint):
             if response.status.value == "Accepted":
                 return True
             else:
-                logging.error(f"❌ Failed to clear charging profile: {response.status.value}")
+                self.log.error("❌ Failed to clear charging profile: %s", response.status.value)
                 return False
                 
         except Exception as e:
-            logging.error(f"❌ Error clearing charging profile: {e}")
+            self.log.error("❌ Error clearing charging profile: %s", e)
             return False
 
 
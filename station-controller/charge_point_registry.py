@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+
+class ChargePointRegistry:
+    """
+    The charge points that are currently connected, by station ID.
+
+    Stations connect with the ID from their websocket path; BootNotification
+    may rename them to their serial number (see `rename`), and later
+    connections from the same path get that ID right away. A station that
+    reconnects replaces its previous connection. Commands can be an OCPP call
+    payload (e.g. `call.Reset(...)`), sent with `ChargePoint.call`, or an async
+    function that receives the ChargePoint.
+    """
+
+    def __init__(self):
+        self._charge_points = {}
+        self._last_seen = {}
+        self._aliases = {}  # websocket path ID -> ID from BootNotification
+        self.listeners = []  # Called without arguments when stations are registered or unregistered
+
+    def register(self, charge_point):
+        previous = self._charge_points.get(charge_point.id)
+        self._charge_points[charge_point.id] = charge_point
+        self.touch(charge_point.id)
+        if previous is not None and previous is not charge_point:
+            logging.info("Charge point %s reconnected, closing its previous connection", charge_point.id)
+            asyncio.ensure_future(self._close(previous))
+        logging.info("Registered charge point %s (%s connected)", charge_point.id, len(self._charge_points))
+        self._notify()
+
+    def resolve(self, path_id):
+        """The station ID for a websocket path ID; stations don't always send BootNotification after a reconnect."""
+        return self._aliases.get(path_id, path_id)
+
+    def rename(self, charge_point, old_id):
+        """Re-register a charge point whose ID changed, e.g. to its serial number on BootNotification."""
+        self._aliases[old_id] = charge_point.id
+        if self._charge_points.get(old_id) is charge_point:
+            del self._charge_points[old_id]
+            self._last_seen.pop(old_id, None)
+        self.register(charge_point)
+
+    def unregister(self, charge_point):
+        """Remove a disconnected charge point, unless it was already replaced by a new connection."""
+        if self._charge_points.get(charge_point.id) is charge_point:
+            del self._charge_points[charge_point.id]
+            self._last_seen.pop(charge_point.id, None)
+            logging.info("Unregistered charge point %s (%s connected)", charge_point.id, len(self._charge_points))
+            self._notify()
+
+    def touch(self, station_id):
+        self._last_seen[station_id] = time.time()
+
+    def get(self, station_id):
+        return self._charge_points.get(station_id)
+
+    def last_seen(self, station_id):
+        return self._last_seen.get(station_id)
+
+    def station_ids(self):
+        return list(self._charge_points)
+
+    def __contains__(self, station_id):
+        return station_id in self._charge_points
+
+    def __len__(self):
+        return len(self._charge_points)
+
+    def __iter__(self):
+        return iter(list(self._charge_points.values()))
+
+    async def send(self, station_id, command):
+        """Send a command to one station. Raises KeyError when it is not connected."""
+        charge_point = self._charge_points.get(station_id)
+        if charge_point is None:
+            raise KeyError(f"Charge point {station_id} is not connected")
+        if callable(command):
+            return await command(charge_point)
+        return await charge_point.call(command)
+
+    async def send_many(self, station_ids, command):
+        """Send a command to several stations concurrently; returns {station_id: result or exception}."""
+        station_ids = list(station_ids)
+        results = await asyncio.gather(
+            *(self.send(station_id, command) for station_id in station_ids),
+            return_exceptions=True
+        )
+        return dict(zip(station_ids, results))
+
+    async def broadcast(self, command):
+        """Send a command to all connected stations concurrently."""
+        return await self.send_many(self.station_ids(), command)
+
+    def _notify(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                logging.error("❌ Error in charge point registry listener: %s", e)
+
+    @staticmethod
+    async def _close(charge_point):
+        try:
+            await charge_point._connection.close()
+        except Exception as e:
+            logging.debug("Error closing previous connection of %s: %s", charge_point.id, e)
+
+connected_charge_points = ChargePointRegistry()
@@ -1,7 +1,15 @@
+import asyncio
 import logging
 from ocpp.v16 import call_result
 from ocpp.v16.enums import ChargingRateUnitType, ChargingProfilePurposeType, ChargingProfileStatus
 
+def charging_profile_id(connector_id):
+    """
+    The id of the limit profile of a connector. A profile replaces the one with
+    the same id on the station, so every connector needs its own.
+    """
+    return connector_id + 1
+
 class ChargingProfileManager:
     """ Manages charging power limits via OCPP SetChargingProfile. """
 
@@ -13,7 +21,7 @@ class ChargingProfileManager:
         """ Sets a charging profile with a power limit. """
         
         try:
-            logging.info(f"Applying charging profile for connector {connector_id}")
+            logging.info("Applying charging profile for connector %s", connector_id)
             
             # Extract charging profile data
             profile = cs_charging_profiles.get("chargingProfile", {})
@@ -21,7 +29,7 @@ class ChargingProfileManager:
             charging_schedule_periods = charging_schedule.get("chargingSchedulePeriod", [])
             
             if not charging_schedule_periods:
-                logging.warning(f"No charging schedule periods found for connector {connector_id}")
+                logging.warning("No charging schedule periods found for connector %s", connector_id)
                 return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
             
             # Get the first period (most common case for simple power limiting)
@@ -30,7 +38,7 @@ class ChargingProfileManager:
             unit = charging_schedule.get("chargingRateUnit", ChargingRateUnitType.watts)
             
             if power_limit is None:
-                logging.warning(f"No power limit found in charging profile for connector {connector_id}")
+                logging.warning("No power limit found in charging profile for connector %s", connector_id)
                 return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
             
             # Store the active profile
@@ -41,7 +49,7 @@ class ChargingProfileManager:
                 "schedule": charging_schedule
             }
             
-            logging.info(f"Power limit set to {power_limit} {unit.value} on connector {connector_id}")
+            logging.info("Power limit set to %s %s on connector %s", power_limit, unit.value, connector_id)
             
             # Here you would typically send the power limit to the charging station hardware
             # This depends on your specific charging station implementation
@@ -50,7 +58,7 @@ class ChargingProfileManager:
             return call_result.SetChargingProfile(status=ChargingProfileStatus.accepted)
             
         except Exception as e:
-            logging.error(f"Failed to set charging profile: {e}")
+            logging.error("Failed to set charging profile: %s", e)
             return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
     
     async def _apply_power_limit_to_hardware(self, connector_id, power_limit, unit):
@@ -65,10 +73,10 @@ class ChargingProfileManager:
             elif unit == ChargingRateUnitType.watts:
                 power_limit_watts = power_limit
             else:
-                logging.warning(f"Unsupported charging rate unit: {unit}")
+                logging.warning("Unsupported charging rate unit: %s", unit)
                 return
             
-            logging.info(f"Applying {power_limit_watts}W power limit to connector {connector_id}")
+            logging.info("Applying %sW power limit to connector %s", power_limit_watts, connector_id)
             
             # TODO: Implement hardware-specific power limiting
             # This could involve:
@@ -80,7 +88,7 @@ class ChargingProfileManager:
             # await self.cp.send_power_limit_command(connector_id, power_limit_watts)
             
         except Exception as e:
-            logging.error(f"Failed to apply power limit to hardware: {e}")
+            logging.error("Failed to apply power limit to hardware: %s", e)
     
     def get_active_profile(self, connector_id):
         """Get the currently active charging profile for a connector."""
@@ -111,5 +119,142 @@ class ChargingProfileManager:
             return await self.apply_profile(connector_id, profile)
             
         except Exception as e:
-            logging.error(f"Failed to set simple power limit: {e}")
-            return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
\ No newline at end of file
+            logging.error("Failed to set simple power limit: %s", e)
+            return call_result.SetChargingProfile(status=ChargingProfileStatus.rejected)
+
+class ChargingLimitSender:
+    """
+    Sends power limits to one charging station through SetChargingProfile.
+
+    Each connector has one command slot with latest-wins coalescing:
+    - a new limit replaces one that hasn't been sent yet
+    - a limit equal to the one applied to the connector's current transaction
+      (or already on its way for it) is a no-op
+    - at most one SetChargingProfile is outstanding per station
+
+    A limit applied in one transaction says nothing about the next one, which
+    starts with the station's default: the first limit of a session is always sent.
+
+    Retries of a limit that has been superseded are abandoned; its callers get
+    the result of the newer limit instead.
+    """
+
+    def __init__(self, charge_point):
+        self.cp = charge_point
+        self._slots = {}         # connector_id -> {"limit", "unit", "waiters"} not sent yet
+        self._in_flight = None   # connector_id, transaction_id, limit, unit and waiters of the call being sent
+        self._task = None
+
+    def submit(self, connector_id, limit, unit=ChargingRateUnitType.amps):
+        """
+        Queue a limit for a connector. Returns a future that resolves to True once
+        the station accepted the limit (or an equal one), False when it failed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        slot = self._slots.get(connector_id)
+        transaction_id = self._transaction_id(connector_id)
+
+        if slot is not None and (slot["limit"], slot["unit"]) == (limit, unit):
+            slot["waiters"].append(future)
+            return future
+
+        in_flight = self._in_flight
+        if in_flight is not None and in_flight["connector_id"] == connector_id:
+            if (in_flight["transaction_id"], in_flight["limit"], in_flight["unit"]) == (transaction_id, limit, unit):
+                # Already being sent: drop anything queued behind it and share its result
+                if slot is not None:
+                    self._slots.pop(connector_id)
+                    in_flight["waiters"].extend(slot["waiters"])
+                in_flight["waiters"].append(future)
+                return future
+        elif self.applied_limit(connector_id) == (limit, unit):
+            # Already applied: cancel a queued change back to the applied limit
+            if slot is not None:
+                self._slots.pop(connector_id)
+                self._resolve(slot["waiters"], True)
+            future.set_result(True)
+            return future
+
+        waiters = slot["waiters"] if slot is not None else []
+        waiters.append(future)
+        self._slots[connector_id] = {"limit": limit, "unit": unit, "waiters": waiters}
+        if slot is not None:
+            logging.debug("%s connector %s: queued limit %s replaced by %s", self.cp.id, connector_id, slot['limit'], limit)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._send_all())
+        return future
+
+    def target_limit(self, connector_id):
+        """The limit a connector will have once the queued commands are sent."""
+        slot = self._slots.get(connector_id)
+        if slot is not None:
+            return slot["limit"]
+        in_flight = self._in_flight
+        if in_flight is not None and (in_flight["connector_id"], in_flight["transaction_id"]) == (connector_id, self._transaction_id(connector_id)):
+            return in_flight["limit"]
+        applied = self.applied_limit(connector_id)
+        return applied[0] if applied is not None else None
+
+    def applied_limit(self, connector_id):
+        """The (limit, unit) the station accepted for the connector's current transaction, or None."""
+        applied = self.cp.applied_limits.get(connector_id)
+        if applied is None or applied[0] != self._transaction_id(connector_id):
+            return None
+        return applied[1:]
+
+    def reset(self, connector_id):
+        """Forget the limit applied to a connector, when a transaction starts or stops on it."""
+        self.cp.applied_limits.pop(connector_id, None)
+
+    def _transaction_id(self, connector_id):
+        transaction = self.cp.transactions.for_connector(self.cp.id, connector_id)
+        return transaction.transaction_id if transaction is not None else None
+
+    def is_busy(self):
+        return bool(self._slots) or self._in_flight is not None
+
+    async def stop(self):
+        """Cancel the queued commands, e.g. when the station disconnects."""
+        in_flight = self._in_flight
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if in_flight is not None:
+            self._resolve(in_flight["waiters"], False)
+        for slot in self._slots.values():
+            self._resolve(slot["waiters"], False)
+        self._slots.clear()
+
+    async def _send_all(self):
+        while self._slots:
+            connector_id = next(iter(self._slots))
+            slot = self._slots.pop(connector_id)
+            self._in_flight = dict(slot, connector_id=connector_id, transaction_id=self._transaction_id(connector_id))
+            try:
+                success = await self.cp.set_charging_profile(
+                    connector_id, slot["limit"], slot["unit"],
+                    superseded=lambda: connector_id in self._slots
+                )
+            except Exception as e:
+                logging.error("❌ Error sending limit %s to %s connector %s: %s", slot['limit'], self.cp.id, connector_id, e)
+                success = False
+            finally:
+                in_flight, self._in_flight = self._in_flight, None
+
+            newer = self._slots.get(connector_id)
+            if not success and newer is not None:
+                # Abandoned for a newer limit: the callers get that result instead
+                newer["waiters"].extend(in_flight["waiters"])
+            else:
+                self._resolve(in_flight["waiters"], success)
+
+    @staticmethod
+    def _resolve(waiters, result):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(result)
@@ -1,8 +1,112 @@
 
+# Websocket server
+
+WEBSOCKET_HOST = "0.0.0.0"
+WEBSOCKET_PORT = 9000
+CONTROLLER_WORKERS = 1           # Worker processes; above 1 a supervisor process hands every station to its own worker, see workers.py
+WORKER_HANDSHAKE_TIMEOUT = 10    # Seconds the supervisor waits for the websocket request line of a new connection
+WORKER_REQUEST_TIMEOUT = 60      # Seconds the supervisor waits for a worker to answer, e.g. a call to one of its stations
+
 # State files
 
-METER_VALUES_CSV = "/var/www/html/meter_values.csv"
 STATUS_JSON = "/var/www/html/meter_values.json"
+STATUS_STATIONS_DIRECTORY = "/var/www/html/meter_values/"  # Per-station status files plus index.json
+STATUS_PUBLISH_INTERVAL = 2.0  # Seconds between status file writes
 
 DB_DATA_DIRECTORY = "/home/ubuntu/ocpp-data/"
 DB_FILE = DB_DATA_DIRECTORY + "cloud.db"
+
+# Raw meter sample archive (every sample of every MeterValues request)
+
+METER_ARCHIVE_DIRECTORY = DB_DATA_DIRECTORY + "meter_values/"
+METER_ARCHIVE_FLUSH_INTERVAL = 5.0           # Seconds between writes of the buffered samples
+METER_ARCHIVE_FLUSH_BYTES = 256 * 1024       # Write sooner once this much is buffered
+METER_ARCHIVE_ROTATE_BYTES = 64 * 1024 * 1024  # Start a new segment after this size, and every day
+METER_ARCHIVE_COMPRESS = True                # Gzip closed segments
+
+# Columnar time series of the numeric meter samples, see timeseries_store.py
+
+TIMESERIES_DIRECTORY = DB_DATA_DIRECTORY + "timeseries/"
+TIMESERIES_SEGMENT_SAMPLES = 65536           # Samples per segment file (1 MiB for the times, 1 MiB for the values)
+TIMESERIES_FLUSH_INTERVAL = 10.0             # Seconds between writing dirty segments to disk
+TIMESERIES_OPEN_SERIES = 128                 # Series whose last segment stays open for appending (2 file descriptors each)
+
+# SQLite tuning (applied to every connection of the station controller)
+
+SQLITE_JOURNAL_MODE = "WAL"      # Readers (cloud API) no longer block the writer and vice versa
+SQLITE_SYNCHRONOUS = "NORMAL"    # Safe with WAL; fsync at checkpoints instead of every commit
+SQLITE_BUSY_TIMEOUT_MS = 5000    # Wait for a lock instead of failing with "database is locked"
+SQLITE_CACHE_SIZE_KB = 16384     # Page cache per connection
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+DB_POOL_SIZE = 2                 # All writes run on one database thread, see persistence.py
+
+# RFID authorization cache (seconds)
+
+AUTH_CACHE_TTL = 300             # Reload the authorized RFIDs at least this often
+AUTH_CACHE_NEGATIVE_TTL = 30     # Remember refused RFIDs for this long
+AUTH_CACHE_POLL_INTERVAL = 2     # Check the database for changes at most this often
+
+# Refused cards
+
+REFUSED_CARD_WINDOW = 300          # Refusals of a card at a station within this many seconds share one row
+REFUSED_CARD_RECENT_SIZE = 100     # Recent refusals kept in memory
+
+# Local authorization list: the authorized RFIDs are pushed to the stations with SendLocalList
+
+LOCAL_AUTH_LIST_ENABLED = True
+LOCAL_AUTH_LIST_FILE = DB_DATA_DIRECTORY + "local_auth_list.json"  # Current list, its version and recent changes
+LOCAL_AUTH_LIST_CHECK_INTERVAL = 10  # Seconds between checks of the cards and residents for changes
+LOCAL_AUTH_LIST_HISTORY = 100        # Versions kept to send differential updates; older stations get the full list
+LOCAL_AUTH_LIST_CONNECT_DELAY = 5    # Seconds after a station connects (and sends BootNotification) before syncing its list
+
+# Event journal: OCPP events are journaled before the response and applied to the database afterwards
+
+EVENT_JOURNAL_DIRECTORY = DB_DATA_DIRECTORY + "journal/"
+EVENT_JOURNAL_NAME = "station-controller"      # Key of this journal's checkpoint in the database
+EVENT_JOURNAL_SYNC_DELAY = 0.005               # Seconds to gather more events before an fsync
+EVENT_JOURNAL_SYNC_TIMEOUT = 5.0               # Respond anyway after this long; the events stay queued until written
+EVENT_JOURNAL_SEGMENT_BYTES = 16 * 1024 * 1024 # Start a new journal file after this size
+EVENT_JOURNAL_REPLAY_INTERVAL = 2.0            # Seconds between applying journaled events to the database
+EVENT_JOURNAL_REPLAY_BATCH = 500               # Events applied per database transaction
+
+# P1 smart meter
+
+P1_SERIAL_PORT = "/dev/ttyUSB0"
+P1_BAUDRATE = 115200
+P1_HISTORY_SIZE = 300            # Telegrams kept per phase (DSMR 5 sends one per second)
+P1_STALE_AFTER = 10              # Seconds without a telegram before readings are considered stale
+
+# Site load balancing
+
+LOAD_BALANCING_ENABLED = False  # Needs the P1 meter; without one every step logs a P1 error
+SITE_FUSE_RATING = 63            # Main fuse rating per phase (A)
+SITE_SAFETY_MARGIN = 3           # Amps kept free below the fuse rating
+LOAD_BALANCING_INTERVAL = 5      # Seconds between control steps
+LOAD_BALANCING_POLICY = "fair"   # "fair": equal share per session, "priority": by STATION_PRIORITIES
+STATION_PRIORITIES = {}          # station_id -> priority, higher is served first
+CHARGER_MIN_CURRENT = 6          # Below this an EV can't charge (IEC 61851), so sessions get 0 A instead
+CHARGER_MAX_CURRENT = 32
+LIMIT_MIN_CHANGE = 1.0           # Ignore limit changes smaller than this (A)
+LIMIT_HYSTERESIS = 2.0           # Extra headroom (A) required before raising a limit
+LIMIT_RAISE_INTERVAL = 30        # Minimum seconds between raises of one connector; cuts are sent immediately
+
+# Active transactions
+
+ACTIVE_TRANSACTION_MAX_AGE = 24 * 3600  # At startup, unstopped transactions younger than this (s) are taken as still open
+ACTIVE_TRANSACTION_RECENTLY_CLOSED = 1000  # Closed transaction ids remembered, so late MeterValues don't reopen them
+
+# Metrics
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"       # Only reachable from the controller host, e.g. through an SSH tunnel
+METRICS_PORT = 9100
+LOOP_LAG_INTERVAL = 0.5          # Seconds between event-loop lag samples
+
+# Logging
+LOG_LEVEL = "INFO"
+LOG_FILE = None                  # e.g. "/var/log/station-controller.log"; stdout only when None
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_RATE_LIMIT = 10              # Records of a per-frame message per logger per interval
+LOG_RATE_INTERVAL = 60           # Seconds
+LOG_RATE_WINDOWS = 1024          # (logger, message) pairs counted at once; the least recently used are forgotten
@@ -1,13 +1,46 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from constants import DB_FILE
+from sqlalchemy.pool import QueuePool
+from constants import (
+    DB_FILE, DB_POOL_SIZE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+)
 
 # SQLite database URL
 DATABASE_URL = "sqlite:///" + DB_FILE
 
+# PRAGMAs set on every new connection
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "cache_size": -SQLITE_CACHE_SIZE_KB,  # Negative values are KiB instead of pages
+    "mmap_size": SQLITE_MMAP_SIZE,
+}
+
+def create_sqlite_engine(url=DATABASE_URL, pragmas=SQLITE_PRAGMAS, pool_size=DB_POOL_SIZE):
+    """Create an engine for the station controller's single-writer SQLite workload."""
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return engine
+
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_sqlite_engine()
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -21,4 +54,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
@@ -0,0 +1,418 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import ChargeTransaction, PowerLog, RefusedCard, EventJournalCheckpoint
+from database import SessionLocal
+from persistence import run_db
+from transaction_service import TransactionService
+from constants import (
+    EVENT_JOURNAL_DIRECTORY, EVENT_JOURNAL_NAME, EVENT_JOURNAL_SYNC_DELAY, EVENT_JOURNAL_SYNC_TIMEOUT,
+    EVENT_JOURNAL_SEGMENT_BYTES, EVENT_JOURNAL_REPLAY_INTERVAL, EVENT_JOURNAL_REPLAY_BATCH, REFUSED_CARD_WINDOW
+)
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".jsonl"
+DEAD_LETTER_PREFIX = "dead-letters-"
+RETRY_DELAY = 1.0  # Seconds before writing the journal again after an error
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+class DeadLetters:
+    """
+    Journaled events that cannot be applied, kept in a JSON lines file for manual
+    repair so the journal can go on with the other events: a start whose
+    transaction id is taken by another transaction, and the later events of that
+    transaction, which would otherwise end up on the other one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.transaction_ids = set()  # Transactions whose events are dead letters
+        self._sequences = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self._sequences.add(event["seq"])
+                self.transaction_ids.add(event["transaction_id"])
+
+    def add(self, event, reason):
+        """ Store an event that is not applied; written and fsynced before the checkpoint moves past it. """
+        self.transaction_ids.add(event["transaction_id"])
+        if event["seq"] in self._sequences:
+            return  # Already stored by a batch that was rolled back
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(dict(event, reason=reason), separators=(",", ":")) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._sequences.add(event["seq"])
+        logging.error("❌ Journaled %s event %s of transaction %s not applied, moved to %s: %s",
+                      event["type"], event["seq"], event["transaction_id"], self.path, reason)
+
+class EventJournalService:
+    @staticmethod
+    def get_checkpoint(journal: str) -> int:
+        """Get the sequence number of the last event of a journal that was applied, 0 when none was."""
+        db = SessionLocal()
+        try:
+            checkpoint = db.query(EventJournalCheckpoint).filter(EventJournalCheckpoint.journal == journal).first()
+            return checkpoint.sequence if checkpoint else 0
+        finally:
+            db.close()
+
+    @staticmethod
+    def apply(journal: str, events: list[dict], dead_letters: DeadLetters):
+        """
+        Apply journaled events and move the journal's checkpoint past them in one
+        database transaction. Events up to the stored checkpoint are skipped, so
+        every event is applied exactly once, however often a batch is retried.
+        Events of a transaction that cannot be stored go to the dead letters.
+        """
+        db = SessionLocal()
+        try:
+            checkpoint = db.query(EventJournalCheckpoint.sequence).filter(EventJournalCheckpoint.journal == journal).scalar() or 0
+            events = [event for event in events if event["seq"] > checkpoint]
+            if not events:
+                return
+
+            power_logs = []
+            for event in events:
+                kind = event["type"]
+                if kind in ("start", "stop", "power_log") and event["transaction_id"] in dead_letters.transaction_ids:
+                    dead_letters.add(event, "an earlier event of the transaction was not applied")
+                    continue
+                if kind == "power_log":
+                    # Consecutive power logs are inserted together
+                    power_logs.append({
+                        "charge_transaction_id": event["transaction_id"],
+                        "created": _datetime(event["created"]),
+                        "power_kw": event["power_kw"],
+                        "energy_kwh": event["energy_kwh"]
+                    })
+                    continue
+                if power_logs:
+                    db.execute(insert(PowerLog), power_logs)
+                    power_logs = []
+
+                if kind == "start":
+                    result = db.execute(
+                        sqlite_insert(ChargeTransaction).values(
+                            id=event["transaction_id"],
+                            station_id=event["station_id"],
+                            rfid=event["rfid"],
+                            connector_id=event["connector_id"],
+                            meter_start=event["meter_start"],
+                            created=_datetime(event["created"])
+                        ).on_conflict_do_nothing(index_elements=["id"])
+                    )
+                    if result.rowcount == 0:
+                        # Another transaction has this id (written by another process, or allocated
+                        # before CONTROLLER_WORKERS changed): its stop and power logs would end up on that one
+                        dead_letters.add(event, "the transaction id is taken by another transaction")
+                elif kind == "stop":
+                    db.execute(TransactionService.stop_statement(
+                        event["transaction_id"], event["meter_stop"], _datetime(event["stopped"]),
+                        event.get("reason"), event.get("last_energy_kwh")
+                    ))
+                elif kind == "refused":
+                    EventJournalService._record_refusal(db, event["station_id"], event["rfid"], _datetime(event["created"]))
+                else:
+                    logging.error("Skipping journaled event %s of unknown type %s", event["seq"], kind)
+            if power_logs:
+                db.execute(insert(PowerLog), power_logs)
+
+            db.execute(
+                sqlite_insert(EventJournalCheckpoint)
+                .values(journal=journal, sequence=events[-1]["seq"])
+                .on_conflict_do_update(index_elements=["journal"], set_={"sequence": events[-1]["seq"]})
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _record_refusal(db, station_id, rfid, seen):
+        """
+        Count a refused swipe in the row of the card at the station that was last
+        seen within REFUSED_CARD_WINDOW, or start a new row.
+        """
+        row_id = db.execute(
+            select(RefusedCard.id)
+            .where(RefusedCard.rfid == rfid, RefusedCard.station_id == station_id,
+                   RefusedCard.last_seen >= seen - timedelta(seconds=REFUSED_CARD_WINDOW))
+            .order_by(RefusedCard.last_seen.desc())
+            .limit(1)
+        ).scalar()
+        if row_id is not None:
+            db.execute(update(RefusedCard).where(RefusedCard.id == row_id).values(count=RefusedCard.count + 1, last_seen=seen))
+        else:
+            db.execute(insert(RefusedCard).values(station_id=station_id, rfid=rfid, created=seen, count=1, last_seen=seen))
+
+class EventJournal:
+    """
+    Append-only journal of the OCPP events that end up in the database:
+    transaction starts and stops, power logs and refused cards.
+
+    Handlers append an event and wait until it is on disk before the station gets
+    its response. Events that arrive while the journal is being written are
+    written together with the next fsync, so a busy controller does one fsync
+    for many events. A background task applies the written events to the
+    database in batches; when SQLite is locked or unavailable they stay in the
+    journal and are applied later, in order.
+
+    The journal is a series of files, <directory>/journal-<first sequence>.jsonl,
+    one JSON event per line. Each batch applied to the database also stores the
+    sequence number of its last event (the checkpoint), so after a crash only the
+    events after the checkpoint are applied again. Files whose events are all
+    applied are deleted. Events that can never be applied are moved to
+    <directory>/dead-letters-<name>.jsonl, see DeadLetters.
+
+    Transaction ids are allocated here instead of by the database, so
+    StartTransaction can be answered before the transaction is stored.
+    """
+
+    def __init__(self, directory=EVENT_JOURNAL_DIRECTORY, name=EVENT_JOURNAL_NAME, sync_delay=EVENT_JOURNAL_SYNC_DELAY,
+                 sync_timeout=EVENT_JOURNAL_SYNC_TIMEOUT, segment_bytes=EVENT_JOURNAL_SEGMENT_BYTES,
+                 replay_interval=EVENT_JOURNAL_REPLAY_INTERVAL, replay_batch=EVENT_JOURNAL_REPLAY_BATCH,
+                 id_stride=1, id_offset=0):
+        self.directory = directory
+        self.name = name
+        self.sync_delay = sync_delay
+        self.sync_timeout = sync_timeout
+        self.segment_bytes = segment_bytes
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+        # With several worker processes, each allocates the transaction ids id_offset (mod id_stride)
+        self.id_stride = id_stride
+        self.id_offset = id_offset
+
+        self._sequence = 0
+        self._checkpoint = 0
+        self._next_transaction_id = 1
+        self._buffer = []           # Events waiting to be written
+        self._written = None        # Future resolved once the buffered events are on disk
+        self._pending = []          # Written events waiting to be applied to the database
+        self._file = None
+        self._file_size = 0
+        self._segments = []         # [path, last sequence] of the journal files, oldest first
+        self._segments_lock = threading.Lock()
+        self._dead_letters = None
+        self._wakeup = None
+        self._stopping = False
+        self._writer_task = None
+        self._replay_task = None
+        self._replay_lock = asyncio.Lock()
+
+    @property
+    def pending(self):
+        """ Number of events not yet applied to the database. """
+        return len(self._buffer) + len(self._pending)
+
+    async def open(self):
+        """ Read the journal left by the previous run; events after the checkpoint are applied by the next replay. """
+        self._checkpoint = await run_db(EventJournalService.get_checkpoint, self.name)
+        self._dead_letters = DeadLetters(os.path.join(self.directory, f"{DEAD_LETTER_PREFIX}{self.name}{SEGMENT_SUFFIX}"))
+        await asyncio.get_running_loop().run_in_executor(None, self._dead_letters.load)
+        max_transaction_id = await run_db(TransactionService.get_max_transaction_id)
+        events = await asyncio.get_running_loop().run_in_executor(None, self._read_segments)
+
+        self._pending = [event for event in events if event["seq"] > self._checkpoint]
+        self._sequence = max([self._checkpoint] + [event["seq"] for event in events])
+        started = [event["transaction_id"] for event in events if event["type"] == "start"]
+        first = max([max_transaction_id] + started) + 1
+        self._next_transaction_id = first + (self.id_offset - first) % self.id_stride
+        if self._pending:
+            logging.info("Event journal has %s events that are not yet in the database", len(self._pending))
+
+    def allocate_transaction_id(self):
+        transaction_id = self._next_transaction_id
+        self._next_transaction_id += self.id_stride
+        return transaction_id
+
+    def append(self, kind, **data):
+        """ Queue an event for the next write; returns a future that is resolved once it is on disk. """
+        self._sequence += 1
+        self._buffer.append({"seq": self._sequence, "type": kind, **data})
+        if self._written is None:
+            self._written = asyncio.get_running_loop().create_future()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self._written
+
+    async def record(self, kind, **data):
+        """
+        Journal an event and wait until it is on disk. After `sync_timeout` it
+        returns anyway: the event stays queued and is written once the disk recovers.
+        """
+        written = self.append(kind, **data)
+        try:
+            await asyncio.wait_for(asyncio.shield(written), self.sync_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Event journal not written within %ss, responding before %s event %s is on disk",
+                            self.sync_timeout, kind, self._sequence)
+
+    def start(self):
+        if self._writer_task is None or self._writer_task.done():
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            if self._buffer:
+                self._wakeup.set()
+            self._writer_task = asyncio.create_task(self._run_writer())
+            self._replay_task = asyncio.create_task(self._run_replay())
+
+    async def stop(self):
+        """ Write the queued events, apply what the database accepts and close the journal. """
+        if self._replay_task:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+        if self._writer_task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._writer_task
+            self._writer_task = None
+        await self.replay()
+        await asyncio.get_running_loop().run_in_executor(None, self._close)
+        await asyncio.get_running_loop().run_in_executor(None, self._remove_applied_segments, self._checkpoint)
+
+    async def replay(self):
+        """ Apply the written events to the database, in batches. Returns False when the database refused them. """
+        async with self._replay_lock:
+            while self._pending:
+                batch = self._pending[:self.replay_batch]
+                try:
+                    await run_db(EventJournalService.apply, self.name, batch, self._dead_letters)
+                except Exception as e:
+                    logging.error("❌ Error applying %s journaled events to the database, retrying later: %s", len(batch), e)
+                    return False
+                del self._pending[:len(batch)]
+                self._checkpoint = batch[-1]["seq"]
+                logging.debug("Applied journaled events up to %s", self._checkpoint)
+            await asyncio.get_running_loop().run_in_executor(None, self._remove_applied_segments, self._checkpoint)
+            return True
+
+    async def _run_writer(self):
+        while True:
+            await self._wakeup.wait()
+            if self.sync_delay and not self._stopping:
+                await asyncio.sleep(self.sync_delay)
+            self._wakeup.clear()
+            if self._buffer and not await self._sync():
+                if self._stopping:
+                    logging.error("❌ Event journal could not be written, %s events are lost", len(self._buffer))
+                    return
+                await asyncio.sleep(RETRY_DELAY)
+                self._wakeup.set()
+            if self._stopping and not self._buffer:
+                return
+
+    async def _sync(self):
+        events, written = self._buffer, self._written
+        self._buffer, self._written = [], None
+        data = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data, events[0]["seq"], events[-1]["seq"])
+        except Exception as e:
+            logging.error("❌ Error writing the event journal, retrying: %s", e)
+            # Back in front of the events queued in the meantime, with the same waiters
+            self._buffer[:0] = events
+            if self._written is None:
+                self._written = written
+            else:
+                self._written.add_done_callback(lambda _: written.done() or written.set_result(None))
+            return False
+
+        self._pending.extend(events)
+        written.set_result(None)
+        return True
+
+    async def _run_replay(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            await self.replay()
+
+    def _write(self, data, first_sequence, last_sequence):
+        """ Append to the current journal file and fsync it; a new file is started after an error. """
+        if self._file is not None and self._file_size >= self.segment_bytes:
+            self._close()
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{SEGMENT_PREFIX}{first_sequence:012d}"
+            path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+            suffix = 1
+            while os.path.exists(path):
+                # Retrying a batch whose file was closed after an error
+                path = os.path.join(self.directory, f"{name}-{suffix}{SEGMENT_SUFFIX}")
+                suffix += 1
+            self._file = open(path, "a", encoding="utf-8")
+            self._file_size = self._file.tell()
+            with self._segments_lock:
+                self._segments.append([path, last_sequence])
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException:
+            # Never append after a line that may have been written halfway
+            self._close()
+            raise
+        self._file_size += len(data)
+        with self._segments_lock:
+            self._segments[-1][1] = last_sequence
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_segments(self):
+        """ All events in the journal files, by sequence number; lines cut off by a crash are skipped. """
+        if not os.path.isdir(self.directory):
+            return []
+        events = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            last_sequence = 0
+            with open(path, encoding="utf-8") as file:
+                for line_number, line in enumerate(file, 1):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logging.warning("Skipping incomplete event journal line %s:%s", path, line_number)
+                        continue
+                    events[event["seq"]] = event
+                    last_sequence = max(last_sequence, event["seq"])
+            with self._segments_lock:
+                self._segments.append([path, last_sequence])
+        return [events[sequence] for sequence in sorted(events)]
+
+    def _remove_applied_segments(self, checkpoint):
+        """ Delete the journal files, except the one being written, whose events are all in the database. """
+        with self._segments_lock:
+            current = self._file.name if self._file is not None else None
+            applied = [segment for segment in self._segments if segment[1] <= checkpoint and segment[0] != current]
+            self._segments = [segment for segment in self._segments if segment not in applied]
+        for path, _ in applied:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error("❌ Could not remove event journal file %s: %s", path, e)
+
+event_journal = EventJournal()
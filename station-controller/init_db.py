@@ -12,12 +12,12 @@ def init_database():
     for table in Base.metadata.sorted_tables:
         if table.name not in existing_tables:
             missing_tables.append(table.name)
-            logging.fatal(f"Required table '{table.name}' not found in database")
+            logging.fatal("Required table '%s' not found in database", table.name)
         else:
-            logging.debug(f"Table '{table.name}' exists")
+            logging.debug("Table '%s' exists", table.name)
     
     if missing_tables:
-        logging.fatal(f"Database initialization failed: {len(missing_tables)} required tables are missing: {', '.join(missing_tables)}")
+        logging.fatal("Database initialization failed: %s required tables are missing: %s", len(missing_tables), ', '.join(missing_tables))
         raise RuntimeError(f"Database initialization failed: Required tables are missing")
     else:
         logging.info("All required database tables exist")
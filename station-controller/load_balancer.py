@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import math
+import time
+from ocpp.v16.enums import ChargingRateUnitType
+from charge_point_registry import connected_charge_points
+from active_transactions import active_transactions
+from logging_setup import RATE_LIMITED
+from constants import (
+    SITE_FUSE_RATING, SITE_SAFETY_MARGIN, LOAD_BALANCING_INTERVAL, LOAD_BALANCING_POLICY,
+    STATION_PRIORITIES, CHARGER_MIN_CURRENT, CHARGER_MAX_CURRENT, LIMIT_MIN_CHANGE,
+    LIMIT_HYSTERESIS, LIMIT_RAISE_INTERVAL
+)
+
+class SiteLoadBalancer:
+    """
+    Shares the building's grid connection between all charging sessions.
+
+    Every `interval` seconds the balancer reads the phase currents from the P1
+    meter, subtracts what the EVs draw on each phase (from their MeterValues) to
+    get the rest of the building's load per phase, and divides what is left under
+    the main fuse on the most loaded phase over the active transactions. Limits are queued on each station's limit sender,
+    which coalesces them into SetChargingProfile calls:
+
+    - cuts are sent right away, raises at most once per `raise_interval`
+    - a raise needs `hysteresis` amps of extra headroom, so limits don't flap
+    - changes smaller than `min_change` amps are not sent
+    - sessions that can't get `min_current` are paused at 0 A
+    """
+
+    def __init__(self, p1_monitor, registry=connected_charge_points, transactions=active_transactions, fuse_rating=SITE_FUSE_RATING,
+                 safety_margin=SITE_SAFETY_MARGIN, interval=LOAD_BALANCING_INTERVAL, policy=LOAD_BALANCING_POLICY,
+                 priorities=STATION_PRIORITIES, min_current=CHARGER_MIN_CURRENT, max_current=CHARGER_MAX_CURRENT,
+                 min_change=LIMIT_MIN_CHANGE, hysteresis=LIMIT_HYSTERESIS, raise_interval=LIMIT_RAISE_INTERVAL):
+        self.p1_monitor = p1_monitor
+        self.registry = registry
+        self.transactions = transactions
+        self.fuse_rating = fuse_rating
+        self.safety_margin = safety_margin
+        self.interval = interval
+        self.policy = policy
+        self.priorities = priorities
+        self.min_current = min_current
+        self.max_current = max_current
+        self.min_change = min_change
+        self.hysteresis = hysteresis
+        self.raise_interval = raise_interval
+
+        self._raised_at = {}  # (station_id, connector_id) -> time of the last raise
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def active_sessions(self):
+        """(charge point, transaction) of every open transaction on a connected station, in the order they are served."""
+        sessions = []
+        for transaction in self.transactions:
+            charge_point = self.registry.get(transaction.station_id)
+            if charge_point is not None and transaction.connector_id is not None:
+                sessions.append((charge_point, transaction))
+        if self.policy == "priority":
+            sessions.sort(key=lambda session: -self.priorities.get(session[0].id, 0))
+        return sessions
+
+    def available_current(self, sessions):
+        """Amps the EVs may draw together on any phase, or None without P1 readings."""
+        if self.p1_monitor.last_update is None:
+            return None
+        if self.p1_monitor.is_stale():
+            # The meter stopped reporting: fall back to the minimum for everyone
+            return self.min_current * len(sessions)
+        # The rest of the building's load per phase. Currents reported without a phase stay
+        # in it, which only makes the limits lower.
+        base_load = {}
+        for phase, site_current in self.p1_monitor.phase_currents().items():
+            ev_current = sum(transaction.phase_currents.get(phase, 0.0) for _, transaction in sessions)
+            base_load[phase] = max(0.0, (site_current or 0.0) - ev_current)
+        return max(0.0, min(self.fuse_rating - self.safety_margin - load for load in base_load.values()))
+
+    def allocate(self, available, count):
+        """Split `available` amps over `count` sessions; sessions are in the order they are served."""
+        if count == 0:
+            return []
+        if self.policy == "priority":
+            limits = []
+            for _ in range(count):
+                limit = min(self.max_current, available)
+                limit = limit if limit >= self.min_current else 0.0
+                limits.append(limit)
+                available -= limit
+            return limits
+
+        share = available / count
+        if share >= self.min_current:
+            return [min(self.max_current, math.floor(share * 10) / 10)] * count
+        # Not enough for everyone: serve as many sessions as possible with the minimum
+        served = int(available // self.min_current)
+        return [float(self.min_current)] * served + [0.0] * (count - served)
+
+    async def step(self):
+        sessions = self.active_sessions()
+        if not sessions:
+            return
+
+        available = self.available_current(sessions)
+        if available is None:
+            return  # No P1 meter readings yet, leave the chargers alone
+
+        limits = self.allocate(available, len(sessions))
+        raise_limits = self.allocate(max(0.0, available - self.hysteresis), len(sessions))
+        now = time.monotonic()
+
+        for (charge_point, transaction), limit, raise_limit in zip(sessions, limits, raise_limits):
+            connector_id = transaction.connector_id
+            key = (charge_point.id, connector_id)
+            # Compare with the limit on its way, so a slow station isn't sent the same change twice
+            current_limit = charge_point.limit_sender.target_limit(connector_id)
+            if current_limit is None or limit < current_limit:
+                new_limit = limit
+            elif raise_limit > current_limit and now - self._raised_at.get(key, 0) >= self.raise_interval:
+                new_limit = raise_limit
+            else:
+                continue
+
+            if current_limit is not None and abs(new_limit - current_limit) < self.min_change:
+                continue
+            if current_limit is not None and new_limit > current_limit:
+                self._raised_at[key] = now
+
+            charge_point.log.info("Load balancing: %s connector %s %sA → %sA (available %.1fA for %s sessions)", charge_point.id, connector_id,
+                                  current_limit, new_limit, available, len(sessions), extra=RATE_LIMITED)
+            charge_point.limit_sender.submit(connector_id, new_limit, ChargingRateUnitType.amps)
+
+        # Forget sessions that ended
+        active = {(charge_point.id, transaction.connector_id) for charge_point, transaction in sessions}
+        for key in [key for key in self._raised_at if key not in active]:
+            del self._raised_at[key]
+
+    async def _run(self):
+        while True:
+            try:
+                await self.step()
+            except Exception as e:
+                logging.error("❌ Error in site load balancing: %s", e)
+            await asyncio.sleep(self.interval)
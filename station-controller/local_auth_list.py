@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+from ocpp.v16 import call
+from ocpp.v16.enums import AuthorizationStatus, UpdateType, UpdateStatus
+from rfid_manager import authorization_cache
+from charge_point_registry import connected_charge_points
+from persistence import run_db
+from constants import (
+    LOCAL_AUTH_LIST_FILE, LOCAL_AUTH_LIST_CHECK_INTERVAL, LOCAL_AUTH_LIST_HISTORY, LOCAL_AUTH_LIST_CONNECT_DELAY
+)
+
+class LocalAuthList:
+    """
+    Keeps the OCPP Local Authorization List of every station in sync with the
+    cards of the active residents, so stations can authorize a card themselves.
+
+    The list gets a new version whenever the set of authorized RFIDs changes.
+    The version only goes up, also across restarts: the list, its version and
+    the changes of the last `history` versions are kept in `state_file`. A
+    station is asked for its version (GetLocalListVersion) when it connects and
+    receives the changes since that version (SendLocalList, Differential), or
+    the full list when its version is unknown, newer than ours or rejected.
+    Changes to the cards table are pushed to all connected stations.
+    """
+
+    def __init__(self, cache=authorization_cache, registry=connected_charge_points, state_file=LOCAL_AUTH_LIST_FILE,
+                 check_interval=LOCAL_AUTH_LIST_CHECK_INTERVAL, history=LOCAL_AUTH_LIST_HISTORY,
+                 connect_delay=LOCAL_AUTH_LIST_CONNECT_DELAY):
+        self.cache = cache
+        self.registry = registry
+        self.state_file = state_file
+        self.check_interval = check_interval
+        self.history = history
+        self.connect_delay = connect_delay
+
+        self.version = 0
+        self._rfids = set()
+        self._changes = []           # [{"version", "added", "removed"}], oldest first
+        self._station_versions = {}  # station_id -> version the station confirmed
+        self._unsupported = set()    # Stations without a local authorization list
+        self._locks = {}             # station_id -> lock, one sync at a time per station
+        self._task = None
+        self._station_tasks = set()
+
+    def load(self):
+        """ Read the list of the previous run. """
+        try:
+            with open(self.state_file, encoding="utf-8") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error("❌ Could not read the local authorization list %s, starting a new one: %s", self.state_file, e)
+            return
+        self.version = state.get("version", 0)
+        self._rfids = set(state.get("rfids", []))
+        self._changes = state.get("changes", [])
+        logging.info("Loaded local authorization list version %s (%s RFIDs)", self.version, len(self._rfids))
+
+    def update(self):
+        """ Take over the authorized RFIDs of the cache; returns True when that made a new version. """
+        rfids = self.cache.authorized_rfids()
+        if rfids == self._rfids and self.version > 0:
+            return False
+
+        self.version += 1
+        self._changes.append({
+            "version": self.version,
+            "added": sorted(rfids - self._rfids),
+            "removed": sorted(self._rfids - rfids)
+        })
+        del self._changes[:-self.history]
+        self._rfids = rfids
+        self._save()
+        logging.info("Local authorization list version %s: %s RFIDs", self.version, len(rfids))
+        return True
+
+    def changes_since(self, version):
+        """ RFIDs added and removed since a version, or None when that version is unknown. """
+        if version == self.version:
+            return set(), set()
+        known = [change["version"] for change in self._changes]
+        if version <= 0 or version > self.version or version + 1 not in known:
+            return None
+
+        added, removed = set(), set()
+        for change in self._changes:
+            if change["version"] > version:
+                added = (added - set(change["removed"])) | set(change["added"])
+                removed = (removed - set(change["added"])) | set(change["removed"])
+        return added, removed
+
+    def station_connected(self, charge_point):
+        """ Sync the list of a station that just connected, once it had time to send BootNotification. """
+        task = asyncio.create_task(self._sync_after(charge_point, self.connect_delay))
+        self._station_tasks.add(task)
+        task.add_done_callback(self._station_tasks.discard)
+
+    async def sync_station(self, charge_point):
+        """ Bring the list of one station to the current version. Returns True when it is. """
+        station_id = charge_point.id
+        if station_id in self._unsupported or self.version == 0:
+            return False
+
+        async with self._locks.setdefault(station_id, asyncio.Lock()):
+            response = await charge_point.call(call.GetLocalListVersion())
+            if response is None:
+                charge_point.log.warning("GetLocalListVersion failed, not syncing the local authorization list")
+                return False
+            station_version = response.list_version
+            if station_version < 0:
+                # The station has no local authorization list, or it is disabled
+                charge_point.log.info("Local authorization list not available on this station")
+                self._unsupported.add(station_id)
+                return False
+            if station_version == self.version:
+                self._station_versions[station_id] = station_version
+                return True
+
+            version = self.version
+            changes = self.changes_since(station_version)
+            if changes is not None:
+                added, removed = changes
+                status = await self._send(charge_point, version, UpdateType.differential, added, removed)
+                if status == UpdateStatus.accepted:
+                    charge_point.log.info("Local authorization list updated from version %s to %s (+%s, -%s)",
+                                          station_version, version, len(added), len(removed))
+                    self._station_versions[station_id] = version
+                    return True
+                charge_point.log.info("Differential local authorization list update %s, sending the full list", status)
+
+            status = await self._send(charge_point, version, UpdateType.full, self._rfids)
+            if status == UpdateStatus.accepted:
+                charge_point.log.info("Local authorization list version %s sent (%s RFIDs)", version, len(self._rfids))
+                self._station_versions[station_id] = version
+                return True
+            if status == UpdateStatus.not_supported:
+                self._unsupported.add(station_id)
+            charge_point.log.warning("Station did not accept the local authorization list: %s", status)
+            return False
+
+    async def sync_all(self):
+        """ Push the current version to all connected stations. """
+        charge_points = [charge_point for charge_point in self.registry
+                         if self._station_versions.get(charge_point.id) != self.version]
+        results = await asyncio.gather(*(self.sync_station(charge_point) for charge_point in charge_points), return_exceptions=True)
+        for charge_point, result in zip(charge_points, results):
+            if isinstance(result, Exception):
+                charge_point.log.error("Failed to sync the local authorization list: %s", result)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in [self._task, *self._station_tasks] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await run_db(self.cache.refresh_if_changed)
+                if self.update():
+                    await self.sync_all()
+            except Exception as e:
+                logging.error("❌ Error updating the local authorization list: %s", e)
+            await asyncio.sleep(self.check_interval)
+
+    async def _sync_after(self, charge_point, delay):
+        await asyncio.sleep(delay)
+        if self.registry.get(charge_point.id) is not charge_point:
+            return  # Disconnected (or replaced) in the meantime
+        try:
+            await self.sync_station(charge_point)
+        except Exception as e:
+            charge_point.log.error("Failed to sync the local authorization list: %s", e)
+
+    @staticmethod
+    async def _send(charge_point, version, update_type, rfids, removed=()):
+        entries = [{"id_tag": rfid, "id_tag_info": {"status": AuthorizationStatus.accepted}} for rfid in sorted(rfids)]
+        # In a differential update, an entry without id_tag_info removes the RFID
+        entries += [{"id_tag": rfid} for rfid in sorted(removed)]
+        response = await charge_point.call(call.SendLocalList(
+            list_version=version,
+            update_type=update_type,
+            local_authorization_list=entries
+        ))
+        return response.status if response is not None else UpdateStatus.failed
+
+    def _save(self):
+        """ Write the state file atomically, so a crash never leaves a version without its list. """
+        state = {"version": self.version, "rfids": sorted(self._rfids), "changes": self._changes}
+        temp_path = self.state_file + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.state_file)
+        except OSError as e:
+            logging.error("❌ Could not save the local authorization list %s: %s", self.state_file, e)
+
+local_auth_list = LocalAuthList()
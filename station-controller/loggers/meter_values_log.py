@@ -1,47 +1,197 @@
+import asyncio
 import csv
-import os
+import gzip
+import io
 import logging
-from constants import METER_VALUES_CSV
+import os
+import shutil
+from datetime import datetime
+from constants import (
+    METER_ARCHIVE_DIRECTORY, METER_ARCHIVE_FLUSH_INTERVAL, METER_ARCHIVE_FLUSH_BYTES,
+    METER_ARCHIVE_ROTATE_BYTES, METER_ARCHIVE_COMPRESS
+)
 from loggers.file_manager import FileManager
 
+HEADER = ["timestamp", "charge_point_id", "connectorId", "transactionId", "measurand", "phase", "unit", "value", "context", "location", "format"]
+SEGMENT_PREFIX = "meter_values-"
+
 class MeterValuesLog(FileManager):
-    """Logs meter values to a CSV file."""
+    """
+    Archive of every raw meter sample, shared by all charge points.
+
+    Samples are formatted into an in-memory CSV buffer on the event loop. A
+    background task appends the buffer to the current segment every
+    `flush_interval` seconds, or sooner once it holds `flush_bytes`, so a frame
+    costs no system call. The segment file stays open. A new segment starts every
+    day and when the current one exceeds `rotate_bytes`; closed segments are
+    gzipped in the background. When a write fails, the samples go back in front
+    of the buffer and are written with the next flush, in a new segment.
+
+    Segments are named meter_values-<YYYY-MM-DD>-<HHMMSS>.csv(.gz), after the
+    time they were started.
+    """
+
+    def __init__(self, directory=METER_ARCHIVE_DIRECTORY, flush_interval=METER_ARCHIVE_FLUSH_INTERVAL,
+                 flush_bytes=METER_ARCHIVE_FLUSH_BYTES, rotate_bytes=METER_ARCHIVE_ROTATE_BYTES, compress=METER_ARCHIVE_COMPRESS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.rotate_bytes = rotate_bytes
+        self.compress = compress
+
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._file = None
+        self._file_day = None
+        self._file_size = 0
+        self._wakeup = None
+        self._stopping = False
+        self._task = None
+        self._compressions = set()
+
+    def log_meter_values(self, station_id, connector_id, transaction_id, meter_values):
+        """ Buffer all samples of a MeterValues request; returns the number of samples. """
+        entries_logged = 0
+        for meter_value in meter_values:
+            timestamp = meter_value.get("timestamp", "")
+            for sample in meter_value.get("sampled_value", []):
+                self._writer.writerow([
+                    timestamp, station_id, connector_id, transaction_id,
+                    sample.get("measurand", "Energy.Active.Import.Register"),  # The OCPP default
+                    sample.get("phase", ""),
+                    sample.get("unit", ""),
+                    sample.get("value", ""),
+                    sample.get("context", ""),
+                    sample.get("location", ""),
+                    sample.get("format", ""),
+                ])
+                entries_logged += 1
+
+        if self._buffer.tell() >= self.flush_bytes and self._wakeup is not None:
+            self._wakeup.set()
+        return entries_logged
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            if self.compress:
+                # Segments left open by the previous run
+                for file_path in self._uncompressed_segments():
+                    self._compress_in_background(file_path)
+
+    async def stop(self):
+        """ Write out the buffer, close the segment and wait for running compressions. """
+        if self._task:
+            # Let a running write finish instead of cancelling it halfway
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, self._close)
+        if self._compressions:
+            await asyncio.gather(*self._compressions, return_exceptions=True)
 
-    def __init__(self, charge_point_id):
-        self.file_path = self._ensure_file_exists(METER_VALUES_CSV)
-        self._ensure_file_exists()
-        self._ensure_header()
-        self.charge_point_id = charge_point_id
+    async def flush(self):
+        data = self._buffer.getvalue()
+        if not data:
+            return
+        # A new buffer, so the event loop can keep adding samples during the write
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
 
-    def log_meter_values(self, connector_id, transaction_id, meter_values):
-        """Logs meter values to the CSV file."""
         try:
-            with open(self.file_path, mode='a', newline='', encoding="utf-8") as file:
-                writer = csv.writer(file)
-
-                entries_logged = 0
-                for meter_value in meter_values:
-                    timestamp = meter_value.get("timestamp")
-                    sampled_values = meter_value.get("sampledValue", [])
-
-                    for sample in sampled_values:
-                        measurand = sample.get("measurand", "Unknown")
-                        phase = sample.get("phase", "")  # Keep empty instead of "N/A"
-                        unit = sample.get("unit", "")
-                        value = sample.get("value", "0")
-                        context = sample.get("context", "")
-
-                        writer.writerow([timestamp, self.charge_point_id, connector_id, transaction_id, measurand, phase, unit, value, context])
-                        entries_logged += 1
-
-            logging.info(f"Logged {entries_logged} MeterValues for connector {connector_id}, transaction {transaction_id}")
-
-        except Exception as e:
-            logging.error(f"Error logging MeterValues: {e}")
-
-    def _ensure_header(self):
-        """Ensure CSV has a header row."""
-        if os.stat(self.file_path).st_size == 0:
-            with open(self.file_path, "w", newline="", encoding="utf-8") as file:
-                writer = csv.writer(file)
-                writer.writerow(["timestamp", "charge_point_id", "connectorId", "transactionId", "measurand", "phase", "unit", "value", "context"])
+            closed = await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except Exception:
+            # Back in front of the samples buffered during the write
+            buffered = self._buffer.getvalue()
+            self._buffer = io.StringIO()
+            self._buffer.write(data + buffered)
+            self._writer = csv.writer(self._buffer)
+            raise
+        if closed and self.compress:
+            self._compress_in_background(closed)
+
+    def _compress_in_background(self, file_path):
+        task = asyncio.get_running_loop().run_in_executor(None, self._compress, file_path)
+        self._compressions.add(task)
+        task.add_done_callback(self._compressions.discard)
+
+    def _uncompressed_segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".csv")
+        ]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error("❌ Error writing the meter values archive, retrying with the next flush: %s", e)
+
+    def _write(self, data):
+        """ Append to the current segment, rotating first when needed. Returns the path of a closed segment. """
+        closed = None
+        today = datetime.now().strftime("%Y-%m-%d")
+        if self._file is not None and (today != self._file_day or self._file_size >= self.rotate_bytes):
+            closed = self._close()
+        if self._file is None:
+            self._open(today)
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except BaseException:
+            # Never append after a row that may have been written halfway
+            try:
+                self._close()
+            except OSError:
+                self._file = None
+            raise
+        self._file_size += len(data)
+        return closed
+
+    def _open(self, day):
+        name = f"{SEGMENT_PREFIX}{day}-{datetime.now().strftime('%H%M%S')}"
+        file_path = os.path.join(self.directory, f"{name}.csv")
+        suffix = 1
+        while os.path.exists(file_path) or os.path.exists(file_path + ".gz"):
+            # Never append to a segment that may be being compressed
+            file_path = os.path.join(self.directory, f"{name}-{suffix}.csv")
+            suffix += 1
+        self._ensure_file_exists(file_path)
+        self._file = open(file_path, "a", newline="", encoding="utf-8")
+        self._file_day = day
+        self._file_size = self._file.tell()
+        if self._file_size == 0:
+            csv.writer(self._file).writerow(HEADER)
+            self._file_size = self._file.tell()
+
+    def _close(self):
+        if self._file is None:
+            return None
+        file_path = self._file.name
+        self._file.close()
+        self._file = None
+        return file_path
+
+    @staticmethod
+    def _compress(file_path):
+        try:
+            with open(file_path, "rb") as source, gzip.open(file_path + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(file_path)
+            logging.info("Compressed meter values segment %s", file_path)
+        except OSError as e:
+            logging.error("❌ Could not compress meter values segment %s: %s", file_path, e)
+
+meter_values_log = MeterValuesLog()
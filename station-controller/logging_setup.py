@@ -0,0 +1,133 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from collections import OrderedDict
+from constants import (
+    LOG_LEVEL, LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS, LOG_FORMAT, LOG_RATE_LIMIT, LOG_RATE_INTERVAL, LOG_RATE_WINDOWS
+)
+
+STATION_LOGGER_PREFIX = "station."
+
+# Pass as `extra` to rate limit a message that is logged for every frame, e.g. MeterValues
+RATE_LIMITED = {"rate_limited": True}
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per message per logger per `interval`
+    seconds, of the info messages logged with `extra=RATE_LIMITED`: the ones
+    logged for every frame. Other records, such as transaction starts and stops,
+    always pass.
+
+    Messages are told apart by their %-style template, so "Logged %d MeterValues
+    for connector %s" is one message for all frames of a station; every station
+    has its own logger, so one busy station doesn't silence the others. The
+    number of dropped records is added to the next one that gets through. At
+    most `windows` (logger, message) pairs are counted; the least recently used
+    are forgotten.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL, windows=LOG_RATE_WINDOWS):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.windows = windows
+        self._windows = OrderedDict()  # (logger name, template) -> [window start, records, suppressed]
+
+    def filter(self, record):
+        if record.levelno != logging.INFO or not getattr(record, "rate_limited", False):
+            return True
+
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        window = self._windows.get(key)
+        if window is not None:
+            self._windows.move_to_end(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            while len(self._windows) > self.windows:
+                self._windows.popitem(last=False)
+            if suppressed:
+                record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            return True
+
+        if window[1] < self.limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting to the listener thread. The standard
+    one formats every record before queueing it, on the event loop.
+    """
+
+    def prepare(self, record):
+        # The queue doesn't leave the process, so the record needs no pickling
+        return record
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """
+    Configure logging for the station controller, once, at startup.
+
+    Records are put on a queue by the event loop; a background thread formats them
+    and writes them to stdout (and the log file), so slow I/O never blocks the loop.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # The ocpp library logs every message it sends and receives at INFO
+    logging.getLogger("ocpp").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """ Write out the queued records and stop the background thread. """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def station_logger(station_id):
+    """ The logger of one charging station, so its debug logging can be switched on by itself. """
+    return logging.getLogger(f"{STATION_LOGGER_PREFIX}{station_id}")
+
+def set_station_debug(station_id, enabled):
+    """ Switch debug logging of one station on or off at runtime. """
+    station_logger(station_id).setLevel(logging.DEBUG if enabled else logging.NOTSET)
+    logging.info("Debug logging %s for station %s", "enabled" if enabled else "disabled", station_id)
+
+def debug_stations():
+    """ Stations that have debug logging switched on. """
+    return sorted(
+        name[len(STATION_LOGGER_PREFIX):]
+        for name, logger in logging.Logger.manager.loggerDict.items()
+        if name.startswith(STATION_LOGGER_PREFIX) and isinstance(logger, logging.Logger) and logger.level == logging.DEBUG
+    )
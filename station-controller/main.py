@@ -2,31 +2,103 @@ import asyncio
 import logging
 import websockets
 from charge_point import ChargePoint
+from charge_point_registry import connected_charge_points
 from init_db import init_database
+from persistence import run_db, shutdown_db_executor
+from event_journal import event_journal
+from workers import Supervisor, replay_worker_journals
+from local_auth_list import local_auth_list
+from refused_card_service import refused_card_recorder
+from status_publisher import status_publisher
+from loggers.meter_values_log import meter_values_log
+from timeseries_store import timeseries_store
+from active_transactions import active_transactions
+from p1_monitor import P1Monitor
+from load_balancer import SiteLoadBalancer
+from metrics import LoopLagMonitor, MetricsServer
+from logging_setup import setup_logging, stop_logging
+from constants import LOAD_BALANCING_ENABLED, METRICS_ENABLED, LOCAL_AUTH_LIST_ENABLED, WEBSOCKET_HOST, WEBSOCKET_PORT, CONTROLLER_WORKERS
 
-# Configure logging - set OCPP library to DEBUG to reduce noise, keep our app at INFO
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# Set OCPP library logging to DEBUG to reduce the SetChargingProfile message noise
-logging.getLogger('ocpp').setLevel(logging.WARNING)
-
-async def on_connect(websocket, path="no_station"):
+async def on_connect(websocket, path=None):
     """ Handle new charge point connections. """
-    logging.info(f"On Connect {path}")
-    charge_point_id = path.strip('/')
-    logging.info(f"New ChargePoint connected: {charge_point_id}")
+    if path is None:
+        # websockets >= 14 no longer passes the path to the handler
+        request = getattr(websocket, "request", None)
+        path = request.path if request else "no_station"
+    logging.info("On Connect %s", path)
+    charge_point_id = connected_charge_points.resolve(path.strip('/'))
+    logging.info("New ChargePoint connected: %s", charge_point_id)
 
     cp = ChargePoint(charge_point_id, websocket)
-    await cp.start()
+    connected_charge_points.register(cp)
+    if LOCAL_AUTH_LIST_ENABLED:
+        local_auth_list.station_connected(cp)
+    try:
+        await cp.start()
+    except websockets.exceptions.ConnectionClosed:
+        logging.info("ChargePoint %s disconnected", cp.id)
+    finally:
+        connected_charge_points.unregister(cp)
+        await cp.limit_sender.stop()
 
 async def main():
+    # Log records are written by a background thread, see logging_setup.py
+    setup_logging()
+
     # Initialize database
     init_database()
     logging.info("Database initialized")
+    # Apply what the previous run journaled but didn't store, before loading the open transactions
+    await replay_worker_journals()
+    await event_journal.open()
+    await event_journal.replay()
+    await run_db(active_transactions.load)
+    event_journal.start()
+    status_publisher.start()
+    meter_values_log.start()
+    timeseries_store.start()
+
+    if LOCAL_AUTH_LIST_ENABLED:
+        local_auth_list.load()
+        local_auth_list.start()
+
+    loop_lag_monitor = LoopLagMonitor()
+    metrics_server = MetricsServer(refused_cards=refused_card_recorder)
+    if METRICS_ENABLED:
+        loop_lag_monitor.start()
+        await metrics_server.start()
+
+    p1_monitor = P1Monitor()
+    load_balancer = SiteLoadBalancer(p1_monitor)
+    if LOAD_BALANCING_ENABLED:
+        p1_monitor.start()
+        load_balancer.start()
     
-    server = await websockets.serve(on_connect, '0.0.0.0', 9000, subprotocols=['ocpp1.6'])
-    logging.info("WebSocket Server Started on ws://0.0.0.0:9000")
-    await server.wait_closed()
+    server = await websockets.serve(on_connect, WEBSOCKET_HOST, WEBSOCKET_PORT, subprotocols=['ocpp1.6'])
+    logging.info("WebSocket Server Started on ws://%s:%s", WEBSOCKET_HOST, WEBSOCKET_PORT)
+    try:
+        await server.wait_closed()
+    finally:
+        await metrics_server.stop()
+        await loop_lag_monitor.stop()
+        await load_balancer.stop()
+        await p1_monitor.stop()
+        await local_auth_list.stop()
+        await status_publisher.stop()
+        await meter_values_log.stop()
+        await timeseries_store.stop()
+        await event_journal.stop()
+        shutdown_db_executor()
+        stop_logging()
+
+def run(workers=CONTROLLER_WORKERS):
+    if workers > 1:
+        supervisor = Supervisor(workers)
+        # Fork the workers before this process starts any threads
+        supervisor.spawn()
+        asyncio.run(supervisor.run())
+    else:
+        asyncio.run(main())
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    run()
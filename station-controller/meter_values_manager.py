@@ -1,24 +1,39 @@
 import logging
-import json
-from power_log_service import PowerLogService
-
-METER_VALUES_JSON = "/var/www/html/meter_values.json"
+from datetime import datetime
+from event_journal import event_journal
+from status_publisher import status_publisher
+from loggers.meter_values_log import meter_values_log
+from timeseries_store import timeseries_store
+from logging_setup import RATE_LIMITED
 
 class MeterValuesManager:
-    """Manages logging of meter values to a condensed JSON file."""
+    """Manages logging of meter values to the raw sample archive, the time series, the status publisher and the power logs."""
 
-    def __init__(self, json_path=METER_VALUES_JSON, charge_point=None):
-        self.json_path = json_path
+    def __init__(self, charge_point=None, publisher=status_publisher, archive=meter_values_log, timeseries=timeseries_store,
+                 journal=event_journal):
         self.charge_point = charge_point
+        self.publisher = publisher
+        self.archive = archive
+        self.timeseries = timeseries
+        self.journal = journal
 
-    def log_meter_values(self, connector_id, transaction_id, meter_values):
-        """Logs meter values to the condensed JSON file."""
+    async def log_meter_values(self, connector_id, transaction_id, meter_values):
+        """Logs meter values to the condensed status snapshot and the power logs."""
+        log = self.charge_point.log if self.charge_point else logging.getLogger()
         try:
             if not meter_values:
-                logging.warning("No meter values provided to log.")
+                log.warning("No meter values provided to log.")
                 return
 
-            logging.debug(f"Received meter_values: {meter_values}")
+            log.debug("Received meter_values: %s", meter_values)
+
+            station_id = self.charge_point.id if self.charge_point else "unknown"
+            # Every sample, including voltages and currents, goes to the archive
+            self.archive.log_meter_values(station_id, connector_id, transaction_id, meter_values)
+            try:
+                self.timeseries.append_meter_values(station_id, connector_id, meter_values)
+            except Exception as e:
+                log.error("Failed to store meter values in the time series: %s", e)
 
             entries_logged = 0
             condensed_data = {
@@ -41,7 +56,7 @@ class MeterValuesManager:
                 sampled_values = meter_value.get("sampled_value", [])
 
                 if not sampled_values:
-                    logging.warning(f"No sampled_value found in meter_value: {meter_value}")
+                    log.warning("No sampled_value found in meter_value: %s", meter_value)
                     continue
 
                 for sample in sampled_values:
@@ -65,18 +80,33 @@ class MeterValuesManager:
                         elif measurand == "Energy.Active.Import.Register" and unit == "kWh":
                             energy_kwh = float_value
                     except (ValueError, TypeError):
-                        logging.warning(f"Could not convert value '{value}' to float for measurand '{measurand}'")
+                        log.warning("Could not convert value '%s' to float for measurand '%s'", value, measurand)
+
+            # Latest readings of the transaction, for the load balancer and the status files
+            # Current.Import per phase ("L1" or "L1-N"); one without a phase can't be placed on a phase
+            phase_currents = {
+                key.rsplit(".", 1)[1][:2]: value for key, value in condensed_data["data"].items()
+                if key.startswith("Current.Import.L")
+            }
+            if self.charge_point and transaction_id is not None:
+                self.charge_point.transactions.record_meter_values(
+                    transaction_id, station_id, connector_id,
+                    energy_kwh=energy_kwh,
+                    power_kw=power_kw,
+                    phase_currents=phase_currents,
+                    timestamp=condensed_data["timestamp"]
+                )
 
             # Add charging profile information if available
             if self.charge_point:
                 try:
-                    profile_status = self.charge_point.get_dynamic_load_status()
-                    condensed_data["chargingProfile"]["currentMaxPower"] = profile_status["current_power_limit"]
-                    logging.debug(f"Added charging profile info: {profile_status['current_power_limit']}A")
+                    power_limit = self.charge_point.get_power_limit(connector_id)
+                    condensed_data["chargingProfile"]["currentMaxPower"] = power_limit
+                    log.debug("Added charging profile info: %sA", power_limit)
                 except Exception as e:
-                    logging.warning(f"Failed to get charging profile status: {e}")
+                    log.warning("Failed to get charging profile status: %s", e)
             
-            self._write_condensed_json(condensed_data)
+            self.publisher.update(station_id, connector_id, condensed_data)
             
             # Create PowerLog record if we have power or energy data
             if power_kw is not None or energy_kwh is not None:
@@ -87,35 +117,22 @@ class MeterValuesManager:
                     
                     # Skip creating power log if energy drops to zero (end of charging)
                     if energy_kwh == 0.0:
-                        logging.debug(f"Skipping PowerLog creation for transaction {transaction_id}: energy dropped to zero (end of charging)")
+                        log.debug("Skipping PowerLog creation for transaction %s: energy dropped to zero (end of charging)", transaction_id)
                     else:
-                        PowerLogService.create_power_log(
-                            charge_transaction_id=transaction_id,
+                        # On disk before the response; the journal stores it in the database
+                        await self.journal.record(
+                            "power_log",
+                            transaction_id=transaction_id,
+                            created=datetime.utcnow().isoformat(),
                             power_kw=power_kw,
                             energy_kwh=energy_kwh
                         )
                         
-                        # Update the transaction's final_energy_kwh with the latest energy value
-                        if energy_kwh is not None and energy_kwh > 0:
-                            PowerLogService.update_transaction_final_energy(
-                                transaction_id=transaction_id,
-                                final_energy_kwh=energy_kwh
-                            )
-                        
-                        logging.info(f"Created PowerLog record for transaction {transaction_id}: power_kw={power_kw}, energy_kwh={energy_kwh}")
+                        log.debug("Journaled PowerLog record for transaction %s: power_kw=%s, energy_kwh=%s", transaction_id, power_kw, energy_kwh)
                 except Exception as e:
-                    logging.error(f"Failed to create PowerLog record for transaction {transaction_id}: {e}")
+                    log.error("Failed to create PowerLog record for transaction %s: %s", transaction_id, e)
 
-            logging.info(f"Logged {entries_logged} MeterValues for connector {connector_id}, transaction {transaction_id}")
+            log.info("Logged %s MeterValues for connector %s, transaction %s", entries_logged, connector_id, transaction_id, extra=RATE_LIMITED)
 
         except Exception as e:
-            logging.exception("Error logging MeterValues")
-
-    def _write_condensed_json(self, data):
-        """Writes condensed meter values to a JSON file."""
-        try:
-            with open(self.json_path, mode='w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
-            logging.debug(f"Wrote condensed JSON to {self.json_path}")
-        except Exception:
-            logging.exception("Failed to write condensed JSON.") 
+            log.exception("Error logging MeterValues")
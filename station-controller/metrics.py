@@ -0,0 +1,279 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import unquote
+from logging_setup import set_station_debug, debug_stations
+from constants import METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL
+
+# Upper bounds of the latency buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class Histogram:
+    """ Counts observations in fixed latency buckets, like a Prometheus histogram. """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket). """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(float(bound), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5), 3),
+            "p95_ms": round(self.quantile(0.95), 3),
+            "p99_ms": round(self.quantile(0.99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+class ActionMetrics:
+    """ Count, errors and latency of one OCPP action for one station. """
+
+    def __init__(self):
+        self.errors = 0
+        self.latency = Histogram()
+
+    def observe(self, value_ms, error=False):
+        self.latency.observe(value_ms)
+        if error:
+            self.errors += 1
+
+class Metrics:
+    """
+    In-process metrics of the station controller.
+
+    - handled: incoming OCPP calls, per (action, station), timed around the @on() handler
+    - sent: outgoing OCPP calls (SetChargingProfile, ...), per (action, station), CALL to CALLRESULT
+    - db: time spent on the database thread per operation, and how long work waited for it
+    - loop_lag: how late a timer on the event loop fires
+
+    The db metrics are observed on the database thread, the others on the event loop.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.handled = defaultdict(ActionMetrics)  # (action, station_id) -> ActionMetrics
+        self.sent = defaultdict(ActionMetrics)     # (action, station_id) -> ActionMetrics
+        self.db = defaultdict(ActionMetrics)       # operation -> ActionMetrics
+        self.db_wait = Histogram()
+        self.loop_lag = Histogram()
+        self._db_lock = threading.Lock()  # Guards db and db_wait, observed on the database thread
+
+    def observe_handled(self, action, station_id, value_ms, error=False):
+        self.handled[(action, station_id)].observe(value_ms, error)
+
+    def observe_sent(self, action, station_id, value_ms, error=False):
+        self.sent[(action, station_id)].observe(value_ms, error)
+
+    def observe_db(self, operation, wait_ms, value_ms, error=False):
+        with self._db_lock:
+            self.db_wait.observe(wait_ms)
+            self.db[operation].observe(value_ms, error)
+
+    def snapshot(self):
+        """ All metrics as a JSON-serializable dict. """
+        def actions(table):
+            result = defaultdict(dict)
+            for (action, station_id), metrics in table.items():
+                result[action][station_id] = dict(metrics.latency.summary(), errors=metrics.errors)
+            return result
+
+        with self._db_lock:
+            db = {operation: dict(m.latency.summary(), errors=m.errors) for operation, m in list(self.db.items())}
+            db_wait = self.db_wait.summary()
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "handled": actions(self.handled),
+            "sent": actions(self.sent),
+            "db": db,
+            "db_wait": db_wait,
+            "loop_lag": self.loop_lag.summary(),
+        }
+
+    def render_prometheus(self):
+        """ All metrics in the Prometheus text exposition format. """
+        lines = [f"station_controller_uptime_seconds {time.time() - self.started:.1f}"]
+
+        def histogram(name, histogram, labels=""):
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.3f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        for name, table in (("ocpp_handled", self.handled), ("ocpp_sent", self.sent)):
+            lines.append(f"# TYPE {name}_latency_ms histogram")
+            for (action, station_id), metrics in sorted(table.items()):
+                histogram(f"{name}_latency_ms", metrics.latency, f'action="{action}",station="{station_id}"')
+            lines.append(f"# TYPE {name}_errors_total counter")
+            for (action, station_id), metrics in sorted(table.items()):
+                lines.append(f'{name}_errors_total{{action="{action}",station="{station_id}"}} {metrics.errors}')
+
+        with self._db_lock:
+            db = sorted(list(self.db.items()))
+            lines.append("# TYPE db_operation_ms histogram")
+            for operation, metrics in db:
+                histogram("db_operation_ms", metrics.latency, f'operation="{operation}"')
+            lines.append("# TYPE db_operation_errors_total counter")
+            for operation, metrics in db:
+                lines.append(f'db_operation_errors_total{{operation="{operation}"}} {metrics.errors}')
+            lines.append("# TYPE db_wait_ms histogram")
+            histogram("db_wait_ms", self.db_wait)
+        lines.append("# TYPE event_loop_lag_ms histogram")
+        histogram("event_loop_lag_ms", self.loop_lag)
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def instrument_handlers(charge_point, registry=metrics):
+    """
+    Wrap the @on() handlers in the route map of a charge point, so every incoming
+    call is counted and timed per action and station.
+    """
+    for action, handlers in charge_point.route_map.items():
+        handler = handlers.get("_on_action")
+        if handler is not None:
+            handlers["_on_action"] = _timed_handler(charge_point, action, handler, registry)
+
+def _timed_handler(charge_point, action, handler, registry):
+    # functools.wraps keeps the signature, which the ocpp library inspects
+    @functools.wraps(handler)
+    async def timed(*args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            response = handler(*args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+            return response
+        except Exception:
+            error = True
+            raise
+        finally:
+            registry.observe_handled(action, charge_point.id, (time.perf_counter() - start) * 1000, error)
+    return timed
+
+class LoopLagMonitor:
+    """ Measures how late the event loop runs a timer, which shows blocking code. """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, registry=metrics):
+        self.interval = interval
+        self.registry = registry
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.registry.loop_lag.observe(max(0.0, loop.time() - expected) * 1000)
+
+class MetricsServer:
+    """
+    Minimal HTTP server for the metrics, so they can be read without the FastAPI app.
+
+    GET /metrics                     Prometheus text format
+    GET /metrics.json                the same metrics as JSON
+    GET /debug/stations              stations with debug logging switched on
+    PUT /debug/stations/<station>    switch debug logging of a station on
+    DELETE /debug/stations/<station> and off again
+    GET /debug/refused_cards         the most recent refused RFID swipes, when a recorder is given
+    """
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, registry=metrics, refused_cards=None):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.refused_cards = refused_cards
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info("Metrics available on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Skip the headers, the requests don't need them
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            method = parts[0] if parts else ""
+            path = parts[1] if len(parts) > 1 else ""
+            status, content_type, body = self._route(method, path)
+
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _route(self, method, path):
+        if path == "/metrics" and method == "GET":
+            return "200 OK", "text/plain; version=0.0.4", self.registry.render_prometheus()
+        if path == "/metrics.json" and method == "GET":
+            return "200 OK", "application/json", json.dumps(self.registry.snapshot())
+        if path == "/debug/stations" and method == "GET":
+            return "200 OK", "application/json", json.dumps(debug_stations())
+        if path.startswith("/debug/stations/") and method in ("PUT", "DELETE"):
+            set_station_debug(unquote(path[len("/debug/stations/"):]), method == "PUT")
+            return "200 OK", "application/json", json.dumps(debug_stations())
+        if path == "/debug/refused_cards" and method == "GET" and self.refused_cards is not None:
+            return "200 OK", "application/json", json.dumps(self.refused_cards.recent())
+        if path in ("/metrics", "/metrics.json", "/debug/stations", "/debug/refused_cards") or path.startswith("/debug/stations/"):
+            return "405 Method Not Allowed", "text/plain", "Method not allowed\n"
+        return "404 Not Found", "text/plain", "Not found\n"
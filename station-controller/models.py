@@ -41,6 +41,12 @@ class ChargeTransaction(Base):
     rfid = Column(String, ForeignKey("cards.rfid"), nullable=False)
     created = Column(DateTime(timezone=True), server_default=func.now())
     final_energy_kwh = Column(Float, nullable=True)
+    connector_id = Column(Integer, nullable=True)
+    meter_start = Column(Integer, nullable=True)  # Wh, as sent in StartTransaction
+    meter_stop = Column(Integer, nullable=True)   # Wh, as sent in StopTransaction
+    stopped = Column(DateTime(timezone=True), nullable=True)
+    stop_reason = Column(String, nullable=True)
+    energy_delivered_kwh = Column(Float, nullable=True)
 
     card = relationship("Card", back_populates="charge_transactions")
     power_logs = relationship("PowerLog", back_populates="charge_transaction")
@@ -62,4 +68,12 @@ class RefusedCard(Base):
     id = Column(Integer, primary_key=True, index=True)
     rfid = Column(String, nullable=False)
     station_id = Column(String, nullable=False)
-    created = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created = Column(DateTime(timezone=True), server_default=func.now())
+    count = Column(Integer, nullable=False, default=1)       # Refusals collapsed into this row
+    last_seen = Column(DateTime(timezone=True), nullable=True)  # Time of the latest of them
+
+class EventJournalCheckpoint(Base):
+    __tablename__ = "event_journal_checkpoints"
+
+    journal = Column(String, primary_key=True)
+    sequence = Column(Integer, nullable=False)  # Last journaled event applied to the database
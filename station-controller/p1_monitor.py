@@ -1,59 +1,227 @@
-import serial
+import asyncio
 import logging
 import time
+from collections import deque
+import serial
 from dsmr_parser import telegram_specifications
+from dsmr_parser.clients.telegram_buffer import TelegramBuffer
 from dsmr_parser.parsers import TelegramParser
-from dsmr_parser.clients.serial import SerialReader
+from constants import P1_SERIAL_PORT, P1_BAUDRATE, P1_HISTORY_SIZE, P1_STALE_AFTER
+
+PHASES = ("L1", "L2", "L3")
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent samples.
+
+    The latest value, min, max and mean are kept up to date on every append
+    (min/max with monotonic queues), so reading them is O(1). Percentiles sort
+    the buffer and are meant for reporting rather than control loops.
+    """
+
+    def __init__(self, size=P1_HISTORY_SIZE):
+        self.size = size
+        self._values = [0.0] * size
+        self._count = 0   # Samples appended in total
+        self._sum = 0.0
+        self._min = deque()  # (sample number, value), values increasing
+        self._max = deque()  # (sample number, value), values decreasing
+
+    def append(self, value):
+        index = self._count % self.size
+        if self._count >= self.size:
+            self._sum -= self._values[index]
+        self._values[index] = value
+        self._sum += value
+
+        oldest = self._count - self.size + 1
+        for window, better in ((self._min, lambda a, b: a <= b), (self._max, lambda a, b: a >= b)):
+            while window and better(value, window[-1][1]):
+                window.pop()
+            window.append((self._count, value))
+            while window[0][0] < oldest:
+                window.popleft()
+        self._count += 1
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    @property
+    def latest(self):
+        return self._values[(self._count - 1) % self.size] if self._count else None
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    @property
+    def mean(self):
+        return self._sum / len(self) if self._count else None
+
+    def values(self):
+        """The buffered samples, oldest first."""
+        if self._count <= self.size:
+            return self._values[:self._count]
+        index = self._count % self.size
+        return self._values[index:] + self._values[:index]
+
+    def percentile(self, pct):
+        if not self._count:
+            return None
+        ordered = sorted(self.values())
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
 
-logging.basicConfig(level=logging.INFO)
+    def stats(self):
+        return {
+            "latest": self.latest,
+            "min": self.min,
+            "mean": self.mean,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
 
 class P1Monitor:
-    """ Reads power usage from the P1 smart meter via USB. """
+    """
+    Reads DSMR telegrams from the P1 smart meter without blocking the event loop.
 
-    def __init__(self, usb_port="/dev/ttyUSB0", baudrate=115200):
+    The serial port (or a pty) is read through a non-blocking pipe transport and
+    telegrams are parsed as soon as they are complete. A replay file with
+    recorded telegrams can be used instead of a meter, e.g. for tests. Phase
+    currents (A) and net phase power (kW) are kept in ring buffers, so control
+    logic can read the latest values and site headroom in O(1).
+    """
+
+    def __init__(self, usb_port=P1_SERIAL_PORT, baudrate=P1_BAUDRATE, history_size=P1_HISTORY_SIZE,
+                 replay_file=None, replay_interval=1.0, telegram_specification=telegram_specifications.V5):
         self.usb_port = usb_port
         self.baudrate = baudrate
-        self.serial_reader = None
+        self.replay_file = replay_file
+        self.replay_interval = replay_interval
 
-    def connect(self):
-        """ Connect to the P1 meter via USB. """
-        try:
-            self.serial_reader = SerialReader(
-                device=self.usb_port,
-                serial_settings={
-                    "baudrate": self.baudrate,
-                    "bytesize": serial.EIGHTBITS,
-                    "parity": serial.PARITY_NONE,
-                    "stopbits": serial.STOPBITS_ONE,
-                    "xonxoff": 0
-                },
-                telegram_specification=telegram_specifications.V5
-            )
-            logging.info(f"Connected to P1 meter on {self.usb_port}")
-        except Exception as e:
-            logging.error(f"Failed to connect to P1 meter: {e}")
-            self.serial_reader = None
+        self.currents = {phase: RingBuffer(history_size) for phase in PHASES}
+        self.power = {phase: RingBuffer(history_size) for phase in PHASES}
+        self.last_update = None  # time.monotonic() of the last telegram
+        self.telegrams = 0
 
-    def read_power_usage(self):
-        """ Reads power consumption per phase. """
-        if not self.serial_reader:
-            logging.error("P1 meter not connected!")
-            return
+        self._parser = TelegramParser(telegram_specification)
+        self._buffer = TelegramBuffer()
+        self._task = None
 
-        try:
-            for telegram in self.serial_reader.read():
-                phase_1_current = telegram.P1_POWER_CURRENT_L1.value
-                phase_2_current = telegram.P1_POWER_CURRENT_L2.value
-                phase_3_current = telegram.P1_POWER_CURRENT_L3.value
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_stale(self, max_age=P1_STALE_AFTER):
+        return self.last_update is None or time.monotonic() - self.last_update > max_age
+
+    def phase_currents(self):
+        """Latest current per phase in A, e.g. {"L1": 12.0, "L2": 4.0, "L3": 7.0}."""
+        return {phase: buffer.latest for phase, buffer in self.currents.items()}
+
+    def max_phase_current(self):
+        """Latest current of the most loaded phase in A, or None without readings."""
+        if self.last_update is None:
+            return None
+        return max(buffer.latest for buffer in self.currents.values())
 
-                logging.info(f"Current usage - L1: {phase_1_current}A, L2: {phase_2_current}A, L3: {phase_3_current}A")
-                time.sleep(1)  # Read every second
+    def headroom(self, fuse_rating):
+        """Amps left on the most loaded phase before reaching `fuse_rating`, or None when stale."""
+        if self.is_stale():
+            return None
+        return fuse_rating - self.max_phase_current()
 
-        except Exception as e:
-            logging.error(f"Error reading P1 meter: {e}")
+    def stats(self):
+        return {
+            "currents": {phase: buffer.stats() for phase, buffer in self.currents.items()},
+            "power": {phase: buffer.stats() for phase, buffer in self.power.items()},
+            "telegrams": self.telegrams,
+            "age": None if self.last_update is None else time.monotonic() - self.last_update,
+        }
+
+    def feed(self, data):
+        """Add raw telegram data and process every telegram that is complete."""
+        self._buffer.append(data)
+        for telegram in self._buffer.get_all():
+            try:
+                self._record(self._parser.parse(telegram))
+            except Exception as e:
+                logging.warning("Skipping P1 telegram that could not be parsed: %s", e)
+
+    def _record(self, telegram):
+        for number, phase in enumerate(PHASES, start=1):
+            current = getattr(telegram, f"INSTANTANEOUS_CURRENT_L{number}", None)
+            imported = getattr(telegram, f"INSTANTANEOUS_ACTIVE_POWER_L{number}_POSITIVE", None)
+            exported = getattr(telegram, f"INSTANTANEOUS_ACTIVE_POWER_L{number}_NEGATIVE", None)
+            self.currents[phase].append(float(current.value) if current else 0.0)
+            self.power[phase].append(
+                (float(imported.value) if imported else 0.0) - (float(exported.value) if exported else 0.0)
+            )
+        self.last_update = time.monotonic()
+        self.telegrams += 1
+        logging.debug("P1 currents: %s", self.phase_currents())
+
+    async def _run(self):
+        while True:
+            try:
+                if self.replay_file:
+                    await self._replay()
+                else:
+                    await self._read_serial()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Error reading P1 meter on %s: %s", self.replay_file or self.usb_port, e)
+            await asyncio.sleep(5)  # Reconnect delay
+
+    async def _read_serial(self):
+        """Read the serial port (or a pty) through a non-blocking pipe transport."""
+        port = serial.Serial(
+            self.usb_port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            xonxoff=False,
+            timeout=0
+        )
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), port)
+        logging.info("Connected to P1 meter on %s", self.usb_port)
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    raise ConnectionError("P1 serial port closed")
+                self.feed(data.decode("ascii", errors="replace"))
+        finally:
+            transport.close()
+            port.close()
 
-    def start_monitoring(self):
-        """ Starts monitoring power usage in a loop. """
-        self.connect()
+    async def _replay(self):
+        """Feed recorded telegrams one at a time, `replay_interval` seconds apart, looping forever."""
+        with open(self.replay_file, encoding="ascii", errors="replace", newline="") as f:
+            recording = TelegramBuffer()
+            recording.append(f.read())
+        telegrams = list(recording.get_all())
+        if not telegrams:
+            raise ValueError("replay file contains no telegrams")
+        logging.info("Replaying %s P1 telegrams from %s", len(telegrams), self.replay_file)
         while True:
-            self.read_power_usage()
+            for telegram in telegrams:
+                self.feed(telegram)
+                await asyncio.sleep(self.replay_interval)
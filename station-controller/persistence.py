@@ -0,0 +1,36 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from metrics import metrics
+
+# SQLite allows a single writer at a time, so all database work is funneled
+# through one dedicated thread. The event loop only awaits the result, which
+# keeps a slow commit from stalling the websockets of other charge points.
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """ Run a synchronous database function on the database thread and await its result. """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(_timed, func, time.perf_counter(), *args, **kwargs))
+
+def _timed(func, queued, *args, **kwargs):
+    """ Record how long the work waited for the database thread and how long it took. """
+    start = time.perf_counter()
+    error = False
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.observe_db(
+            getattr(func, "__qualname__", repr(func)),
+            (start - queued) * 1000,
+            (time.perf_counter() - start) * 1000,
+            error
+        )
+
+def shutdown_db_executor(wait=True):
+    """ Finish queued database work and stop the database thread. """
+    _db_executor.shutdown(wait=wait)
@@ -1,19 +1,33 @@
-from models import RefusedCard
-from database import SessionLocal
+import logging
+from collections import deque
+from datetime import datetime
+from event_journal import event_journal
+from constants import REFUSED_CARD_RECENT_SIZE
 
-class RefusedCardService:
-    @staticmethod
-    def create_refused_card(station_id: str, rfid: str) -> RefusedCard:
-        """Create a new refused card entry in the database."""
-        db = SessionLocal()
-        try:
-            refused_card = RefusedCard(
-                station_id=station_id,
-                rfid=rfid
-            )
-            db.add(refused_card)
-            db.commit()
-            db.refresh(refused_card)
-            return refused_card
-        finally:
-            db.close()
+class RefusedCardRecorder:
+    """
+    Records refused RFID swipes, shared by all charge points.
+
+    Every refusal is appended to the event journal, so it survives a crash or a
+    database outage. The journal writes the refusals in batches and collapses
+    refusals of the same card at the same station within REFUSED_CARD_WINDOW
+    into one refused_cards row with a count and the time it was last seen. The
+    most recent refusals are also kept in memory, newest last, see `recent`.
+    """
+
+    def __init__(self, journal=event_journal, recent_size=REFUSED_CARD_RECENT_SIZE):
+        self.journal = journal
+        self._recent = deque(maxlen=recent_size)
+
+    def record(self, station_id, rfid):
+        now = datetime.utcnow()
+        # Not waited for: the station doesn't need the refusal on disk before its response
+        self.journal.append("refused", station_id=station_id, rfid=rfid, created=now.isoformat())
+        self._recent.append({"station_id": station_id, "rfid": rfid, "timestamp": now.isoformat()})
+        logging.debug("RFID %s refused at %s", rfid, station_id)
+
+    def recent(self, station_id=None):
+        """ The most recent refusals, newest first, optionally of one station. """
+        return [refusal for refusal in reversed(self._recent) if station_id is None or refusal["station_id"] == station_id]
+
+refused_card_recorder = RefusedCardRecorder()
@@ -1,47 +1,177 @@
+import hashlib
 import logging
+import sqlite3
+import threading
+import time
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, engine
 from models import Card, Resident, ResidentStatus
-from refused_card_service import RefusedCardService
+from refused_card_service import refused_card_recorder
+from persistence import run_db
+from constants import AUTH_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL, AUTH_CACHE_POLL_INTERVAL
 
-logging.basicConfig(level=logging.INFO)
+def normalize_rfid(rfid_tag):
+    """ Normalize an RFID tag the way it is stored in the cards table. """
+    return rfid_tag.strip().upper()
+
+class AuthorizationCache:
+    """
+    In-memory view of the RFIDs that may charge, shared by all charge points.
+
+    Positive entries are the cards of all active residents, loaded in one query.
+    Negative entries remember refused tags for a short while, so repeated swipes
+    of an unknown card don't hit the database, until they expire. The cache
+    reloads when the fingerprint of the authorized cards changes (a card or an
+    active resident added, removed, changed or reassigned, or a resident
+    renamed), and at least every `ttl` seconds.
+    """
+
+    def __init__(self, ttl=AUTH_CACHE_TTL, negative_ttl=AUTH_CACHE_NEGATIVE_TTL, poll_interval=AUTH_CACHE_POLL_INTERVAL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.poll_interval = poll_interval
+        self.version = 0  # Bumped whenever the set of authorized RFIDs changes
+
+        self._lock = threading.Lock()
+        self._authorized = {}  # rfid -> resident name
+        self._refused = {}     # rfid -> expiry (monotonic clock)
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._fingerprint = None
+        self._fingerprint_connection = None
+
+    def lookup(self, rfid_tag):
+        """ Returns True or False for a known tag, or None when the database has to be asked. """
+        if rfid_tag in self._authorized:
+            return True
+        expires_at = self._refused.get(rfid_tag)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                return False
+            self._refused.pop(rfid_tag, None)
+        return None
+
+    def resident_name(self, rfid_tag):
+        return self._authorized.get(rfid_tag)
+
+    def authorized_rfids(self):
+        """ The RFIDs of all active residents, as of the last load. """
+        return set(self._authorized)
+
+    def needs_check(self):
+        """ True when the cache is empty or it is time to poll the database for changes. """
+        return self._loaded_at is None or time.monotonic() - self._checked_at >= self.poll_interval
+
+    def refresh_if_changed(self):
+        """ Reload the authorized RFIDs when the cards or residents changed or the TTL expired. """
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._checked_at < self.poll_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            fingerprint = self._read_fingerprint()
+            expired = self._loaded_at is None or now - self._loaded_at >= self.ttl
+            if expired or fingerprint is None or fingerprint != self._fingerprint:
+                self._load()
+                self._fingerprint = fingerprint
+
+    def invalidate(self):
+        """ Force a reload on the next lookup. """
+        self._loaded_at = None
+
+    def check(self, rfid_tag):
+        """ Look up a single tag that is not in the cache, and remember the outcome. """
+        db = SessionLocal()
+        try:
+            card = self._authorized_cards(db).filter(Card.rfid == rfid_tag).first()
+            with self._lock:
+                if card:
+                    self._authorized[rfid_tag] = card.resident.full_name
+                    self._refused.pop(rfid_tag, None)
+                    return True
+                self._refused[rfid_tag] = time.monotonic() + self.negative_ttl
+                return False
+        finally:
+            db.close()
+
+    def _load(self):
+        db = SessionLocal()
+        try:
+            authorized = {card.rfid: card.resident.full_name for card in self._authorized_cards(db).all()}
+        finally:
+            db.close()
+
+        if authorized.keys() != self._authorized.keys():
+            self.version += 1
+        self._authorized = authorized
+        # Refused tags stay refused until they expire, unless they have been authorized since
+        now = time.monotonic()
+        self._refused = {rfid: expires_at for rfid, expires_at in self._refused.items()
+                         if expires_at > now and rfid not in authorized}
+        self._loaded_at = time.monotonic()
+        logging.debug("Authorization cache loaded %s RFIDs (version %s)", len(authorized), self.version)
+
+    @staticmethod
+    def _authorized_cards(db: Session):
+        return db.query(Card).join(Resident).filter(Resident.status == ResidentStatus.ACTIVE)
+
+    def _read_fingerprint(self):
+        """
+        Hash of the cards of active residents, with their resident: it changes with any
+        change to what the cache holds, unlike counts or sums, and unlike PRAGMA data_version
+        it doesn't change with every power log written. Reads two small tables.
+        """
+        try:
+            if self._fingerprint_connection is None:
+                self._fingerprint_connection = sqlite3.connect(engine.url.database, check_same_thread=False)
+            rows = self._fingerprint_connection.execute(
+                "SELECT cards.rfid, residents.id, residents.full_name FROM cards "
+                "JOIN residents ON residents.id = cards.resident_id WHERE residents.status = ? "
+                "ORDER BY cards.rfid, residents.id",
+                (ResidentStatus.ACTIVE.name,)
+            )
+            digest = hashlib.sha256()
+            for row in rows:
+                digest.update(repr(row).encode())
+            return digest.digest()
+        except sqlite3.Error as e:
+            logging.warning("Could not read the authorized cards fingerprint, reloading authorization cache: %s", e)
+            self._fingerprint_connection = None
+            return None
+
+authorization_cache = AuthorizationCache()
 
 class RFIDManager:
     """ Manages the RFID authentication process. """
 
-    def __init__(self):
-        self.rfid_whitelist = set()
+    def __init__(self, cache=authorization_cache, refused_cards=refused_card_recorder):
+        self.cache = cache
+        self.refused_cards = refused_cards
+
+    async def is_authorized(self, rfid_tag, station_id=None):
+        """ Check if an RFID tag is authorized, using the shared authorization cache. """
+        logging.debug("Auth request for RFID: %s", rfid_tag)
 
-    def is_authorized(self, rfid_tag, station_id=None):
-        """ Check if an RFID tag is authorized by querying the database. """
-        logging.debug(f"Auth request for RFID: {rfid_tag}")
-        
         # Clean the RFID tag
-        rfid_tag = rfid_tag.strip().upper()
-        
+        rfid_tag = normalize_rfid(rfid_tag)
+
         try:
-            db = SessionLocal()
-            # Check if the card exists and is associated with an active resident
-            card = db.query(Card).join(Resident).filter(
-                Card.rfid == rfid_tag,
-                Resident.status == ResidentStatus.ACTIVE
-            ).first()
-            
-            if card:
-                logging.info(f"Authorization successful for RFID {rfid_tag} - Resident: {card.resident.full_name}")
-                return True
-            else:
-                logging.warning(f"Unauthorized RFID attempt: {rfid_tag} - Card not found or resident not active")
-                # Log the refused card attempt if station_id is provided
-                if station_id:
-                    try:
-                        RefusedCardService.create_refused_card(station_id, rfid_tag)
-                    except Exception as e:
-                        logging.error(f"Failed to log refused card: {str(e)}")
-                return False
-                
+            # Only a cache refresh or an unknown tag needs the database thread
+            if self.cache.needs_check():
+                await run_db(self.cache.refresh_if_changed)
+            authorized = self.cache.lookup(rfid_tag)
+            if authorized is None:
+                authorized = await run_db(self.cache.check, rfid_tag)
         except Exception as e:
-            logging.error(f"Database error during authorization check for RFID {rfid_tag}: {str(e)}")
+            logging.error("Database error during authorization check for RFID %s: %s", rfid_tag, e)
             return False
-        finally:
-            db.close()
+
+        if authorized:
+            logging.info("Authorization successful for RFID %s - Resident: %s", rfid_tag, self.cache.resident_name(rfid_tag))
+            return True
+
+        logging.warning("Unauthorized RFID attempt: %s - Card not found or resident not active", rfid_tag)
+        # Log the refused card attempt if station_id is provided; written in the background
+        if station_id:
+            self.refused_cards.record(station_id, rfid_tag)
+        return False
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from urllib.parse import quote
+from active_transactions import active_transactions
+from constants import STATUS_JSON, STATUS_STATIONS_DIRECTORY, STATUS_PUBLISH_INTERVAL
+
+class StatusPublisher:
+    """
+    Publishes the latest meter values of all charge points as JSON files for the web UIs.
+
+    Snapshots are kept in memory per station and connector. A background task
+    writes the files at most once per `interval`, and only when a snapshot
+    changed. Every file is written to a temporary file first and moved in
+    place with os.replace, so the web server never serves a half-written file.
+
+    Files:
+    - `json_path`: the most recently updated snapshot (the format the UIs read)
+    - `stations_directory`/station-<station>.json: all connectors and open transactions of one
+      station; the id is percent-encoded, so every station gets its own file
+    - `stations_directory`/index.json: the known stations and their last update
+    """
+
+    def __init__(self, json_path=STATUS_JSON, stations_directory=STATUS_STATIONS_DIRECTORY, interval=STATUS_PUBLISH_INTERVAL,
+                 transactions=active_transactions):
+        self.json_path = json_path
+        self.stations_directory = stations_directory
+        self.interval = interval
+        self.transactions = transactions
+
+        self._snapshots = {}  # station_id -> {connector_id: snapshot}
+        self._latest = None
+        self._dirty_stations = set()
+        self._task = None
+        self.forward = None  # In a worker process: sends the changes to the supervisor, which publishes them
+
+    def update(self, station_id, connector_id, snapshot):
+        """Store the latest snapshot of a connector; it is written with the next publish."""
+        connectors = self._snapshots.setdefault(station_id, {})
+        if connectors.get(connector_id) == snapshot:
+            return
+        connectors[connector_id] = snapshot
+        self._latest = snapshot
+        self._dirty_stations.add(station_id)
+        if self.forward:
+            self.forward({"type": "status", "station_id": station_id, "connector_id": connector_id, "snapshot": snapshot,
+                          "transactions": self._transactions_of(station_id)})
+
+    def touch(self, station_id):
+        """Rewrite the station's file with the next publish, e.g. when a transaction started or stopped."""
+        self._snapshots.setdefault(station_id, {})
+        self._dirty_stations.add(station_id)
+        if self.forward:
+            self.forward({"type": "transactions", "station_id": station_id, "transactions": self._transactions_of(station_id)})
+
+    def get_snapshot(self, station_id, connector_id):
+        return self._snapshots.get(station_id, {}).get(connector_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop publishing after writing any pending changes."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.publish()
+
+    async def publish(self):
+        if not self._dirty_stations:
+            return
+
+        stations = {
+            station_id: {
+                "stationId": station_id,
+                "connectors": {str(connector_id): snapshot for connector_id, snapshot in self._snapshots[station_id].items()},
+                "transactions": self._transactions_of(station_id)
+            }
+            for station_id in self._dirty_stations
+        }
+        index = self._build_index()
+        latest = self._latest
+        self._dirty_stations = set()
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_files, latest, stations, index)
+        except Exception:
+            logging.exception("Failed to publish status files.")
+            # Try these stations again with the next publish
+            self._dirty_stations.update(stations)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.publish()
+
+    def _transactions_of(self, station_id):
+        return [transaction.to_dict() for transaction in self.transactions.for_station(station_id)]
+
+    def _build_index(self):
+        return {
+            "updated": datetime.utcnow().isoformat(),
+            "stations": {
+                station_id: {
+                    "file": self._station_file_name(station_id),
+                    "timestamp": max((snapshot.get("timestamp", "") for snapshot in connectors.values()), default=""),
+                    "connectors": sorted(connectors)
+                }
+                for station_id, connectors in self._snapshots.items()
+            }
+        }
+
+    def _write_files(self, latest, stations, index):
+        if latest is not None:
+            self._write_json(self.json_path, latest)
+        if self.stations_directory:
+            for station_id, station in stations.items():
+                self._write_json(os.path.join(self.stations_directory, self._station_file_name(station_id)), station)
+            self._write_json(os.path.join(self.stations_directory, "index.json"), index)
+
+    @staticmethod
+    def _station_file_name(station_id):
+        # The prefix keeps stations off index.json (and "." or ".."), the encoding keeps "a/b" and "a_b" apart
+        return "station-" + quote(str(station_id), safe="") + ".json"
+
+    @staticmethod
+    def _write_json(path, data):
+        """Write JSON atomically: temporary file in the same directory, then os.replace."""
+        # Follow a symlink, so the file can live in a directory the controller may write to
+        path = os.path.realpath(path)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Never written in place, where the web server could serve it half written: when the
+        # directory isn't writable this raises and the stations stay dirty
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            # mkstemp creates the file owner-only; the web server has to be able to read it
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+status_publisher = StatusPublisher()
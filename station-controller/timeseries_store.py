@@ -0,0 +1,345 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+import numpy as np
+from constants import TIMESERIES_DIRECTORY, TIMESERIES_SEGMENT_SAMPLES, TIMESERIES_FLUSH_INTERVAL, TIMESERIES_OPEN_SERIES
+
+TIME_DTYPE = np.dtype("<i8")    # Milliseconds since the epoch (UTC)
+VALUE_DTYPE = np.dtype("<f8")
+EMPTY = np.iinfo(TIME_DTYPE).max  # Unused slots at the end of a segment
+
+def _safe_name(value):
+    # Percent-encoded, so different names never share a directory
+    name = quote(str(value), safe="")
+    return name.replace(".", "%2E") if name in (".", "..") else name
+
+def to_millis(timestamp):
+    """ Epoch milliseconds of an OCPP timestamp (ISO 8601 string) or a datetime. """
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+class Segment:
+    """
+    A fixed number of samples of one series: a time column and a value column,
+    each a preallocated memory-mapped file. Times only go up, so the time column
+    is the segment's index; unused slots hold EMPTY.
+
+    Each column keeps a file descriptor open until the segment is closed and the
+    views returned by slice() are released.
+    """
+
+    def __init__(self, path, writable):
+        self.path = path
+        self.start = int(os.path.basename(path))
+        mode = "r+" if writable else "r"
+        self.times = np.memmap(path + ".t", dtype=TIME_DTYPE, mode=mode)
+        self.values = np.memmap(path + ".v", dtype=VALUE_DTYPE, mode=mode)
+        self.writable = writable
+        self.count = int(np.searchsorted(self.times, EMPTY))
+        self.dirty = False
+
+    @classmethod
+    def create(cls, path, capacity):
+        times = np.memmap(path + ".t", dtype=TIME_DTYPE, mode="w+", shape=(capacity,))
+        times[:] = EMPTY
+        times.flush()
+        np.memmap(path + ".v", dtype=VALUE_DTYPE, mode="w+", shape=(capacity,)).flush()
+        del times
+        return cls(path, writable=True)
+
+    @property
+    def full(self):
+        return self.count >= len(self.times)
+
+    @property
+    def end(self):
+        """ Time of the last sample, or None when the segment is empty. """
+        return int(self.times[self.count - 1]) if self.count else None
+
+    def append(self, time_ms, value):
+        # The value goes first, so a reader never sees a time without its value
+        self.values[self.count] = value
+        self.times[self.count] = time_ms
+        self.count += 1
+        self.dirty = True
+
+    def slice(self, start_ms, end_ms):
+        """ Views (no copies) of the samples with start_ms <= time < end_ms. """
+        if not self.writable:
+            # The controller may have appended since this reader opened the segment
+            self.count = int(np.searchsorted(self.times, EMPTY))
+        times = self.times[:self.count]
+        first = int(np.searchsorted(times, start_ms, side="left"))
+        last = int(np.searchsorted(times, end_ms, side="left"))
+        return np.asarray(times[first:last]), np.asarray(self.values[first:last])
+
+    def flush(self):
+        if self.dirty:
+            self.values.flush()
+            self.times.flush()
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+        self.times = self.values = None
+
+class Series:
+    """
+    All segments of one (station, connector, measurand, phase), in time order.
+    Only the last segment is kept open, for appending; the others are opened
+    read-only for the reads that need them.
+    """
+
+    def __init__(self, directory, writable=False, unit=None, capacity=TIMESERIES_SEGMENT_SAMPLES):
+        self.directory = directory
+        self.writable = writable
+        self.capacity = capacity
+        self.unit = unit
+        self._tail = None  # The last segment, opened on first use
+
+        meta_path = os.path.join(directory, "series.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as file:
+                self.unit = json.load(file).get("unit")
+        elif writable:
+            os.makedirs(directory, exist_ok=True)
+            with open(meta_path, "w", encoding="utf-8") as file:
+                json.dump({"unit": unit}, file)
+
+        self.starts = self._list_segments()
+
+    def _list_segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name[:-2]) for name in os.listdir(self.directory) if name.endswith(".t"))
+
+    def _tail_segment(self):
+        if self._tail is None and self.starts:
+            self._tail = Segment(os.path.join(self.directory, str(self.starts[-1])), self.writable)
+        return self._tail
+
+    def append(self, time_ms, value):
+        """ Append a sample; samples older than the last one are dropped. Returns True when stored. """
+        segment = self._tail_segment()
+        if segment is not None and segment.count and time_ms < segment.end:
+            return False
+        if segment is None or segment.full:
+            if segment is not None:
+                segment.close()
+            segment = self._tail = Segment.create(os.path.join(self.directory, str(time_ms)), self.capacity)
+            self.starts.append(time_ms)
+        segment.append(time_ms, value)
+        return True
+
+    def range_segments(self, start_ms, end_ms):
+        """ Per segment, views of the times and values with start_ms <= time < end_ms. """
+        if not self.writable:
+            self.starts = self._list_segments()
+        # Segments starting before start_ms may still hold samples in the range
+        first = max(0, bisect.bisect_right(self.starts, start_ms) - 1)
+        last = bisect.bisect_left(self.starts, end_ms)
+        for start in self.starts[first:last]:
+            if self.writable and start == self.starts[-1]:
+                segment = self._tail_segment()
+            else:
+                segment = Segment(os.path.join(self.directory, str(start)), writable=False)
+            times, values = segment.slice(start_ms, end_ms)
+            if segment is not self._tail:
+                segment.close()
+            if len(times):
+                yield times, values
+
+    def range(self, start_ms, end_ms):
+        """
+        Times and values with start_ms <= time < end_ms. These are views of the
+        memory-mapped files when the range lies in one segment; only a range
+        spanning segments is copied into new arrays.
+        """
+        parts = list(self.range_segments(start_ms, end_ms))
+        if not parts:
+            return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=VALUE_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([times for times, _ in parts]), np.concatenate([values for _, values in parts])
+
+    def downsample(self, start_ms, end_ms, bucket_ms, how="mean"):
+        """
+        Aggregate the samples in [start_ms, end_ms) into buckets of bucket_ms.
+        Returns the start of each non-empty bucket and its mean, min, max or last value.
+        """
+        if how not in ("mean", "min", "max", "last"):
+            raise ValueError(f"Unknown aggregation: {how}")
+
+        parts = []
+        for times, values in self.range_segments(start_ms, end_ms):
+            parts.append(self._aggregate((times - start_ms) // bucket_ms, values))
+        if not parts:
+            return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=VALUE_DTYPE)
+
+        buckets, sums, counts, minima, maxima, lasts = (np.concatenate(column) for column in zip(*parts))
+        if len(parts) > 1:
+            # A bucket spanning two segments has a partial aggregate from each: combine them
+            offsets = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+            ends = np.concatenate((offsets[1:], [len(buckets)])) - 1
+            buckets, sums, counts = buckets[offsets], np.add.reduceat(sums, offsets), np.add.reduceat(counts, offsets)
+            minima, maxima = np.minimum.reduceat(minima, offsets), np.maximum.reduceat(maxima, offsets)
+            lasts = lasts[ends]
+
+        aggregate = {"mean": lambda: sums / counts, "min": lambda: minima, "max": lambda: maxima, "last": lambda: lasts}[how]()
+        return start_ms + buckets * bucket_ms, aggregate
+
+    @staticmethod
+    def _aggregate(buckets, values):
+        """ Sum, count, min, max and last value per bucket of one segment's samples. """
+        # Times are sorted, so every bucket is one run of samples
+        offsets = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.concatenate((offsets[1:], [len(values)]))
+        return (
+            buckets[offsets],
+            np.add.reduceat(values, offsets),
+            ends - offsets,
+            np.minimum.reduceat(values, offsets),
+            np.maximum.reduceat(values, offsets),
+            values[ends - 1],
+        )
+
+    def flush(self):
+        if self._tail is not None:
+            self._tail.flush()
+
+    def close(self):
+        """ Flush and close the open segment; it is opened again when needed. """
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+
+class TimeSeriesStore:
+    """
+    Columnar store for the numeric meter samples of all stations.
+
+    Every (station, connector, measurand, phase) is a series in its own directory:
+    <directory>/<station>/<connector>/<measurand>[.<phase>]/, holding append-only
+    segments of TIMESERIES_SEGMENT_SAMPLES samples (<start time>.t and .v). The
+    controller only queues the samples in memory on the event loop; every
+    `flush_interval` they are written in the executor, which also creates new
+    series and segments, and dirty segments are flushed to disk. Only the
+    `open_series` series written to last keep their last segment open, so the
+    number of open files does not grow with the number of stations. Readers, e.g.
+    analytics scripts, open the store read-only and get NumPy views of the files.
+    """
+
+    def __init__(self, directory=TIMESERIES_DIRECTORY, writable=False, flush_interval=TIMESERIES_FLUSH_INTERVAL,
+                 capacity=TIMESERIES_SEGMENT_SAMPLES, open_series=TIMESERIES_OPEN_SERIES):
+        self.directory = directory
+        self.writable = writable
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.open_series = open_series
+        self._series = {}  # (station_id, connector_id, measurand, phase) -> Series
+        self._open = OrderedDict()  # Series with an open segment, least recently written first
+        self._pending = []  # (station_id, connector_id, measurand, phase, unit, time_ms, value), not yet written
+        self._task = None
+
+    def series(self, station_id, connector_id, measurand, phase=None, unit=None):
+        key = (station_id, connector_id, measurand, phase or None)
+        series = self._series.get(key)
+        if series is None:
+            name = f"{measurand}.{phase}" if phase else measurand
+            directory = os.path.join(self.directory, _safe_name(station_id), _safe_name(connector_id), _safe_name(name))
+            series = Series(directory, self.writable, unit, self.capacity)
+            self._series[key] = series
+        return series
+
+    def append_meter_values(self, station_id, connector_id, meter_values):
+        """ Queue every numeric sample of a MeterValues request. Returns the number of samples queued. """
+        queued = 0
+        for meter_value in meter_values:
+            try:
+                time_ms = to_millis(meter_value.get("timestamp", ""))
+            except (ValueError, TypeError):
+                logging.debug("Skipping meter value without a valid timestamp: %s", meter_value)
+                continue
+            for sample in meter_value.get("sampled_value", []):
+                if sample.get("format") == "SignedData":
+                    continue
+                try:
+                    value = float(sample.get("value"))
+                except (ValueError, TypeError):
+                    continue
+                measurand = sample.get("measurand", "Energy.Active.Import.Register")
+                self._pending.append((station_id, connector_id, measurand, sample.get("phase"), sample.get("unit", ""), time_ms, value))
+                queued += 1
+        return queued
+
+    def write(self, samples):
+        """
+        Append queued samples to their series and flush; disk I/O, so it runs in the
+        executor. The samples that were appended are removed from the list, also when
+        it raises, so the caller can queue the rest again.
+        """
+        stored = 0
+        written = 0
+        try:
+            for station_id, connector_id, measurand, phase, unit, time_ms, value in samples:
+                series = self.series(station_id, connector_id, measurand, phase, unit)
+                if series.unit != unit:
+                    logging.warning("Skipping %s %s sample of %s: unit %s, the series is in %s",
+                                    measurand, phase or "", station_id, unit, series.unit)
+                else:
+                    if series.append(time_ms, value):
+                        stored += 1
+                    self._opened(series)
+                written += 1
+        finally:
+            del samples[:written]
+        self.flush()
+        return stored
+
+    def _opened(self, series):
+        self._open[series.directory] = series
+        self._open.move_to_end(series.directory)
+        while len(self._open) > self.open_series:
+            self._open.popitem(last=False)[1].close()
+
+    def _take_pending(self):
+        samples, self._pending = self._pending, []
+        return samples
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.write, self._take_pending())
+
+    def flush(self):
+        for series in list(self._open.values()):
+            series.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            samples = self._take_pending()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.write, samples)
+            except Exception as e:
+                # The samples that were not appended go first again, so the series stay in time order
+                self._pending[:0] = samples
+                logging.error("❌ Error flushing the time series store, %d samples kept for the next flush: %s", len(samples), e)
+
+timeseries_store = TimeSeriesStore(writable=True)
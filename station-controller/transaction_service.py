@@ -1,23 +1,39 @@
+from datetime import datetime
+from sqlalchemy import func, update
 from models import ChargeTransaction
 from database import SessionLocal
 
 class TransactionService:
     @staticmethod
-    def create_transaction(station_id: str, rfid: str) -> ChargeTransaction:
-        """Create a new charge transaction in the database."""
+    def stop_statement(transaction_id: int, meter_stop: int, stopped: datetime, reason: str = None, last_energy_kwh: float = None):
+        """
+        UPDATE closing a transaction with its final figures. The delivered energy is
+        meter_stop - meter_start (Wh); when meter_start is unknown, e.g. for
+        transactions started before it was stored, the last metered energy is kept
+        as final energy.
+        """
+        energy_delivered_kwh = (meter_stop - ChargeTransaction.meter_start) / 1000.0
+        return (
+            update(ChargeTransaction)
+            .where(ChargeTransaction.id == transaction_id)
+            .values(
+                stopped=stopped,
+                meter_stop=meter_stop,
+                stop_reason=reason,
+                energy_delivered_kwh=energy_delivered_kwh,
+                final_energy_kwh=func.coalesce(energy_delivered_kwh, last_energy_kwh, ChargeTransaction.final_energy_kwh)
+            )
+        )
+
+    @staticmethod
+    def get_max_transaction_id() -> int:
+        """Get the highest transaction ID in the database, 0 when there are none."""
         db = SessionLocal()
         try:
-            transaction = ChargeTransaction(
-                station_id=station_id,
-                rfid=rfid
-            )
-            db.add(transaction)
-            db.commit()
-            db.refresh(transaction)
-            return transaction
+            return db.query(func.max(ChargeTransaction.id)).scalar() or 0
         finally:
             db.close()
-    
+
     @staticmethod
     def get_transaction_by_id(transaction_id: int) -> ChargeTransaction:
         """Get a transaction by its ID."""
@@ -43,4 +59,18 @@ class TransactionService:
         try:
             return db.query(ChargeTransaction).filter(ChargeTransaction.rfid == rfid).all()
         finally:
-            db.close() 
\ No newline at end of file
+            db.close()
+
+    @staticmethod
+    def get_open_transactions(since: datetime) -> list[ChargeTransaction]:
+        """Get the transactions created since the given time that have not been stopped, oldest first."""
+        db = SessionLocal()
+        try:
+            return (
+                db.query(ChargeTransaction)
+                .filter(ChargeTransaction.created >= since, ChargeTransaction.stopped.is_(None))
+                .order_by(ChargeTransaction.id)
+                .all()
+            )
+        finally:
+            db.close()
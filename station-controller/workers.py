@@ -0,0 +1,548 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import zlib
+from ocpp.v16 import call, call_result
+from ocpp.v16.enums import ChargingRateUnitType
+from websockets.asyncio.server import Server, ServerConnection
+from websockets.server import ServerProtocol
+from websockets.typing import Subprotocol
+from charge_point_registry import connected_charge_points
+from init_db import init_database
+from database import engine
+from persistence import run_db, shutdown_db_executor
+from event_journal import EventJournal, event_journal
+from local_auth_list import local_auth_list
+from refused_card_service import refused_card_recorder
+from status_publisher import status_publisher
+from loggers.meter_values_log import meter_values_log
+from timeseries_store import timeseries_store
+from active_transactions import active_transactions
+from p1_monitor import P1Monitor
+from load_balancer import SiteLoadBalancer
+from metrics import LoopLagMonitor, MetricsServer
+from logging_setup import setup_logging, stop_logging, station_logger
+from constants import (
+    WEBSOCKET_HOST, WEBSOCKET_PORT, WORKER_HANDSHAKE_TIMEOUT, WORKER_REQUEST_TIMEOUT, EVENT_JOURNAL_DIRECTORY,
+    EVENT_JOURNAL_NAME, METER_ARCHIVE_DIRECTORY, LOAD_BALANCING_ENABLED, METRICS_ENABLED, METRICS_PORT,
+    LOCAL_AUTH_LIST_ENABLED, LOG_FILE
+)
+
+WORKER_PREFIX = "worker-"
+CHANNEL_LIMIT = 16 * 1024 * 1024  # Longest message between the supervisor and a worker
+PEEK_BYTES = 4096                 # The websocket request line must fit in this
+PEEK_INTERVAL = 0.01              # Seconds between looks at a request line that arrived in part
+
+def worker_index(path_id, count):
+    """ The worker of a station, by the ID in its websocket path, so a station always lands on the same worker. """
+    return zlib.crc32(path_id.encode()) % count
+
+def worker_directory(directory, index):
+    return os.path.join(directory, f"{WORKER_PREFIX}{index}")
+
+async def replay_worker_journals(directory=EVENT_JOURNAL_DIRECTORY):
+    """
+    Apply what the event journals of the worker processes of a previous run
+    (<directory>/worker-<n>/) didn't store yet. Runs before any journal is
+    opened, so the transaction ids they allocated are in the database.
+    """
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not (name.startswith(WORKER_PREFIX) and os.path.isdir(path)):
+            continue
+        journal = EventJournal(directory=path, name=f"{EVENT_JOURNAL_NAME}-{name}")
+        await journal.open()
+        await journal.replay()
+        await journal.stop()
+
+class Channel:
+    """
+    JSON messages, one per line, between the supervisor and a worker over a socket pair.
+
+    Either side can send a request and await its result: the request gets an
+    "id" and the other side answers with {"type": "result", "id", "result"}.
+    """
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+        self._reader = None
+        self._writer = None
+        self._next_id = 0
+        self._requests = {}  # id -> future of the result
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.open_connection(sock=self.sock, limit=CHANNEL_LIMIT)
+
+    def send(self, message):
+        if self._writer is None or self._writer.is_closing():
+            return
+        self._writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+    async def request(self, message, timeout=WORKER_REQUEST_TIMEOUT):
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        try:
+            self.send({**message, "id": request_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.pop(request_id, None)
+
+    def respond(self, request, result):
+        self.send({"type": "result", "id": request["id"], "result": result})
+
+    async def run(self, handle):
+        """ Pass every message but the results to `handle`, until the other side closes the channel. """
+        while line := await self._reader.readline():
+            try:
+                message = json.loads(line)
+            except ValueError as e:
+                logging.error("❌ Invalid message on channel %s: %s", self.name, e)
+                continue
+            if message.get("type") == "result":
+                future = self._requests.get(message.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(message.get("result"))
+                continue
+            try:
+                handle(message)
+            except Exception as e:
+                logging.error("❌ Error handling %s message on channel %s: %s", message.get("type"), self.name, e)
+        for future in self._requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Channel {self.name} closed"))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+class RemoteLimitSender:
+    """ The ChargingLimitSender of a station in a worker process, as far as the load balancer uses it. """
+
+    def __init__(self, charge_point):
+        self.cp = charge_point
+        self._targets = {}  # connector_id -> (transaction_id, last limit submitted for it)
+        self._pending = 0
+
+    def submit(self, connector_id, limit, unit=ChargingRateUnitType.amps):
+        target = (self._transaction_id(connector_id), limit)
+        self._targets[connector_id] = target
+        return asyncio.ensure_future(self._submit(connector_id, target, unit))
+
+    def target_limit(self, connector_id):
+        # A limit submitted in an earlier transaction doesn't apply to the current one
+        target = self._targets.get(connector_id)
+        return target[1] if target is not None and target[0] == self._transaction_id(connector_id) else None
+
+    def _transaction_id(self, connector_id):
+        transaction = active_transactions.for_connector(self.cp.id, connector_id)
+        return transaction.transaction_id if transaction is not None else None
+
+    def is_busy(self):
+        return self._pending > 0
+
+    async def stop(self):
+        self._targets.clear()
+
+    async def _submit(self, connector_id, target, unit):
+        limit = target[1]
+        self._pending += 1
+        try:
+            accepted = await self.cp.channel.request({
+                "type": "limit", "station_id": self.cp.id, "connector_id": connector_id, "limit": limit, "unit": unit
+            })
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.cp.log.warning("Limit %s for connector %s not confirmed by the worker: %s", limit, connector_id, e)
+            accepted = False
+        finally:
+            self._pending -= 1
+        if not accepted and self._targets.get(connector_id) == target:
+            # Unknown what the station has now: send the next limit regardless
+            del self._targets[connector_id]
+        return bool(accepted)
+
+class RemoteChargePoint:
+    """
+    Stand-in in the supervisor for a charge point connected to a worker process.
+    Calls are sent to the station by the worker.
+    """
+
+    def __init__(self, id, channel):
+        self.id = id
+        self.channel = channel
+        self.limit_sender = RemoteLimitSender(self)
+
+    @property
+    def log(self):
+        return station_logger(self.id)
+
+    async def call(self, payload):
+        """ Send a call to the station; None when it failed, like ChargePoint.call. """
+        action = type(payload).__name__
+        try:
+            response = await self.channel.request({
+                "type": "call", "station_id": self.id, "action": action, "payload": dataclasses.asdict(payload)
+            })
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.log.warning("%s not answered by the worker: %s", action, e)
+            return None
+        if response is None:
+            return None
+        return getattr(call_result, action)(**response)
+
+class Supervisor:
+    """
+    Runs the station controller as one supervisor process and `count` worker processes.
+
+    The workers each run the OCPP websockets of their share of the stations:
+    the handlers, event journal, meter archive and time series. The supervisor
+    accepts the websocket connections, reads the request line and passes the
+    socket to the worker of the station (see `worker_index`), so a station
+    always reconnects to the same worker. It runs what needs all stations: the
+    status files, the load balancer and the local authorization list. The
+    workers report their connected stations, open transactions and meter
+    snapshots to it, and it sends calls and charging limits to the stations
+    through their worker.
+
+    Every worker has its own event journal (<journal directory>/worker-<n>/) and
+    allocates the transaction ids n (mod count). The supervisor applies the
+    journals of the previous run before the workers start.
+    """
+
+    def __init__(self, count, host=WEBSOCKET_HOST, port=WEBSOCKET_PORT):
+        self.count = count
+        self.host = host
+        self.port = port
+        self.processes = []
+        self.channels = []
+        self._channel_sockets = []
+        self._fd_sockets = []
+        self._stations = {}  # worker index -> station IDs connected to it
+        self._dispatches = set()
+
+    def spawn(self):
+        """ Start the worker processes. Call this before the supervisor starts any threads; the workers are forked. """
+        context = multiprocessing.get_context("fork")
+        for index in range(self.count):
+            channel_parent, channel_child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            fd_parent, fd_child = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            inherited = self._channel_sockets + self._fd_sockets + [channel_parent, fd_parent]
+            process = context.Process(
+                target=_run_worker, args=(index, self.count, channel_child, fd_child, inherited),
+                name=f"{WORKER_PREFIX}{index}", daemon=True
+            )
+            process.start()
+            channel_child.close()
+            fd_child.close()
+            self.processes.append(process)
+            self._channel_sockets.append(channel_parent)
+            self._fd_sockets.append(fd_parent)
+
+    async def run(self):
+        setup_logging()
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        init_database()
+        logging.info("Database initialized")
+        # Everything the previous run journaled is in the database before the workers open their journals
+        await event_journal.open()
+        await event_journal.replay()
+        await event_journal.stop()
+        await replay_worker_journals()
+        await run_db(active_transactions.load)
+
+        readers = []
+        for index, sock in enumerate(self._channel_sockets):
+            channel = Channel(sock, f"{WORKER_PREFIX}{index}")
+            await channel.open()
+            self.channels.append(channel)
+            readers.append(asyncio.create_task(channel.run(lambda message, index=index: self._handle(index, message))))
+        for channel in self.channels:
+            channel.send({"type": "ready"})
+
+        status_publisher.start()
+        if LOCAL_AUTH_LIST_ENABLED:
+            local_auth_list.load()
+            local_auth_list.start()
+
+        loop_lag_monitor = LoopLagMonitor()
+        metrics_server = MetricsServer()
+        if METRICS_ENABLED:
+            loop_lag_monitor.start()
+            await metrics_server.start()
+
+        p1_monitor = P1Monitor()
+        load_balancer = SiteLoadBalancer(p1_monitor)
+        if LOAD_BALANCING_ENABLED:
+            p1_monitor.start()
+            load_balancer.start()
+
+        listener = socket.create_server((self.host, self.port))
+        listener.setblocking(False)
+        accepting = asyncio.create_task(self._accept(listener))
+        logging.info("WebSocket Server Started on ws://%s:%s with %s workers", self.host, self.port, self.count)
+        try:
+            waiters = [asyncio.create_task(stopped.wait()), accepting, *readers]
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for reader in readers:
+                if reader in done:
+                    logging.error("❌ Worker %s stopped, stopping the station controller", readers.index(reader))
+            if accepting in done:
+                accepting.result()
+        finally:
+            accepting.cancel()
+            listener.close()
+            for task in [*self._dispatches]:
+                task.cancel()
+            await metrics_server.stop()
+            await loop_lag_monitor.stop()
+            await load_balancer.stop()
+            await p1_monitor.stop()
+            await local_auth_list.stop()
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+            await loop.run_in_executor(None, self._join)
+            for reader in readers:
+                reader.cancel()
+            for channel in self.channels:
+                channel.close()
+            await status_publisher.stop()
+            shutdown_db_executor()
+            stop_logging()
+
+    def _join(self):
+        for process in self.processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    async def _accept(self, listener):
+        loop = asyncio.get_running_loop()
+        while True:
+            sock, _ = await loop.sock_accept(listener)
+            task = asyncio.create_task(self._dispatch(sock))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, sock):
+        """ Pass a new connection to the worker of its station. """
+        try:
+            path = await asyncio.wait_for(self._peek_path(sock), WORKER_HANDSHAKE_TIMEOUT)
+            if path is None:
+                return
+            index = worker_index(path.strip('/'), self.count)
+            socket.send_fds(self._fd_sockets[index], [b"c"], [sock.fileno()])
+            logging.debug("Connection for %s passed to worker %s", path, index)
+        except asyncio.TimeoutError:
+            logging.info("No websocket request received within %ss, closing the connection", WORKER_HANDSHAKE_TIMEOUT)
+        except OSError as e:
+            logging.error("❌ Could not pass a connection to a worker: %s", e)
+        finally:
+            # The worker has its own copy of the socket
+            sock.close()
+
+    @staticmethod
+    async def _peek_path(sock):
+        """ The path of the websocket request, read without taking it off the socket; None when it closed first. """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = sock.recv(PEEK_BYTES, socket.MSG_PEEK)
+            except BlockingIOError:
+                readable = loop.create_future()
+                loop.add_reader(sock.fileno(), lambda: readable.done() or readable.set_result(None))
+                try:
+                    await readable
+                finally:
+                    loop.remove_reader(sock.fileno())
+                continue
+            if not data:
+                return None
+            if b"\n" in data or len(data) >= PEEK_BYTES:
+                parts = data.split(b"\n", 1)[0].decode("latin-1").split()
+                return parts[1] if len(parts) > 1 else ""
+            await asyncio.sleep(PEEK_INTERVAL)
+
+    def _handle(self, index, message):
+        kind = message.get("type")
+        if kind == "stations":
+            self._update_stations(index, set(message["station_ids"]))
+        elif kind == "status":
+            active_transactions.replace_station(message["station_id"], message["transactions"])
+            status_publisher.update(message["station_id"], message["connector_id"], message["snapshot"])
+        elif kind == "transactions":
+            active_transactions.replace_station(message["station_id"], message["transactions"])
+            status_publisher.touch(message["station_id"])
+        else:
+            logging.error("❌ Unknown message %s from worker %s", kind, index)
+
+    def _update_stations(self, index, station_ids):
+        """ Mirror the stations connected to a worker in the registry, for the load balancer and the local list. """
+        previous = self._stations.get(index, set())
+        self._stations[index] = station_ids
+        for station_id in previous - station_ids:
+            charge_point = connected_charge_points.get(station_id)
+            if isinstance(charge_point, RemoteChargePoint) and charge_point.channel is self.channels[index]:
+                connected_charge_points.unregister(charge_point)
+        for station_id in station_ids - previous:
+            charge_point = RemoteChargePoint(station_id, self.channels[index])
+            connected_charge_points.register(charge_point)
+            if LOCAL_AUTH_LIST_ENABLED:
+                local_auth_list.station_connected(charge_point)
+
+def _run_worker(index, count, channel_sock, fd_sock, inherited):
+    # The supervisor's ends of the socket pairs; a worker only sees its channel close when the supervisor's end is closed
+    for sock in inherited:
+        sock.close()
+    Worker(index, count, channel_sock, fd_sock).run()
+
+class Worker:
+    """ A worker process of the Supervisor: runs the websockets of the stations the supervisor passes to it. """
+
+    def __init__(self, index, count, channel_sock, fd_sock):
+        self.index = index
+        self.count = count
+        self.channel = Channel(channel_sock, "supervisor")
+        self.fd_sock = fd_sock
+        self._ready = None
+        self._tasks = set()
+
+    def run(self):
+        # Connections of the database pool created before the fork belong to the supervisor
+        engine.dispose(close=False)
+        asyncio.run(self._main())
+
+    async def _main(self):
+        # Imported here: main runs the Supervisor
+        from main import on_connect
+
+        setup_logging(log_file=f"{LOG_FILE}.{WORKER_PREFIX}{self.index}" if LOG_FILE else None)
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        self._ready = asyncio.Event()
+        await self.channel.open()
+        reader = asyncio.create_task(self.channel.run(self._handle))
+        await asyncio.wait([asyncio.create_task(self._ready.wait()), reader], return_when=asyncio.FIRST_COMPLETED)
+        if not self._ready.is_set():
+            return
+
+        event_journal.directory = worker_directory(EVENT_JOURNAL_DIRECTORY, self.index)
+        event_journal.name = f"{EVENT_JOURNAL_NAME}-{WORKER_PREFIX}{self.index}"
+        event_journal.id_stride = self.count
+        event_journal.id_offset = self.index
+        meter_values_log.directory = worker_directory(METER_ARCHIVE_DIRECTORY, self.index)
+
+        await event_journal.open()
+        await event_journal.replay()
+        await run_db(active_transactions.load)
+        event_journal.start()
+        meter_values_log.start()
+        timeseries_store.start()
+        status_publisher.forward = self.channel.send
+        connected_charge_points.listeners.append(self._send_stations)
+
+        loop_lag_monitor = LoopLagMonitor()
+        metrics_server = MetricsServer(port=METRICS_PORT + 1 + self.index, refused_cards=refused_card_recorder)
+        if METRICS_ENABLED:
+            loop_lag_monitor.start()
+            await metrics_server.start()
+
+        server = Server(on_connect)
+        factory = lambda: ServerConnection(ServerProtocol(subprotocols=[Subprotocol("ocpp1.6")]), server)
+        # websockets wants an asyncio server; it listens on an unnamed socket, the connections come from the supervisor
+        unnamed = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unnamed.bind("")
+        server.wrap(await loop.create_unix_server(factory, sock=unnamed))
+        self.fd_sock.setblocking(False)
+        loop.add_reader(self.fd_sock.fileno(), self._receive_connections, factory, stopped)
+        logging.info("Worker %s started", self.index)
+        try:
+            await asyncio.wait([asyncio.create_task(stopped.wait()), reader], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            loop.remove_reader(self.fd_sock.fileno())
+            server.close()
+            await server.wait_closed()
+            await metrics_server.stop()
+            await loop_lag_monitor.stop()
+            await meter_values_log.stop()
+            await timeseries_store.stop()
+            await event_journal.stop()
+            reader.cancel()
+            self.channel.close()
+            shutdown_db_executor()
+            stop_logging()
+
+    def _receive_connections(self, factory, stopped):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                _, fds, _, _ = socket.recv_fds(self.fd_sock, 16, 8)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logging.error("❌ Could not receive a connection from the supervisor: %s", e)
+                stopped.set()
+                return
+            for fd in fds:
+                sock = socket.socket(fileno=fd)
+                sock.setblocking(False)
+                self._spawn(loop.connect_accepted_socket(factory, sock))
+
+    def _send_stations(self):
+        self.channel.send({"type": "stations", "station_ids": connected_charge_points.station_ids()})
+
+    def _handle(self, message):
+        kind = message.get("type")
+        if kind == "ready":
+            self._ready.set()
+        elif kind == "call":
+            self._spawn(self._call(message))
+        elif kind == "limit":
+            self._spawn(self._limit(message))
+        else:
+            logging.error("❌ Unknown message %s from the supervisor", kind)
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, message):
+        result = None
+        charge_point = connected_charge_points.get(message["station_id"])
+        try:
+            if charge_point is None:
+                logging.warning("%s for %s, which is not connected to worker %s", message["action"], message["station_id"], self.index)
+            else:
+                response = await charge_point.call(getattr(call, message["action"])(**message["payload"]))
+                result = dataclasses.asdict(response) if response is not None else None
+        except Exception as e:
+            logging.error("❌ %s for %s failed: %s", message["action"], message["station_id"], e)
+        self.channel.respond(message, result)
+
+    async def _limit(self, message):
+        accepted = False
+        charge_point = connected_charge_points.get(message["station_id"])
+        try:
+            if charge_point is not None:
+                accepted = await charge_point.limit_sender.submit(message["connector_id"], message["limit"], message["unit"])
+        except Exception as e:
+            logging.error("❌ Limit for %s failed: %s", message["station_id"], e)
+        self.channel.respond(message, accepted)